@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+
+# -*- coding:utf-8 -*-
+
+# Copyright (C) 2012 Juan Carlos Moreno <juancarlos.moreno at ecmanaged.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Short lived cache of fetched status data shared by the checks of a runner.
+
+Keys identify a source and query (driver, host, port, user, database,
+command or HTTP method, URL...). Values expire after a TTL of about one
+scheduling tick and the least recently used entries are evicted over
+the size limit. Concurrent fetches of the same key wait for the first
+one, so a source is queried once and its response fanned out to every
+check reading it. Cached values are shared: callers must not change them.
+"""
+
+CACHE_SIZE = 256
+CACHE_TTL = 2
+
+import threading
+
+from collections import OrderedDict
+from time import time
+
+# Key not in cache, None is a valid value
+_missing = object()
+
+
+class FetchCache:
+    def __init__(self, size=CACHE_SIZE, ttl=CACHE_TTL):
+        self.size = size
+        self.ttl = ttl
+
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+        # One lock per key being fetched
+        self.fetching = {}
+
+        self._reset_stats()
+
+    def _reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self.lock:
+            value = self._get(key)
+
+            if value is _missing:
+                self.misses += 1
+                return default
+
+            self.hits += 1
+            return value
+
+    def put(self, key, value, ttl=None):
+        with self.lock:
+            self._put(key, value, ttl)
+
+    def fetch(self, key, func, ttl=None):
+        """
+        Cached value of key, or call func() once for all callers waiting
+        on the same key. Exceptions are not cached: the next waiter calls
+        func() itself.
+
+        @return: value
+        """
+        with self.lock:
+            value = self._get(key)
+            if value is not _missing:
+                self.hits += 1
+                return value
+
+            key_lock = self.fetching.setdefault(key, [threading.Lock(), 0])
+            key_lock[1] += 1
+
+        try:
+            with key_lock[0]:
+                # Filled while waiting
+                with self.lock:
+                    value = self._get(key)
+                    if value is not _missing:
+                        self.hits += 1
+                        return value
+
+                    self.misses += 1
+
+                value = func()
+                self.put(key, value, ttl)
+                return value
+
+        finally:
+            with self.lock:
+                key_lock[1] -= 1
+                if not key_lock[1]:
+                    self.fetching.pop(key, None)
+
+    def stats(self, reset=True):
+        """
+        @return: hit and miss counts since last call
+        """
+        with self.lock:
+            retval = {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self.entries)
+            }
+
+            if reset:
+                self._reset_stats()
+
+        return retval
+
+    def _get(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return _missing
+
+        if entry[0] < time():
+            return _missing
+
+        # Most recently used last
+        self.entries[key] = entry
+        return entry[1]
+
+    def _put(self, key, value, ttl):
+        self.entries.pop(key, None)
+        self.entries[key] = (time() + (self.ttl if ttl is None else ttl), value)
+
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
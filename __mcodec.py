@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+
+# -*- coding:utf-8 -*-
+
+# Copyright (C) 2012 Juan Carlos Moreno <juancarlos.moreno at ecmanaged.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+JSON codec used for data.json, counters and result lines.
+
+The fastest module available is picked once at import: ujson when
+installed, otherwise the standard library json and its C speedups.
+simplejson decodes a few microseconds faster but its import (decimal)
+costs more than that on every cold start. Output is always ASCII.
+
+Results are written by encode(), which preserves numbers and decodes
+byte strings as UTF-8 at any depth in the same pass.
+"""
+
+# Deeper containers are encoded as null
+ENCODE_MAX_DEPTH = 100
+
+# Result format of an installation, the compact one (see __mcompact)
+# is enabled with MPLUGIN_FORMAT=compact in the environment
+FORMAT_ENV = 'MPLUGIN_FORMAT'
+FORMAT_JSON = 'json'
+FORMAT_COMPACT = 'compact'
+
+import json
+from json.encoder import encode_basestring_ascii as _quote
+
+import logging
+log = logging
+
+
+def _pick_codec():
+    """
+    @return: (name, loads, dumps)
+    """
+    try:
+        import ujson
+        return 'ujson', ujson.loads, lambda obj: ujson.dumps(obj, ensure_ascii=True, double_precision=15)
+
+    except ImportError:
+        pass
+
+    return 'json', json.loads, json.dumps
+
+
+CODEC_NAME, _loads, _dumps = _pick_codec()
+
+
+def _to_unicode(obj, depth=0):
+    """
+    Copy of obj with byte strings decoded as UTF-8, invalid bytes dropped
+    """
+    if depth > 100:
+        return obj
+
+    if isinstance(obj, str):
+        return obj.decode('utf-8', 'ignore')
+
+    if isinstance(obj, dict):
+        return dict((_to_unicode(k, depth + 1), _to_unicode(v, depth + 1)) for k, v in obj.iteritems())
+
+    if isinstance(obj, (list, tuple)):
+        return [_to_unicode(x, depth + 1) for x in obj]
+
+    return obj
+
+
+def loads(string):
+    """
+    @raise ValueError: invalid JSON
+    """
+    return _loads(string)
+
+
+def dumps(obj):
+    """
+    @return: ASCII JSON string
+    @raise TypeError, ValueError: not serializable
+    """
+    try:
+        return str(_dumps(obj))
+
+    except (UnicodeDecodeError, OverflowError):
+        # Only pay normalisation when byte strings aren't valid UTF-8
+        return str(_dumps(_to_unicode(obj)))
+
+
+def _encode(obj, write, depth):
+    if isinstance(obj, str):
+        write(_quote(obj.decode('utf-8', 'ignore')))
+
+    elif isinstance(obj, unicode):
+        write(_quote(obj))
+
+    elif obj is None:
+        write('null')
+
+    elif obj is True:
+        write('true')
+
+    elif obj is False:
+        write('false')
+
+    elif isinstance(obj, (int, long)):
+        write('%d' % obj)
+
+    elif isinstance(obj, float):
+        # NaN and infinity are not valid JSON
+        write(repr(obj) if obj == obj and obj not in (_INF, -_INF) else 'null')
+
+    elif isinstance(obj, (dict, list, tuple)):
+        if depth >= ENCODE_MAX_DEPTH:
+            write('null')
+            return
+
+        if isinstance(obj, dict):
+            write('{')
+            first = True
+            for key, value in obj.iteritems():
+                if not first:
+                    write(', ')
+                first = False
+
+                _encode(key if isinstance(key, basestring) else _to_text(key), write, depth + 1)
+                write(': ')
+                _encode(value, write, depth + 1)
+
+            write('}')
+
+        else:
+            write('[')
+            first = True
+            for value in obj:
+                if not first:
+                    write(', ')
+                first = False
+
+                _encode(value, write, depth + 1)
+
+            write(']')
+
+    else:
+        _encode(_to_text(obj), write, depth)
+
+
+_INF = float('inf')
+
+_fast_dumps = json.JSONEncoder(allow_nan=False, default=lambda obj: _to_text(obj)).encode
+
+
+def _to_text(obj):
+    try:
+        return str(obj)
+    except UnicodeError:
+        return unicode(obj)
+
+
+def encode(obj):
+    """
+    Encode a check result: numbers are kept, byte strings are decoded
+    as UTF-8 dropping invalid bytes and anything else is stringified.
+
+    @return: ASCII JSON string
+    """
+    try:
+        # C encoder when everything is valid UTF-8 and nesting stays
+        # within the interpreter recursion limit
+        return str(_fast_dumps(obj))
+
+    except (UnicodeDecodeError, ValueError, TypeError, RuntimeError):
+        pass
+
+    buf = []
+    _encode(obj, buf.append, 0)
+
+    return ''.join(buf)
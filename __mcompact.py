@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+
+# -*- coding:utf-8 -*-
+
+# Copyright (C) 2012 Juan Carlos Moreno <juancarlos.moreno at ecmanaged.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Compact result format, enabled per installation with MPLUGIN_FORMAT=compact
+in the environment (or --format compact for the runner).
+
+Metric names are interned in a schema per plugin: the list of metric
+key paths, identified by a crc32 of its content. Records carry the
+schema id and the metric values in schema order; the schema itself is
+only included when it changes, and every SCHEMA_RESEND runs so a
+restarted consumer recovers. Records are msgpack when the module is
+available, framed by a 4 byte big endian length, otherwise compact
+JSON lines.
+
+Record keys:
+    v       format version
+    id, n   plugin id and name
+    s       state
+    m       message
+    i       interval, ni next interval if adaptive
+    d       data, dl delta section if data only holds changes
+    k       schema id, x metric values, ks schema if sent: key paths as
+            [number of leading keys shared with the previous path, keys...]
+    metrics plain metrics, for results built without a schema
+"""
+
+FORMAT_VERSION = 1
+SCHEMA_RESEND = 100
+SCHEMA_MAX_DEPTH = 100
+
+import struct
+import zlib
+
+from __mcodec import dumps as json_dumps, encode as json_encode, loads as json_loads
+from __mcodec import FORMAT_ENV, FORMAT_JSON, FORMAT_COMPACT
+
+FRAME_HEADER = struct.Struct('>I')
+
+# msgpack module or None once looked up
+_msgpack = []
+
+
+def _packer():
+    """
+    @return: msgpack module or None, imported on first use
+    """
+    if not _msgpack:
+        try:
+            import msgpack
+            _msgpack.append(msgpack)
+        except ImportError:
+            _msgpack.append(None)
+
+    return _msgpack[0]
+
+
+def schema_of(metrics):
+    """
+    Leaves of nested metric dicts, keys sorted at every level
+
+    @return: (schema id, list of key paths, list of values)
+    """
+    paths, values = [], []
+    _leaves(metrics, [], paths, values, 0)
+
+    return '%08x' % (zlib.crc32(json_dumps(paths)) & 0xffffffff), paths, values
+
+
+def _leaves(obj, prefix, paths, values, depth):
+    for key in sorted(obj):
+        value = obj[key]
+
+        if isinstance(value, dict) and value and depth < SCHEMA_MAX_DEPTH:
+            _leaves(value, prefix + [key], paths, values, depth + 1)
+
+        else:
+            paths.append(prefix + [key])
+            values.append(value)
+
+
+def pack_schema(paths):
+    """
+    @return: key paths without the prefix shared with the previous one
+    """
+    retval = []
+    previous = []
+
+    for path in paths:
+        shared = 0
+        while shared < min(len(path), len(previous)) - 1 and path[shared] == previous[shared]:
+            shared += 1
+
+        retval.append([shared] + path[shared:])
+        previous = path
+
+    return retval
+
+
+def unpack_schema(packed):
+    retval = []
+    previous = []
+
+    for item in packed:
+        previous = previous[:item[0]] + list(item[1:])
+        retval.append(previous)
+
+    return retval
+
+
+def encode(record):
+    """
+    @return: msgpack or JSON string of record, values msgpack can't
+             pack are stringified as the JSON encoder does
+    """
+    msgpack = _packer()
+    if msgpack:
+        return msgpack.packb(record, use_bin_type=False, default=str)
+
+    return json_encode(record)
+
+
+def decode(payload):
+    msgpack = _packer()
+    if msgpack:
+        return msgpack.unpackb(payload)
+
+    return json_loads(payload)
+
+
+def frame(payload):
+    """
+    @return: payload framed for a stream, an empty payload is the
+             end of batch marker
+    """
+    if _packer():
+        return FRAME_HEADER.pack(len(payload)) + payload
+
+    return payload + '\n'
+
+
+def line_frame(payload):
+    return payload + '\n'
+
+
+class Decoder:
+    """
+    Receiving side: rebuild results, keeping the last schema of every
+    plugin
+    """
+    def __init__(self):
+        self.schemas = {}
+
+    def decode(self, payload):
+        """
+        @return: result dict as to_dict() of the sender
+        @raise KeyError: schema not received yet
+        """
+        record = decode(payload)
+
+        if 'ks' in record:
+            self.schemas[(record['id'], record['k'])] = unpack_schema(record['ks'])
+
+        metrics = record.get('metrics')
+        if 'k' in record:
+            metrics = {}
+            for path, value in zip(self.schemas[(record['id'], record['k'])], record['x']):
+                parent = metrics
+                for key in path[:-1]:
+                    parent = parent.setdefault(key, {})
+                parent[path[-1]] = value
+
+        retval = {
+            'id': record.get('id'),
+            'name': record.get('n'),
+            'state': record.get('s'),
+            'message': record.get('m'),
+            'data': record.get('d', {}),
+            'metrics': metrics or {},
+            'interval': record.get('i')
+        }
+
+        if 'ni' in record:
+            retval['next_interval'] = record['ni']
+
+        if 'dl' in record:
+            retval['delta'] = record['dl']
+
+        return retval
@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+
+# -*- coding:utf-8 -*-
+
+# Copyright (C) 2012 Juan Carlos Moreno <juancarlos.moreno at ecmanaged.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Process wide cache of parsed data.json files.
+
+Entries are keyed on inode, mtime and size of the file and hold the
+parsed data, the flattened config values and a content hash computed
+when first asked (hashlib is not loaded by plain check runs). A file is
+stat()ed at most once per CONFIG_POLL_INTERVAL and only parsed again
+when it changed, so a resident runner parses each config once.
+"""
+
+CONFIG_POLL_INTERVAL = 5
+
+import threading
+
+from os import stat
+from importlib import import_module
+from time import time
+
+from __mcodec import loads as json_loads
+
+import logging
+log = logging
+
+_entries = {}
+_entries_lock = threading.Lock()
+
+
+class ConfigEntry:
+    def __init__(self, path, key=None, content=None):
+        self.path = path
+        self.key = key
+        self.checked = time()
+
+        self.data = {}
+        self.config = {}
+        self.content = content
+        self._hash = None
+
+        if content is None:
+            return
+
+        try:
+            data = json_loads(content)
+        except ValueError:
+            data = None
+
+        if not isinstance(data, dict):
+            log.warning("Invalid data in file: %s" % path)
+            return
+
+        self.data = data
+
+        # Config values by name
+        for idx, value in (data.get('config') or {}).items():
+            self.config[idx] = value.get('value', None) if isinstance(value, dict) else None
+
+    @property
+    def exists(self):
+        return self.key is not None
+
+    @property
+    def hash(self):
+        """
+        @return: content_hash() of the file, None if it doesn't exist
+        """
+        if self._hash is None and self.content is not None:
+            self._hash = content_hash(self.content)
+
+        return self._hash
+
+
+def load_config(path, poll=CONFIG_POLL_INTERVAL):
+    """
+    @param path: data.json file
+    @param poll: seconds a cached entry is trusted without stat()
+    @return: ConfigEntry, empty if the file doesn't exist
+    """
+    now = time()
+
+    entry = _entries.get(path)
+    if entry and now - entry.checked < poll:
+        return entry
+
+    try:
+        st = stat(path)
+        key = (st.st_ino, st.st_mtime, st.st_size)
+    except OSError:
+        key = None
+
+    if entry and entry.key == key:
+        entry.checked = now
+        return entry
+
+    if key is None:
+        entry = ConfigEntry(path)
+
+    else:
+        try:
+            with open(path, 'r') as f:
+                entry = ConfigEntry(path, key, f.read())
+
+        except IOError, e:
+            log.warning("Unable to read %s: %s" % (path, e))
+            entry = ConfigEntry(path)
+
+    with _entries_lock:
+        _entries[path] = entry
+
+    return entry
+
+
+def invalidate(path):
+    """
+    Forget cached entry, next load reads the file
+    """
+    with _entries_lock:
+        _entries.pop(path, None)
+
+
+def content_hash(content):
+    """
+    @return: hash comparable with ConfigEntry.hash
+    """
+    return import_module('hashlib').md5(content).hexdigest()
@@ -0,0 +1,659 @@
+#!/usr/bin/env python
+
+# -*- coding:utf-8 -*-
+
+# Copyright (C) 2012 Juan Carlos Moreno <juancarlos.moreno at ecmanaged.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Non-blocking HTTP collection for status plugins.
+
+A single select() loop drives every request of a batch, so hundreds of
+status endpoints are polled concurrently from one thread, with a bound
+on simultaneous connections per host.
+
+Requests are HTTP/1.1 with keep-alive: finished connections go back to
+a per host idle pool and later batches of the process (a runner) skip
+the TCP connect and TLS handshake.
+"""
+
+HTTP_TIMEOUT = 30
+HTTP_PER_HOST = 4
+HTTP_MAX_REDIRECTS = 5
+HTTP_USER_AGENT = 'ecmanaged-monitor'
+
+# Idle keep-alive connections are dropped after (seconds)
+HTTP_KEEPALIVE_IDLE = 120
+
+import errno
+import socket
+import select
+import base64
+import threading
+
+from time import time
+from urlparse import urlsplit, urljoin
+from collections import deque
+
+from __mplugin import MPlugin, lazy_import
+
+# Only https needs ssl, plain http checks skip its import cost
+ssl = lazy_import('ssl')
+
+import logging
+log = logging
+
+
+class HTTPRequest:
+    def __init__(self, url, method='GET', headers=None, body=None, auth=None,
+                 timeout=HTTP_TIMEOUT, verify=True):
+        self.url = url
+        self.method = method
+        self.headers = headers or {}
+        self.body = body
+        self.auth = auth
+        self.timeout = timeout
+        self.verify = verify
+
+    @property
+    def key(self):
+        return (self.method, self.url, self.body, self.auth, self.verify,
+                tuple(sorted(self.headers.items())))
+
+    def build(self):
+        """
+        @return: (scheme, host, port, raw request)
+        """
+        parts = urlsplit(self.url)
+        scheme = parts.scheme or 'http'
+        host = parts.hostname
+
+        if scheme not in ('http', 'https') or not host:
+            raise ValueError("Unsupported URL: %s" % self.url)
+
+        port = parts.port or (443 if scheme == 'https' else 80)
+
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+
+        headers = {
+            'Host': parts.netloc.rsplit('@', 1)[-1],
+            'User-Agent': HTTP_USER_AGENT,
+            'Accept-Encoding': 'identity',
+            'Connection': 'keep-alive'
+        }
+
+        auth = self.auth
+        if not auth and parts.username:
+            auth = (parts.username, parts.password or '')
+
+        if auth:
+            headers['Authorization'] = 'Basic ' + base64.b64encode('%s:%s' % auth)
+
+        if self.body is not None:
+            headers['Content-Length'] = str(len(self.body))
+
+        headers.update(self.headers)
+
+        lines = ['%s %s HTTP/1.1' % (self.method, path)]
+        lines.extend('%s: %s' % (k, v) for k, v in headers.items())
+        raw = '\r\n'.join(lines) + '\r\n\r\n' + (self.body or '')
+
+        return scheme, host, port, raw
+
+
+class HTTPResponse:
+    def __init__(self, url, code=None, reason='', headers=None, body='',
+                 error=None, elapsed=0):
+        self.url = url
+        self.code = code
+        self.reason = reason
+        self.headers = headers or {}
+        self.body = body
+        self.error = error
+        self.elapsed = elapsed
+
+    def json(self):
+        """
+        @raise ValueError: invalid content
+        """
+        retval = MPlugin._from_json(self.body)
+        if not retval and self.body.strip() not in ('{}', '[]'):
+            raise ValueError("Invalid JSON response from %s" % self.url)
+
+        return retval
+
+    @classmethod
+    def parse(cls, url, raw, elapsed):
+        head, sep, body = raw.partition('\r\n\r\n')
+        if not sep:
+            return cls(url, error="Invalid HTTP response", elapsed=elapsed)
+
+        lines = head.split('\r\n')
+        try:
+            version, code, reason = (lines[0].split(' ', 2) + [''])[:3]
+            code = int(code)
+        except ValueError:
+            return cls(url, error="Invalid HTTP status line", elapsed=elapsed)
+
+        headers = {}
+        for line in lines[1:]:
+            if ':' in line:
+                key, value = line.split(':', 1)
+                headers[key.strip().lower()] = value.strip()
+
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            body = cls._dechunk(body)
+
+        return cls(url, code, reason.strip(), headers, body, elapsed=elapsed)
+
+    @staticmethod
+    def _dechunk(body):
+        retval = []
+        while body:
+            size, sep, body = body.partition('\r\n')
+            try:
+                size = int(size.split(';')[0], 16)
+            except ValueError:
+                break
+
+            if not size:
+                break
+
+            retval.append(body[:size])
+            body = body[size + 2:]
+
+        return ''.join(retval)
+
+
+class _IdlePool:
+    """
+    Keep-alive connections not in use, by (scheme, host, port, verify)
+    """
+    def __init__(self, per_host=HTTP_PER_HOST, idle=HTTP_KEEPALIVE_IDLE):
+        self.per_host = per_host
+        self.idle = idle
+
+        self.lock = threading.Lock()
+        self.socks = {}
+
+        self.opened = 0
+        self.reused = 0
+
+    def take(self, key):
+        """
+        @return: open socket or None
+        """
+        now = time()
+
+        while True:
+            with self.lock:
+                socks = self.socks.get(key)
+                if not socks:
+                    return None
+
+                sock, released = socks.pop()
+
+            # Readable while idle means closed by server (or garbage)
+            try:
+                if now - released < self.idle and not select.select([sock], [], [], 0)[0]:
+                    with self.lock:
+                        self.reused += 1
+                    return sock
+
+            except (select.error, socket.error):
+                pass
+
+            _close(sock)
+
+    def put(self, key, sock):
+        with self.lock:
+            socks = self.socks.setdefault(key, [])
+            if len(socks) < self.per_host:
+                socks.append((sock, time()))
+                return
+
+        _close(sock)
+
+    def stats(self, reset=True):
+        with self.lock:
+            retval = {
+                'opened': self.opened,
+                'reused': self.reused,
+                'idle': sum(len(socks) for socks in self.socks.values())
+            }
+
+            if reset:
+                self.opened = self.reused = 0
+
+        return retval
+
+
+_idle = _IdlePool()
+
+
+def connection_stats(reset=True):
+    """
+    @return: connections opened and reused since last call
+    """
+    return _idle.stats(reset)
+
+
+def _close(sock):
+    try:
+        sock.close()
+    except socket.error:
+        pass
+
+
+class _Connection:
+    def __init__(self, index, request, redirects=0):
+        self.index = index
+        self.request = request
+        self.redirects = redirects
+
+        self.scheme, self.host, self.port, self.raw = request.build()
+        self.outgoing = self.raw
+        self.incoming = []
+
+        self.started = time()
+        self.deadline = self.started + request.timeout
+
+        self.sock = None
+        self.fd = None
+        self.state = 'connect'
+
+        # Taken from the idle pool, may have been closed by the server
+        self.reused = False
+
+        # Response framing, parsed once headers arrived
+        self.head = None
+        self.length = None
+        self.chunked = False
+        self.received = 0
+        self.tail = ''
+        self.keep_alive = False
+
+    @property
+    def pool_key(self):
+        return self.scheme, self.host, self.port, self.request.verify
+
+    def start(self):
+        self.sock = _idle.take(self.pool_key)
+        if self.sock:
+            self.fd = self.sock.fileno()
+            self.reused = True
+            self.state = 'send'
+            return
+
+        self._connect()
+
+    def restart(self):
+        """
+        Send again on a new connection, the reused one was closed
+        """
+        self.close()
+
+        self.outgoing = self.raw
+        self.incoming = []
+        self.head = None
+        self.received = 0
+
+        self.reused = False
+        self.state = 'connect'
+
+        self._connect()
+
+    def _connect(self):
+        family, socktype, proto, _, addr = socket.getaddrinfo(
+            self.host, self.port, 0, socket.SOCK_STREAM)[0]
+
+        self.sock = socket.socket(family, socktype, proto)
+        self.sock.setblocking(0)
+        self.fd = self.sock.fileno()
+
+        with _idle.lock:
+            _idle.opened += 1
+
+        err = self.sock.connect_ex(addr)
+        if err not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+            raise socket.error(err, errno.errorcode.get(err, 'connect failed'))
+
+    def fileno(self):
+        # Kept once closed, callers drop the connection by it
+        return self.fd
+
+    def wants_write(self):
+        return self.state in ('connect', 'send', 'handshake_write')
+
+    def handle(self):
+        """
+        Advance state machine
+
+        @return: True when finished
+        """
+        if self.state == 'connect':
+            err = self.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+            if err:
+                raise socket.error(err, errno.errorcode.get(err, 'connect failed'))
+
+            if self.scheme == 'https':
+                context = ssl.create_default_context()
+                if not self.request.verify:
+                    context.check_hostname = False
+                    context.verify_mode = ssl.CERT_NONE
+
+                self.sock = context.wrap_socket(self.sock, server_hostname=self.host,
+                                                do_handshake_on_connect=False)
+                self.state = 'handshake'
+
+            else:
+                self.state = 'send'
+
+        if self.state.startswith('handshake'):
+            try:
+                self.sock.do_handshake()
+                self.state = 'send'
+            except ssl.SSLWantReadError:
+                self.state = 'handshake'
+                return False
+            except ssl.SSLWantWriteError:
+                self.state = 'handshake_write'
+                return False
+
+        if self.state == 'send':
+            try:
+                sent = self.sock.send(self.outgoing)
+                self.outgoing = self.outgoing[sent:]
+            except socket.error, e:
+                if _ssl_wants(e):
+                    return False
+                raise
+
+            if not self.outgoing:
+                self.state = 'recv'
+
+            return False
+
+        if self.state == 'recv':
+            while True:
+                try:
+                    chunk = self.sock.recv(65536)
+                except socket.error, e:
+                    if _ssl_wants(e) or e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                        return False
+
+                    # Servers closing TLS without close_notify
+                    if self.incoming and _ssl_eof(e):
+                        self.keep_alive = False
+                        return True
+                    raise
+
+                if not chunk:
+                    self.keep_alive = False
+                    return True
+
+                self.incoming.append(chunk)
+                self.received += len(chunk)
+
+                # Keep-alive connections are not closed, stop on the framing
+                if self._complete(chunk):
+                    return True
+
+                # SSL may hold decrypted data select() can't see
+                if not getattr(self.sock, 'pending', lambda: 0)():
+                    return False
+
+        return False
+
+    def _complete(self, chunk):
+        """
+        @return: True if the whole response was received
+        """
+        if self.head is None:
+            raw = ''.join(self.incoming)
+            end = raw.find('\r\n\r\n')
+            if end < 0:
+                return False
+
+            self.head = end + 4
+            self.incoming = [raw]
+            self._framing(raw[:end])
+
+            self.tail = ''
+            chunk = raw
+
+        if self.chunked:
+            # Last chunk, trailers are not used by status pages
+            self.tail = (self.tail + chunk)[-7:]
+            return self.tail == '\r\n0\r\n\r\n'
+
+        if self.length is not None:
+            # More than announced, the connection can't be reused
+            if self.received - self.head > self.length:
+                self.keep_alive = False
+
+            return self.received - self.head >= self.length
+
+        return False
+
+    def _framing(self, head):
+        lines = head.split('\r\n')
+        status = lines[0].split(' ', 2)
+
+        headers = {}
+        for line in lines[1:]:
+            if ':' in line:
+                key, value = line.split(':', 1)
+                headers[key.strip().lower()] = value.strip().lower()
+
+        self.chunked = headers.get('transfer-encoding') == 'chunked'
+
+        if self.request.method == 'HEAD' or (len(status) > 1 and status[1] in ('204', '304')):
+            self.length = 0
+
+        elif not self.chunked and 'content-length' in headers:
+            try:
+                self.length = int(headers['content-length'])
+            except ValueError:
+                pass
+
+        # Reusable if the body has an end other than close
+        if status[0] == 'HTTP/1.1':
+            self.keep_alive = headers.get('connection') != 'close'
+        else:
+            self.keep_alive = headers.get('connection') == 'keep-alive'
+
+        self.keep_alive = self.keep_alive and (self.chunked or self.length is not None)
+
+    def response(self):
+        return HTTPResponse.parse(self.request.url, ''.join(self.incoming), time() - self.started)
+
+    def release(self):
+        """
+        Return connection to the idle pool, or close it
+        """
+        if self.sock and self.keep_alive and self.state == 'recv':
+            _idle.put(self.pool_key, self.sock)
+            self.sock = None
+            return
+
+        self.close()
+
+    def close(self):
+        if self.sock:
+            _close(self.sock)
+            self.sock = None
+
+
+def _ssl_wants(e):
+    # SSLError derives from socket.error, plain sockets never need ssl loaded
+    return ssl.loaded() and isinstance(e, (ssl.SSLWantReadError, ssl.SSLWantWriteError))
+
+
+def _ssl_eof(e):
+    return ssl.loaded() and isinstance(e, ssl.SSLError) and 'eof' in str(e).lower()
+
+
+def _redirect(conn, response):
+    if conn.request.method != 'GET' or response.code not in (301, 302, 303, 307):
+        return None
+
+    location = response.headers.get('location')
+    if not location or conn.redirects >= HTTP_MAX_REDIRECTS:
+        return None
+
+    request = HTTPRequest(urljoin(conn.request.url, location), headers=conn.request.headers,
+                          auth=conn.request.auth, timeout=max(conn.deadline - time(), 1),
+                          verify=conn.request.verify)
+
+    # Credentials are only sent again to the same scheme, host and port
+    scheme, host, port, raw = request.build()
+    if (scheme, host, port) != (conn.scheme, conn.host, conn.port):
+        request.auth = None
+        request.headers = dict((k, v) for k, v in request.headers.items()
+                               if k.lower() != 'authorization')
+
+    return _Connection(conn.index, request, conn.redirects + 1)
+
+
+def fetch_all(requests, per_host=HTTP_PER_HOST, callback=None):
+    """
+    Fetch every request concurrently
+
+    @param requests: list of HTTPRequest
+    @param per_host: max simultaneous connections to the same host
+    @param callback: called as callback(index, response) once each
+                     response is complete, before the others finish
+    @return: list of HTTPResponse, same order as requests
+    """
+    responses = [None] * len(requests)
+
+    def complete(index, response):
+        responses[index] = response
+        if callback:
+            callback(index, response)
+
+    waiting = {}
+    for index, request in enumerate(requests):
+        try:
+            conn = _Connection(index, request)
+        except ValueError, e:
+            complete(index, HTTPResponse(request.url, error=str(e)))
+            continue
+
+        waiting.setdefault((conn.host, conn.port), deque()).append(conn)
+
+    active = {}
+    per_host_active = {}
+
+    # Callers drop conn from active first
+    def finish(conn, response):
+        if response.error:
+            conn.close()
+        else:
+            conn.release()
+
+        per_host_active[(conn.host, conn.port)] -= 1
+
+        try:
+            redirect = response and not response.error and _redirect(conn, response)
+        except ValueError, e:
+            # Location not fetchable, e.g. ftp://
+            response = HTTPResponse(conn.request.url, error="Invalid redirect: %s" % e,
+                                    elapsed=response.elapsed)
+            redirect = None
+
+        if redirect:
+            waiting.setdefault((redirect.host, redirect.port), deque()).appendleft(redirect)
+        else:
+            complete(conn.index, response)
+
+    while waiting or active:
+        # Start new connections within per host limit
+        for host in waiting.keys():
+            queue = waiting[host]
+            while queue and per_host_active.get(host, 0) < per_host:
+                conn = queue.popleft()
+                per_host_active[host] = per_host_active.get(host, 0) + 1
+
+                try:
+                    conn.start()
+                    active[conn.fileno()] = conn
+                except (socket.error, ValueError), e:
+                    finish(conn, HTTPResponse(conn.request.url, error=str(e),
+                                              elapsed=time() - conn.started))
+
+            if not queue:
+                del waiting[host]
+
+        if not active:
+            continue
+
+        now = time()
+        wait = max(min(c.deadline for c in active.values()) - now, 0)
+
+        readers = [c for c in active.values() if not c.wants_write()]
+        writers = [c for c in active.values() if c.wants_write()]
+
+        try:
+            readable, writable, _ = select.select(readers, writers, [], wait)
+        except select.error, e:
+            if e.args[0] == errno.EINTR:
+                continue
+            raise
+
+        for conn in set(readable + writable):
+            try:
+                try:
+                    done = conn.handle()
+
+                except socket.error:
+                    if not conn.reused or conn.incoming:
+                        raise
+                    done = True
+
+                # Idle connection closed by the server, once on a new one
+                if done and conn.reused and not conn.incoming:
+                    active.pop(conn.fileno(), None)
+                    conn.restart()
+                    active[conn.fileno()] = conn
+
+                elif done:
+                    active.pop(conn.fileno(), None)
+                    finish(conn, conn.response())
+
+            # ValueError includes ssl.CertificateError on hostname mismatch
+            except (socket.error, ValueError), e:
+                active.pop(conn.fileno(), None)
+                finish(conn, HTTPResponse(conn.request.url, error=str(e),
+                                          elapsed=time() - conn.started))
+
+        now = time()
+        for conn in active.values():
+            if conn.deadline <= now:
+                active.pop(conn.fileno(), None)
+                finish(conn, HTTPResponse(conn.request.url, error="timed out",
+                                          elapsed=now - conn.started))
+
+    return responses
+
+
+def fetch(request):
+    """
+    @param request: HTTPRequest
+    @return: HTTPResponse
+    """
+    return fetch_all([request])[0]
@@ -0,0 +1,304 @@
+#!/usr/bin/env python
+
+# -*- coding:utf-8 -*-
+
+# Copyright (C) 2012 Juan Carlos Moreno <juancarlos.moreno at ecmanaged.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Bulk install and uninstall of plugins.
+
+Every distinct script is stored once under the plugins path, named by
+its content hash, and hard linked as the entry script of each plugin
+directory using it. A batch is prepared first (store files, new configs
+and links written to temporary names) and then committed by renames;
+if any step fails the plugins already switched are restored, so either
+the whole batch is applied or none of it.
+"""
+
+SCRIPTS_DIR_NAME = '.scripts'
+TXN_SUFFIX = '.txn'
+BACKUP_SUFFIX = '.bak'
+
+import os
+import hashlib
+
+from os.path import join, abspath, dirname, exists, isdir, isfile
+from shutil import move, copyfile, rmtree
+
+from __mplugin import CONFIG_FILE_NAME
+from __mconfig import invalidate as config_invalidate, content_hash
+from __mcodec import dumps as json_dumps
+from __mmanifest import Manifest
+from __mstate import StateStore
+
+import logging
+log = logging
+
+
+class InstallError(Exception):
+    pass
+
+
+class Installer:
+    def __init__(self, path):
+        self.path = abspath(path)
+        self.scripts_path = join(self.path, SCRIPTS_DIR_NAME)
+        self.manifest = Manifest(self.path)
+
+    def install(self, plugins):
+        """
+        Install or update plugins in a single transaction
+
+        @param plugins: list of (id, config dict, script source)
+        @return: True if the whole batch was applied
+        """
+        staged = []
+
+        try:
+            self._validate(plugins)
+            for id, config, script in plugins:
+                self._prepare(staged, id, config, script)
+
+        except (InstallError, OSError, IOError), e:
+            log.error("install: %s" % e)
+            self._discard(staged)
+            return False
+
+        try:
+            for plugin in staged:
+                self._commit(plugin)
+
+        except (OSError, IOError), e:
+            log.error("install: Unable to apply %s, rolling back: %s" % (plugin['id'], e))
+            for plugin in reversed(staged):
+                self._rollback(plugin)
+
+            self._discard(staged)
+            return False
+
+        for plugin in staged:
+            self._cleanup(plugin)
+
+        records = [self.manifest.record_from_path(p['id'], p['path']) for p in staged]
+        self.manifest.update([r for r in records if r])
+        self.collect()
+
+        return True
+
+    def uninstall(self, ids):
+        """
+        Move plugin directories out of the way (to .id) in a single
+        transaction, moved ones are restored on failure
+
+        @return: True if every plugin was uninstalled
+        """
+        done = []
+
+        try:
+            for id in ids:
+                self._check_id(id)
+
+                plugin_path = self._plugin_path(id)
+                if not isdir(plugin_path):
+                    raise InstallError("Unknown plugin: %s" % id)
+
+                move_to = join(self.path, '.' + id)
+                move(plugin_path, move_to)
+                done.append((plugin_path, move_to))
+
+        except (InstallError, OSError, IOError), e:
+            log.error("uninstall: %s" % e)
+            for plugin_path, move_to in reversed(done):
+                move(move_to, plugin_path)
+
+            return False
+
+        self.manifest.update(removed=ids)
+
+        # Counters of a plugin installed again later start over
+        store = StateStore.shared(self.path)
+        if store:
+            for id in ids:
+                store.remove(id)
+
+        return True
+
+    def collect(self):
+        """
+        Remove stored scripts no plugin in the manifest refers to, by
+        script hash: link counts can't tell when scripts were copied.
+        Plugins keep their own link or copy of a removed script
+
+        @return: number of files removed
+        """
+        if not isdir(self.scripts_path):
+            return 0
+
+        plugins = self.manifest.load()
+        if plugins is None:
+            plugins = self.manifest.rebuild()
+
+        used = set(record.get('script_hash') for record in plugins.values())
+
+        retval = 0
+        for name in os.listdir(self.scripts_path):
+            if name not in used:
+                os.unlink(join(self.scripts_path, name))
+                retval += 1
+
+        return retval
+
+    def _validate(self, plugins):
+        seen = set()
+
+        for id, config, script in plugins:
+            if not id or not isinstance(config, dict) or not script:
+                raise InstallError("Invalid information received for %s" % id)
+
+            self._check_id(id)
+
+            if id in seen:
+                raise InstallError("Duplicated plugin id: %s" % id)
+
+            seen.add(id)
+
+    def _check_id(self, id):
+        # Names a directory right inside our plugin path
+        if not id or id.startswith('.') or dirname(self._plugin_path(id)) != self.path:
+            raise InstallError("Invalid plugin id: %s" % id)
+
+    def _plugin_path(self, id):
+        return abspath(join(self.path, id))
+
+    def _store(self, script):
+        """
+        @return: path of the stored script, written once per content
+        """
+        if isinstance(script, unicode):
+            script = script.encode('utf-8')
+
+        stored = join(self.scripts_path, hashlib.sha1(script).hexdigest())
+        if isfile(stored):
+            return stored
+
+        if not isdir(self.scripts_path):
+            os.makedirs(self.scripts_path)
+
+        tmp = stored + TXN_SUFFIX
+        with open(tmp, 'wb') as f:
+            f.write(script)
+
+        os.chmod(tmp, 0755)
+        os.rename(tmp, stored)
+
+        return stored
+
+    def _prepare(self, staged, id, config, script):
+        """
+        Write new config and script link next to the current ones,
+        the plugin is added to staged before touching the disk
+        """
+        plugin_path = self._plugin_path(id)
+        plugin = {
+            'id': id,
+            'path': plugin_path,
+            'created': not exists(plugin_path),
+            'files': [],
+            'committed': []
+        }
+        staged.append(plugin)
+
+        if plugin['created']:
+            os.makedirs(plugin_path)
+
+        json_config = json_dumps(config)
+        config_file = join(plugin_path, CONFIG_FILE_NAME)
+
+        # Unchanged config keeps its file
+        current = None
+        if isfile(config_file):
+            with open(config_file, 'r') as f:
+                current = content_hash(f.read())
+
+        if current != content_hash(json_config):
+            with open(config_file + TXN_SUFFIX, 'w') as f:
+                f.write(json_config)
+
+            plugin['files'].append(config_file)
+
+        # Same stored script is already linked
+        stored = self._store(script)
+        script_file = join(plugin_path, id)
+
+        if not self._same_file(stored, script_file):
+            self._link(stored, script_file + TXN_SUFFIX)
+            plugin['files'].append(script_file)
+
+    def _commit(self, plugin):
+        for filepath in plugin['files']:
+            if exists(filepath):
+                os.rename(filepath, filepath + BACKUP_SUFFIX)
+
+            os.rename(filepath + TXN_SUFFIX, filepath)
+            plugin['committed'].append(filepath)
+
+            if filepath.endswith(CONFIG_FILE_NAME):
+                config_invalidate(filepath)
+
+    def _rollback(self, plugin):
+        for filepath in reversed(plugin['committed']):
+            os.rename(filepath, filepath + TXN_SUFFIX)
+
+            if exists(filepath + BACKUP_SUFFIX):
+                os.rename(filepath + BACKUP_SUFFIX, filepath)
+
+            if filepath.endswith(CONFIG_FILE_NAME):
+                config_invalidate(filepath)
+
+    def _cleanup(self, plugin):
+        for filepath in plugin['files']:
+            if exists(filepath + BACKUP_SUFFIX):
+                os.unlink(filepath + BACKUP_SUFFIX)
+
+    def _discard(self, staged):
+        for plugin in staged:
+            if plugin['created']:
+                rmtree(plugin['path'], ignore_errors=True)
+                continue
+
+            for filepath in plugin['files']:
+                if exists(filepath + TXN_SUFFIX):
+                    os.unlink(filepath + TXN_SUFFIX)
+
+        self.collect()
+
+    @staticmethod
+    def _same_file(a, b):
+        try:
+            return os.path.samefile(a, b)
+        except OSError:
+            return False
+
+    @staticmethod
+    def _link(source, target):
+        if exists(target):
+            os.unlink(target)
+
+        # No hard links available, fallback to a copy
+        try:
+            os.link(source, target)
+        except (AttributeError, OSError):
+            copyfile(source, target)
+            os.chmod(target, 0755)
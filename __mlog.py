@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+
+# -*- coding:utf-8 -*-
+
+# Copyright (C) 2012 Juan Carlos Moreno <juancarlos.moreno at ecmanaged.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Queued logging with size based rotation.
+
+Records are formatted by the caller and put on a bounded queue; a
+background thread writes them to a rotating file, so logging never
+waits on disk. One sink is kept per log file, a runner shares it with
+every plugin in the process. The level can be set per plugin ("log_level"
+in data.json) and applies to the thread running that plugin.
+"""
+
+LOG_MAX_BYTES = 1048576
+LOG_BACKUP_COUNT = 3
+LOG_QUEUE_SIZE = 10000
+LOG_LEVEL = 'debug'
+LOG_FORMAT = '%(levelname)s:%(message)s'
+LOG_PLUGIN_FORMAT = '%(levelname)s:%(plugin)s:%(message)s'
+
+import atexit
+import threading
+import Queue
+
+import logging
+
+_sinks = {}
+_sinks_lock = threading.Lock()
+
+# Plugin id and level of the running thread
+_context = threading.local()
+
+
+class LogContextFilter(logging.Filter):
+    def __init__(self, level):
+        logging.Filter.__init__(self)
+        self.level = level
+
+    def filter(self, record):
+        record.plugin = getattr(_context, 'id', None) or '-'
+        return record.levelno >= getattr(_context, 'level', self.level)
+
+
+class QueueHandler(logging.Handler):
+    """
+    Format in the calling thread and hand records to the writer,
+    records are dropped (and counted) when the queue is full
+    """
+    def __init__(self, sink):
+        logging.Handler.__init__(self)
+        self.sink = sink
+        self.queue = sink.queue
+        self.dropped = 0
+
+    def emit(self, record):
+        if not self.sink.thread:
+            self.sink.start()
+
+        try:
+            # Writer only needs the final text
+            record.msg = self.format(record)
+            record.args = None
+            record.exc_info = None
+            record.exc_text = None
+
+            self.queue.put_nowait(record)
+
+        except Queue.Full:
+            self.dropped += 1
+
+        except Exception:
+            self.handleError(record)
+
+
+class LogSink:
+    def __init__(self, filename, max_bytes=LOG_MAX_BYTES, backup_count=LOG_BACKUP_COUNT,
+                 queue_size=LOG_QUEUE_SIZE):
+        self.filename = filename
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.queue = Queue.Queue(queue_size)
+
+        self.handler = QueueHandler(self)
+
+        # Writer starts with the first record, most checks log nothing
+        self.writer = None
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        with self.lock:
+            if self.thread:
+                return
+
+            # Imported here, logging.handlers loads socket and ssl
+            import logging.handlers
+
+            self.writer = logging.handlers.RotatingFileHandler(
+                self.filename, maxBytes=self.max_bytes, backupCount=self.backup_count, delay=True)
+            self.writer.setFormatter(logging.Formatter('%(message)s'))
+
+            self.thread = threading.Thread(target=self._write)
+            self.thread.daemon = True
+            self.thread.start()
+
+    def _write(self):
+        while True:
+            record = self.queue.get()
+            if record is None:
+                break
+
+            self.writer.handle(record)
+
+            # Report records lost while the queue was full
+            dropped, self.handler.dropped = self.handler.dropped, 0
+            if dropped:
+                self.writer.handle(logging.makeLogRecord({
+                    'msg': "WARNING:%d log records dropped" % dropped,
+                    'levelno': logging.WARNING,
+                    'levelname': 'WARNING'
+                }))
+
+        self.writer.close()
+
+    def stop(self):
+        """
+        Write queued records and close the file
+        """
+        if not self.thread or not self.thread.is_alive():
+            return
+
+        self.queue.put(None)
+        self.thread.join()
+
+
+def get_sink(filename):
+    """
+    @return: LogSink for filename, shared by the whole process
+    """
+    with _sinks_lock:
+        sink = _sinks.get(filename)
+        if not sink:
+            sink = _sinks[filename] = LogSink(filename)
+
+        return sink
+
+
+def setup(filename, level=LOG_LEVEL, fmt=LOG_FORMAT):
+    """
+    Send root logger records to the sink of filename, unless
+    the process already configured logging
+
+    @return: QueueHandler or None if not installed
+    """
+    root = logging.getLogger()
+    if root.handlers:
+        return None
+
+    handler = get_sink(filename).handler
+    handler.setFormatter(logging.Formatter(fmt))
+    handler.addFilter(LogContextFilter(to_level(level)))
+
+    root.addHandler(handler)
+    root.setLevel(logging.DEBUG)
+
+    return handler
+
+
+def set_context(id=None, level=None):
+    """
+    Set plugin id and level for records of the current thread,
+    None level uses the level of the sink
+    """
+    _context.id = id
+
+    if level is None:
+        _context.__dict__.pop('level', None)
+    else:
+        _context.level = to_level(level)
+
+
+def clear_context():
+    _context.__dict__.clear()
+
+
+def to_level(level, default=logging.DEBUG):
+    """
+    @param level: level name ('info', 'WARNING'...) or number
+    @return: logging level number
+    """
+    if isinstance(level, (int, long)):
+        return level
+
+    try:
+        value = logging.getLevelName(str(level).upper())
+    except Exception:
+        return default
+
+    return value if isinstance(value, int) else default
+
+
+@atexit.register
+def _stop():
+    for sink in _sinks.values():
+        sink.stop()
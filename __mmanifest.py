@@ -0,0 +1,258 @@
+#!/usr/bin/env python
+
+# -*- coding:utf-8 -*-
+
+# Copyright (C) 2012 Juan Carlos Moreno <juancarlos.moreno at ecmanaged.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Index of the plugins installed under a plugins path.
+
+One JSON file lists every plugin id with its entry script, plugin class,
+interval, config hash and script hash. install() and uninstall() update it under a
+lock and replace it atomically (write and rename), so readers never see
+a partial file and can detect changes from its mtime and generation.
+"""
+
+MANIFEST_FILE_NAME = '.manifest.json'
+MANIFEST_LOCK_NAME = '.manifest.lock'
+MANIFEST_VERSION = 2
+
+import re
+import os
+import hashlib
+
+from os.path import join, abspath, isdir, isfile
+
+from __mplugin import CONFIG_FILE_NAME, DEFAULT_INTERVAL
+from __mconfig import load_config
+from __mcodec import loads as json_loads, dumps as json_dumps
+
+import_error = False
+try:
+    import fcntl
+except ImportError:
+    import_error = True
+
+import logging
+log = logging
+
+CLASS_RE = re.compile(r'^class\s+(\w+)\s*\([^)]*MPlugin[^)]*\)\s*:', re.M)
+
+
+class Manifest:
+    def __init__(self, path):
+        self.path = abspath(path)
+        self.file = join(self.path, MANIFEST_FILE_NAME)
+
+        # Inode and mtime of the file as last loaded, every write
+        # renames a new file in place so the inode always changes
+        self.key = None
+        self.generation = 0
+
+    def exists(self):
+        return isfile(self.file)
+
+    def changed(self):
+        """
+        @return: True if the file changed since last load
+        """
+        return self._stat() != self.key
+
+    def load(self):
+        """
+        @return: {id: record}, None if missing or invalid
+        """
+        self.key = None
+
+        try:
+            key = self._stat()
+            with open(self.file, 'r') as f:
+                content = json_loads(f.read())
+
+        except (OSError, IOError):
+            return None
+
+        except ValueError:
+            log.warning("Invalid manifest: %s" % self.file)
+            return None
+
+        if not isinstance(content, dict) or content.get('version') != MANIFEST_VERSION:
+            return None
+
+        self.key = key
+        self.generation = content.get('generation', 0)
+
+        return content.get('plugins') or {}
+
+    def update(self, records=None, removed=None):
+        """
+        Add or replace records and drop removed ids in one atomic write
+
+        @param records: list of record dicts
+        @param removed: list of plugin ids
+        @return: {id: record} as written
+        """
+        lock = self._lock()
+        try:
+            plugins = self.load()
+            if plugins is None:
+                plugins = self.scan()
+
+            for record in records or []:
+                plugins[record['id']] = record
+
+            for id in removed or []:
+                plugins.pop(id, None)
+
+            self._write(plugins)
+            return plugins
+
+        finally:
+            self._unlock(lock)
+
+    def rebuild(self):
+        """
+        Write the manifest from the plugin directories
+
+        @return: {id: record}
+        """
+        return self.update()
+
+    def scan(self):
+        """
+        @return: {id: record} for every installed plugin directory
+        """
+        retval = {}
+
+        for id in os.listdir(self.path):
+            plugin_path = join(self.path, id)
+
+            if id.startswith('.') or id.startswith('__') or not isdir(plugin_path):
+                continue
+
+            record = self.record_from_path(id, plugin_path)
+            if record:
+                retval[id] = record
+
+        return retval
+
+    @staticmethod
+    def record(id, script, klass=None, interval=None, config_hash=None, script_hash=None):
+        return {
+            'id': id,
+            'script': script,
+            'class': klass,
+            'interval': interval,
+            'config_hash': config_hash,
+            'script_hash': script_hash
+        }
+
+    @classmethod
+    def record_from_path(cls, id, plugin_path):
+        """
+        @return: record for an installed plugin directory, None if incomplete
+        """
+        config = load_config(join(plugin_path, CONFIG_FILE_NAME))
+        if not config.exists:
+            return None
+
+        script = find_script(id, plugin_path)
+        if not script:
+            return None
+
+        return cls.record(id, os.path.relpath(script, os.path.dirname(plugin_path)),
+                          script_class(script), config.data.get('interval', DEFAULT_INTERVAL),
+                          config.hash, script_hash(script))
+
+    def _write(self, plugins):
+        self.generation += 1
+        content = json_dumps({
+            'version': MANIFEST_VERSION,
+            'generation': self.generation,
+            'plugins': plugins
+        })
+
+        tmp = '%s.%d.tmp' % (self.file, os.getpid())
+        with open(tmp, 'w') as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+
+        # Atomic on POSIX, readers see the old or the new index
+        os.rename(tmp, self.file)
+        self.key = self._stat()
+
+    def _stat(self):
+        try:
+            st = os.stat(self.file)
+            return st.st_ino, st.st_mtime
+        except OSError:
+            return None
+
+    def _lock(self):
+        if import_error:
+            return None
+
+        lock = open(join(self.path, MANIFEST_LOCK_NAME), 'a')
+        fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+        return lock
+
+    @staticmethod
+    def _unlock(lock):
+        if lock:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_UN)
+            lock.close()
+
+
+def find_script(id, plugin_path):
+    """
+    Installed scripts are named as the plugin id, fallback
+    to a single python file inside plugin directory
+    """
+    script = join(plugin_path, id)
+    if isfile(script):
+        return script
+
+    scripts = [f for f in os.listdir(plugin_path) if f.endswith('.py')]
+    if len(scripts) == 1:
+        return join(plugin_path, scripts[0])
+
+    return None
+
+
+def script_hash(script):
+    """
+    @return: SHA1 of the script content, the name installed scripts are stored with
+    """
+    try:
+        with open(script, 'rb') as f:
+            return hashlib.sha1(f.read()).hexdigest()
+
+    except (OSError, IOError):
+        return None
+
+
+def script_class(script):
+    """
+    @return: name of the last MPlugin subclass defined in script, None if not found
+    """
+    try:
+        with open(script, 'r') as f:
+            found = CLASS_RE.findall(f.read())
+
+    except IOError:
+        return None
+
+    return found[-1] if found else None
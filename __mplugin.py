@@ -23,10 +23,50 @@ COUNTER_FILE_NAME = '.counter.dat'
 TOUCH_FILE_NAME = '.touch'
 
 INTERVAL_INDEX = '__interval__'
+TIME_INDEX = '__time__'
+HISTORY_INDEX = '__history__:'
+
+# Key path separator and max depth for nested counters
+PATH_SEPARATOR = '\x1f'
+MAX_DEPTH = 100
+
+# Use numpy for counters from this size
+NUMPY_MIN_SIZE = 256
+
+# Samples kept by counter history and rate windows (seconds)
+HISTORY_SIZE = 16
+RATE_WINDOWS = {'1m': 60, '5m': 300, '15m': 900}
 
 CHECK_TIMEOUT = 55
 DEFAULT_INTERVAL = 60
 
+# Opt-in performance section of the result, enabled by "perf" in
+# data.json or in the environment
+PERF_KEY = '_perf'
+PERF_ENV = 'MPLUGIN_PERF'
+
+# Adaptive polling, enabled by "adaptive" in data.json: the interval
+# doubles while state and metrics stay within tolerance, up to a cap
+ADAPTIVE_INDEX = '__adaptive__'
+ADAPTIVE_TOLERANCE = 0.05
+ADAPTIVE_MAX_FACTOR = 8
+
+# Compact result format, schema id and runs since it was last sent
+SCHEMA_INDEX = '__schema__'
+
+# Delta results, enabled by "delta" in data.json: data only carries the
+# keys changed since the previous result, with a full snapshot every
+# DELTA_SNAPSHOT runs
+DELTA_INDEX = '__delta__'
+DELTA_SNAPSHOT = 10
+
+# Sub-interval sampling, enabled by "sampling" in data.json (samples per
+# interval) for plugins implementing sample(): a runner takes the samples
+# and each result reports min, max, mean and p95 per gauge
+SAMPLER_SAMPLES = 6
+SAMPLER_MAX_SAMPLES = 60
+SAMPLER_GROUP = '%s (sampled)'
+
 # Monitor status
 OK = 0
 WARNING = 1
@@ -37,9 +77,21 @@ TIMEOUT = 254
 import sys
 import signal
 
-from os.path import dirname, abspath, join, exists, basename, getmtime
+from contextlib import contextmanager
+
+from os.path import dirname, abspath, join, exists, basename, getmtime, isfile
 from time import time
-from os import makedirs, chmod, utime
+from os import utime, environ, access, pathsep, X_OK
+from os import times as os_times
+from importlib import import_module
+
+# Cold start profiling, installed before the remaining imports
+from __mprofile import StartupProfile, PROFILE_ENV
+
+_profile = None
+if environ.get(PROFILE_ENV):
+    _profile = StartupProfile()
+    _profile.install()
 
 import logging 
 log = logging
@@ -49,12 +101,581 @@ def _timeout(signum, frame):
     sys.exit(TIMEOUT)
 
 
-class MPlugin:
-    def __init__(self, plugin_path=None):
+class CheckResult(BaseException):
+    """
+    Result of a check run, raised by MPlugin.exit when embedded.
+    Inherits from BaseException (as SystemExit does) so "except Exception"
+    blocks inside plugins don't swallow it.
+    """
+    def __init__(self, state, id=None, name=None, message=None, data=None,
+                 metrics=None, interval=None, timings=None, perf=None, next_interval=None,
+                 schema=None, delta=None):
+        BaseException.__init__(self, state)
+
+        self.state = state
+        self.id = id
+        self.name = name
+        self.message = message
+        self.data = data if data is not None else {}
+        self.metrics = metrics if metrics is not None else {}
+        self.interval = interval
+        self.timings = timings if timings is not None else {}
+        self.perf = perf
+
+        # Adaptive polling, seconds until the next run
+        self.next_interval = next_interval
+
+        # Compact format: (schema id, key paths, values, send key paths)
+        self.schema = schema
+
+        # Delta results: {'seq', 'full'} or {'seq', 'removed' key paths},
+        # data holds only changed keys unless full
+        self.delta = delta
+
+    def to_dict(self):
+        """
+        @return: result line as sent by standalone plugins
+        """
+        retval = {
+            'id': self.id,
+            'name': self.name,
+            'message': self.message,
+            'data': self.data,
+            'metrics': self.metrics,
+            'interval': self.interval
+        }
+
+        if self.next_interval is not None:
+            retval['next_interval'] = self.next_interval
+
+        if self.delta is not None:
+            retval['delta'] = self.delta
+
+        return retval
+
+    def to_json(self, extra=None):
+        """
+        @param extra: additional top level keys
+        @return: encoded result line, with the performance section if enabled
+        """
+        output = self.to_dict()
+        if extra:
+            output.update(extra)
+
+        start = time()
+        retval = _mcodec.encode(output)
+
+        if self.perf is None:
+            return retval
+
+        # Time serialisation of the result itself, then append the section
+        self.perf['serialisation'] = time() - start
+        return '%s, "%s": %s}' % (retval[:-1], PERF_KEY, _mcodec.encode(self.perf))
+
+    def to_compact(self, extra=None):
+        """
+        @return: record of the compact format, see __mcompact
+        """
+        retval = {
+            'v': _mcompact.FORMAT_VERSION,
+            'id': self.id,
+            'n': self.name,
+            's': self.state,
+            'm': self.message,
+            'd': self.data,
+            'i': self.interval
+        }
+
+        if self.next_interval is not None:
+            retval['ni'] = self.next_interval
+
+        if self.delta is not None:
+            retval['dl'] = self.delta
+
+        if self.schema:
+            schema_id, paths, values, send = self.schema
+            retval['k'] = schema_id
+            retval['x'] = values
+            if send:
+                retval['ks'] = _mcompact.pack_schema(paths)
+
+        else:
+            retval['metrics'] = self.metrics
+
+        if extra:
+            retval.update(extra)
+
+        if self.perf is not None:
+            retval[PERF_KEY] = self.perf
+
+        return retval
+
+    def encode(self, extra=None, compact=False):
+        """
+        @return: JSON result line, or compact record without framing
+        """
+        if not compact:
+            return self.to_json(extra)
+
+        return _mcompact.encode(self.to_compact(extra))
+
+
+class CounterHistory:
+    """
+    Ring buffer of the last (timestamp, value) samples of a counter,
+    kept in a flat array of doubles
+    """
+    def __init__(self, size=HISTORY_SIZE):
+        self.size = size
+        self.samples = _array.array('d', [0.0] * (2 * size))
+        self.head = 0
+        self.count = 0
+
+    def add(self, timestamp, value):
+        # Counter was reset, older samples are useless
+        if self.count and value < self.last()[1]:
+            self.count = 0
+
+        pos = 2 * self.head
+        self.samples[pos] = timestamp
+        self.samples[pos + 1] = value
+
+        self.head = (self.head + 1) % self.size
+        self.count = min(self.count + 1, self.size)
+
+    def last(self):
+        pos = 2 * ((self.head - 1) % self.size)
+        return self.samples[pos], self.samples[pos + 1]
+
+    def items(self):
+        """
+        @return: list of (timestamp, value), oldest first
+        """
+        retval = []
+        for i in range(self.size - self.count, self.size):
+            pos = 2 * ((self.head + i) % self.size)
+            retval.append((self.samples[pos], self.samples[pos + 1]))
+
+        return retval
+
+    def rate(self, window, now=None):
+        """
+        @return: average rate over the last window seconds, starting
+                 from the newest sample before window if any
+        """
+        if now is None:
+            now = time()
+
+        samples = self.items()
+        before = [x for x in samples if x[0] < now - window]
+        samples = before[-1:] + [x for x in samples if x[0] >= now - window]
+
+        if len(samples) < 2 or samples[-1][0] <= samples[0][0]:
+            return 0
+
+        return (samples[-1][1] - samples[0][1]) / (samples[-1][0] - samples[0][0])
+
+    def rates(self):
+        """
+        @return: rate between each pair of consecutive samples
+        """
+        samples = self.items()
+        retval = []
+
+        for (t1, v1), (t2, v2) in zip(samples, samples[1:]):
+            if t2 > t1:
+                retval.append((v2 - v1) / (t2 - t1))
+
+        return retval
+
+    def peak_rate(self):
+        return max(self.rates() or [0])
+
+    def smoothed_rate(self, alpha=0.3):
+        """
+        @return: exponentially weighted moving average of rates
+        """
+        retval = None
+        for rate in self.rates():
+            retval = rate if retval is None else alpha * rate + (1 - alpha) * retval
+
+        return retval or 0
+
+    def encode(self):
+        return '%d:%d:%d:%s' % (self.size, self.head, self.count,
+                                _base64.b64encode(self.samples.tostring()))
+
+    @classmethod
+    def decode(cls, encoded, size=HISTORY_SIZE):
+        """
+        @return: CounterHistory, empty if encoded is invalid or size changed
+        """
+        retval = cls(size)
+
+        try:
+            old_size, head, count, samples = encoded.split(':', 3)
+            if int(old_size) == size:
+                retval.samples = _array.array('d')
+                retval.samples.fromstring(_base64.b64decode(samples))
+                retval.head = int(head)
+                retval.count = int(count)
+
+                if len(retval.samples) != 2 * size:
+                    retval = cls(size)
+
+        except (AttributeError, ValueError, TypeError):
+            pass
+
+        return retval
+
+
+class GaugeSampler:
+    """
+    Samples of gauges taken between two results, one fixed size ring
+    of doubles per gauge. Shared by the sampling and the running thread.
+    """
+    def __init__(self, samples=SAMPLER_SAMPLES):
+        self.samples = samples
+
+        # Room for samples taken late or while the check runs
+        self.size = 2 * samples
+        self.gauges = {}
+        self.lock = _threading.Lock()
+
+    def add(self, values):
+        """
+        @param values: {gauge name: number}, anything else is skipped
+        """
+        with self.lock:
+            for name, value in values.iteritems():
+                if not _is_counter(value):
+                    continue
+
+                gauge = self.gauges.get(name)
+                if gauge is None:
+                    gauge = self.gauges[name] = [_array.array('d', [0.0] * self.size), 0, 0]
+
+                samples, head, count = gauge
+                samples[head] = value
+                gauge[1] = (head + 1) % self.size
+                gauge[2] = min(count + 1, self.size)
+
+    def summary(self, reset=True):
+        """
+        @return: {gauge name: {'min', 'max', 'mean', 'p95', 'samples'}}
+        """
+        retval = {}
+
+        with self.lock:
+            for name, gauge in self.gauges.iteritems():
+                samples, head, count = gauge
+                if not count:
+                    continue
+
+                # Order doesn't matter, only the valid part of the ring
+                values = sorted(samples[:count] if count < self.size else samples)
+
+                retval[name] = {
+                    'min': values[0],
+                    'max': values[-1],
+                    'mean': sum(values) / count,
+                    'p95': values[max(int(_math.ceil(0.95 * count)) - 1, 0)],
+                    'samples': count
+                }
+
+                if reset:
+                    gauge[1] = gauge[2] = 0
+
+        return retval
+
+
+def _other_leaves(obj, prefix=None, leaves=None, depth=0):
+    """
+    Non numeric leaves of nested dicts and lists, the ones _flatten skips
+
+    @return: list of (key path, value)
+    """
+    if leaves is None:
+        leaves = []
+
+    if depth > MAX_DEPTH:
+        return leaves
+
+    if isinstance(obj, dict):
+        items = obj.iteritems()
+
+    elif isinstance(obj, list):
+        items = enumerate(obj)
+
+    else:
+        return leaves
+
+    for idx, value in items:
+        path = idx if prefix is None else '%s%s%s' % (prefix, PATH_SEPARATOR, idx)
+
+        if isinstance(value, (dict, list)):
+            _other_leaves(value, path, leaves, depth + 1)
+
+        elif not _is_counter(value):
+            leaves.append((path, value))
+
+    return leaves
 
-        # set alarm for timeout
-        signal.signal(signal.SIGALRM, _timeout)
-        signal.alarm(CHECK_TIMEOUT)
+
+def _is_counter(value):
+    return isinstance(value, (int, long, float)) and not isinstance(value, bool)
+
+
+def _diff(previous, current, prefix, removed, depth=0):
+    """
+    Keys of current added or changed since previous, nested dicts
+    compared key by key, key paths no longer present added to removed
+
+    @return: dict of changed keys
+    """
+    retval = {}
+
+    for key, value in current.iteritems():
+        if key not in previous:
+            retval[key] = value
+
+        elif isinstance(value, dict) and isinstance(previous[key], dict) and depth < MAX_DEPTH:
+            changed = _diff(previous[key], value, prefix + [key], removed, depth + 1)
+            if changed:
+                retval[key] = changed
+
+        elif value != previous[key]:
+            retval[key] = value
+
+    for key in previous:
+        if key not in current:
+            removed.append(prefix + [key])
+
+    return retval
+
+
+def _flatten(obj, key=None, prefix=None, paths=None, values=None, depth=0):
+    """
+    Numeric leaves of nested dicts and lists of records
+
+    @return: (key paths, values), depth first
+    """
+    if paths is None:
+        paths, values = [], []
+
+    if depth > MAX_DEPTH:
+        return paths, values
+
+    if isinstance(obj, dict):
+        items = obj.iteritems()
+
+    elif isinstance(obj, list):
+        items = ((elm.get(key, i) if key and isinstance(elm, dict) else i, elm)
+                 for i, elm in enumerate(obj))
+
+    else:
+        return paths, values
+
+    for idx, value in items:
+        path = idx if prefix is None else '%s%s%s' % (prefix, PATH_SEPARATOR, idx)
+
+        if _is_counter(value):
+            paths.append(path)
+            values.append(value)
+
+        else:
+            _flatten(value, key, path, paths, values, depth + 1)
+
+    return paths, values
+
+
+def _unflatten(obj, key, values, depth=0):
+    """
+    Copy of obj with numeric leaves taken from values, in _flatten order
+    """
+    if depth > MAX_DEPTH:
+        return obj
+
+    if isinstance(obj, dict):
+        return dict((idx, _unflatten(value, key, values, depth + 1)) for idx, value in obj.iteritems())
+
+    if isinstance(obj, list):
+        return [_unflatten(elm, key, values, depth + 1) for elm in obj]
+
+    if _is_counter(obj):
+        return next(values)
+
+    return obj
+
+
+def _counter_deltas(current, previous, interval=None):
+    """
+    Difference between current and previous values in bulk, with
+    NumPy for large sets when available. Resets (negative) and counters
+    without previous value return 0. Integer counters keep integer
+    differences when mixed with float ones.
+
+    @param interval: divide differences by interval
+    @return: list of differences
+    """
+    integer = [isinstance(cur, (int, long)) and isinstance(prev, (int, long))
+               for cur, prev in zip(current, previous)]
+
+    if all(integer) or not any(integer):
+        return _typed_deltas(current, previous, interval, all(integer))
+
+    # Integer and float slices apart, merged back in order
+    retval = [0] * len(current)
+    for kind in (True, False):
+        positions = [i for i, is_int in enumerate(integer) if is_int == kind]
+        deltas = _typed_deltas([current[i] for i in positions],
+                               [previous[i] for i in positions], interval, kind)
+
+        for i, delta in zip(positions, deltas):
+            retval[i] = delta
+
+    return retval
+
+
+def _typed_deltas(current, previous, interval, integer):
+    """
+    @param integer: all values are integers
+    @return: list of differences, see _counter_deltas
+    """
+    np = _numpy() if len(current) >= NUMPY_MIN_SIZE else None
+
+    try:
+        if np:
+            dtype = np.int64 if integer else np.float64
+            cur = np.array(current, dtype=dtype)
+            prev = np.array(previous, dtype=dtype)
+
+            delta = cur - prev
+            delta[(prev == 0) | (delta < 0)] = 0
+
+            if interval:
+                delta = delta // interval if integer else delta / interval
+
+            return delta.tolist()
+
+        typecode = 'l' if integer else 'd'
+        cur = _array.array(typecode, current)
+        prev = _array.array(typecode, previous)
+
+    except OverflowError:
+        # Too big for 64 bits integers
+        cur = current
+        prev = previous
+
+    retval = [0] * len(cur)
+    for i in xrange(len(cur)):
+        if prev[i] and cur[i] > prev[i]:
+            retval[i] = (cur[i] - prev[i]) / interval if interval else cur[i] - prev[i]
+
+    return retval
+
+
+_numpy_module = None
+
+
+def _numpy():
+    """
+    @return: numpy module or None, imported on first use
+    """
+    global _numpy_module
+
+    if _numpy_module is None:
+        try:
+            import numpy
+            _numpy_module = numpy
+        except ImportError:
+            _numpy_module = False
+
+    return _numpy_module or None
+
+
+class LazyModule:
+    """
+    Module imported on first attribute access, so optional dependencies
+    are only loaded on the code path that needs them
+    """
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def _load(self):
+        if self._module is None:
+            self._module = import_module(self._name)
+
+        return self._module
+
+    def loaded(self):
+        return self._module is not None
+
+    def available(self):
+        """
+        @return: True if the module can be imported
+        """
+        try:
+            self._load()
+            return True
+
+        except Exception:
+            return False
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+
+def lazy_import(name):
+    """
+    @return: LazyModule for name
+    """
+    return LazyModule(name)
+
+
+_resource = lazy_import('resource')
+
+# Loaded on the code paths using them, a check run only pays for the
+# modules it needs (MPLUGIN_PROFILE=1 reports the import times)
+_mstate = lazy_import('__mstate')
+_mlog = lazy_import('__mlog')
+_mconfig = lazy_import('__mconfig')
+_mcodec = lazy_import('__mcodec')
+_mcompact = lazy_import('__mcompact')
+
+_array = lazy_import('array')
+_base64 = lazy_import('base64')
+_math = lazy_import('math')
+_threading = lazy_import('threading')
+_zlib = lazy_import('zlib')
+
+
+def _max_rss():
+    """
+    @return: peak RSS in KB of the process, None if unknown
+    """
+    # ru_maxrss may include the parent before exec on Linux
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+
+    except (IOError, ValueError):
+        pass
+
+    if _resource.available():
+        return _resource.getrusage(_resource.RUSAGE_SELF).ru_maxrss
+
+    return None
+
+
+class MPlugin:
+    def __init__(self, plugin_path=None, embedded=False):
+        # Embedded plugins return results instead of exit
+        self.embedded = embedded
+        self._profile_mark('imports')
 
         if plugin_path:
             self.path = abspath(plugin_path)
@@ -62,53 +683,123 @@ class MPlugin:
         else:
             self.path = abspath(dirname(sys.argv[0]))
             
-        # Configure log
+        # Queued rotating log, the file is opened on the first record
         if self.path:
-            log.basicConfig(
-                filename=join(self.path, LOG_FILE_NAME),
-                format='%(levelname)s:%(message)s',
-                level=log.DEBUG
-            )
+            _mlog.setup(join(self.path, LOG_FILE_NAME))
         
-        # Read configuration
-        self.data = self._read_config()
-
-        # Build config hash
-        self.config = {}
-        for idx in self.data.get('config', {}).keys():
-            self.config[idx] = self.data.get('config').get(idx, {}).get('value', None)
+        # Read configuration, parsed once per change of data.json
+        time_config = time()
+        self._config_entry = self._read_config()
+        time_config = time() - time_config
+        self._profile_mark('config')
+
+        # Copies, plugins may change their data or config
+        self.data = dict(self._config_entry.data)
+        self.config = dict(self._config_entry.config)
             
         # set id and interval
         self.interval = self.data.get('interval', DEFAULT_INTERVAL)
         self.id = str(self.data.get('id', None))
+        self.adaptive = self._adaptive_config()
+        self.delta_snapshot = self._delta_config()
+
+        # Samples per interval, the GaugeSampler is kept by a runner
+        self.sampling = self._sampling_config()
+        self.sampler = None
+        self._sampling = False
+
+        # Result format of the installation, a runner sets its own
+        self.compact = environ.get(_mcodec.FORMAT_ENV) == _mcodec.FORMAT_COMPACT
+
+        # Earlier runs of this plugin in the process, set by a runner
+        self.runs = 0
+
+        # Log level of this plugin, embedded ones set it on execute()
+        self.log_level = self.data.get('log_level')
+        if not self.embedded:
+            _mlog.set_context(self.id, self.log_level)
+
+        # set alarm for timeout (standalone process only, embedded
+        # checks get their deadline from the runner)
+        self.timeout = int(self.data.get('timeout', CHECK_TIMEOUT))
+        if not self.embedded:
+            signal.signal(signal.SIGALRM, _timeout)
+            signal.alarm(self.timeout)
             
         # Get name from config or filename
-        self.name = str(self.data.get('name', basename(sys.argv[0])))
+        if self.embedded:
+            self.name = str(self.data.get('name', basename(self.path)))
+
+        else:
+            self.name = str(self.data.get('name', basename(sys.argv[0])))
         
         # Initialize variables for counters and intervals
         self._time_start = time()
         self._time_interval = None
         self._counters = None
 
+        # Shared state store, opened on first use
+        self._store = None
+        self._state = None
+
+        # HTTP responses by request key
+        self._http_responses = {}
+
+        # FetchCache shared with other checks, set by a runner
+        self.fetch_cache = None
+
+        # Phase timings for the result, seconds
+        self._perf = None
+        if self.data.get('perf') or environ.get(PERF_ENV):
+            self._perf = {'config': time_config, 'counters': 0.0}
+
+        self._profile_mark('init')
+
     def write_config(self, config=None):
         if not config or not self._is_dict(config):
             return
 
         # Same config?
         json_config = self._to_json(config)
-        if self.data.get('.raw', '') == json_config:
+        if self._config_entry.hash == _mconfig.content_hash(json_config):
             return
 
         # Read from configfile
         config_file = join(self.path, CONFIG_FILE_NAME)
         if self.path in config_file:
             self._file_write(config_file, json_config)
+            _mconfig.invalidate(config_file)
             log.info("Updating config")
 
         else:
             log.warning("Unable to find data file")
 
     def exit(self, state, data=None, metrics=None, message=None):
+        result = self.result(state, data, metrics, message)
+
+        if self.embedded:
+            raise result
+
+        if self.compact:
+            sys.stdout.write(_mcompact.frame(result.encode(compact=True)))
+        else:
+            sys.stdout.write(result.to_json() + '\n')
+
+        if _profile:
+            self._profile_mark('serialisation')
+            _profile.write()
+
+        sys.exit(state)
+
+    def result(self, state, data=None, metrics=None, message=None):
+        """
+        Build check result, writes counters and interval
+
+        @return: CheckResult
+        """
+        self._profile_mark('collection')
+        time_result = time()
+
         if not message or not self._is_string(message):
             message = ' '.join([self.name, self._state_to_str(state)])
 
@@ -117,89 +808,326 @@ class MPlugin:
 
         if not metrics or not self._is_dict(metrics):
             metrics = {}
-            
-        # Sanitize
-        data = self._sanitize(data)
-        metrics = self._sanitize(metrics)
-            
+
+        # exit() called from sample(), nothing to report or store
+        if self._sampling:
+            return CheckResult(state, id=self.id, name=self.name, message=message)
+
+        if self.sampler:
+            for name, summary in self.sampler.summary().iteritems():
+                metrics[SAMPLER_GROUP % name] = summary
+
+        next_interval = None
+        if self.adaptive:
+            next_interval = self._adaptive_interval(state, metrics, data)
+
+        schema = None
+        if self.compact:
+            schema = self._compact_schema(metrics)
+
+        delta = None
+        if self.delta_snapshot:
+            data, delta = self._delta_data(data)
+
         # Write counters and interval
-        self._counters_write()
-        self._interval_write()
-        
-        print str(
-            self._to_json({
-                'id': self.id,
-                'name': self._to_utf8(self.name),
-                'message': self._to_utf8(message),
-                'data': self._to_utf8(data),
-                'metrics': self._to_utf8(metrics),
-                'interval': self._get_time_interval()
-            }).encode('utf-8')
+        self._state_write()
+        self._profile_mark('counters')
+
+        time_end = time()
+
+        perf = None
+        if self._perf is not None:
+            perf = self._perf_result(time_result, time_end)
+
+        return CheckResult(
+            state,
+            id=self.id,
+            name=self.name,
+            message=message,
+            data=data,
+            metrics=metrics,
+            interval=self._get_time_interval(),
+            next_interval=next_interval,
+            schema=schema,
+            delta=delta,
+            timings={
+                'start': self._time_start,
+                'end': time_end,
+                'duration': time_end - self._time_start
+            },
+            perf=perf
         )
-        
-        sys.exit(state)
+
+    def _perf_result(self, time_result, time_end):
+        """
+        @return: performance section, serialisation is added when encoding
+        """
+        retval = dict(self._perf)
+
+        # Counters processed while collecting don't count as collection
+        retval['collection'] = max(time_result - self._time_start - self._perf['counters'], 0)
+        retval['counters'] = self._perf['counters'] + time_end - time_result
+
+        # Process wide figures only mean something for standalone runs
+        if not self.embedded:
+            user, system, children_user, children_system = os_times()[:4]
+            retval['cpu_user'] = user + children_user
+            retval['cpu_sys'] = system + children_system
+            retval['max_rss'] = _max_rss()
+
+        return retval
+
+    def execute(self):
+        """
+        Run check without leaving the process
+
+        @return: CheckResult
+        """
+        self.embedded = True
+        _mlog.set_context(self.id, self.log_level)
+
+        try:
+            self.run()
+
+        except CheckResult, result:
+            return result
+
+        finally:
+            _mlog.clear_context()
+
+        # run() must finish with exit()
+        return self.result(UNKNOWN, message="Check finished without result")
+
+    def http_requests(self):
+        """
+        HTTP requests needed by run(), a runner fetches them ahead
+        and concurrently with other plugins
+
+        @return: list of HTTPRequest
+        """
+        return []
+
+    def sample(self):
+        """
+        Cheap readings of gauges, taken by a runner several times per
+        interval when sampling is enabled
+
+        @return: {gauge name: number} or None
+        """
+        return None
+
+    def take_sample(self):
+        """
+        Call sample() on a fresh fetch, errors and exit() inside give None
+
+        @return: {gauge name: number} or None
+        """
+        self.embedded = True
+        self._sampling = True
+        self._http_responses = {}
+        _mlog.set_context(self.id, self.log_level)
+
+        try:
+            return self.sample()
+
+        except CheckResult, result:
+            log.debug("Sample failed: %s" % result.message)
+
+        except Exception:
+            log.exception("Sample failed")
+
+        finally:
+            self._sampling = False
+            _mlog.clear_context()
+
+        return None
+
+    def source_key(self):
+        """
+        Source read by this check, checks of a runner with the same key
+        and interval are started together to share fetched data
+
+        @return: hashable key or None
+        """
+        return None
+
+    def fetch_cached(self, key, func, ttl=None, credentials=None):
+        """
+        Call func() or return the value fetched by another check of the
+        runner for the same key, the value must not be changed
+
+        @param key: source and query, e.g. ('redis', host, port, 'info')
+        @param credentials: tuple (user, password...) used by func, only
+                            its fingerprint is added to the key
+        @return: func() result
+        """
+        if self.fetch_cache is None:
+            return func()
+
+        if credentials is not None:
+            key = tuple(key) + (import_module('__mpool').fingerprint(credentials),)
+
+        return self.fetch_cache.fetch(key, func, ttl)
+
+    @contextmanager
+    def db_connection(self, key, connect, validate=None, close=None, credentials=None):
+        """
+        Database connection for the with block. Embedded checks take it
+        from the runner pool and give it back afterwards (closed if the
+        block raised), standalone ones connect and close.
+
+        @param key: (driver, host, port, user, database)
+        @param connect: function returning a new connection
+        @param validate: function raising if a pooled connection is unusable
+        @param close: function closing a connection, default conn.close()
+        @param credentials: tuple (user, password...) used by connect, only
+                            its fingerprint is added to the pool key
+        """
+        if not self.embedded:
+            conn = connect()
+            try:
+                yield conn
+            finally:
+                try:
+                    (close or (lambda c: c.close()))(conn)
+                except Exception:
+                    pass
+
+            return
+
+        # Import by name, "from __mpool" would be mangled inside a class
+        mpool = import_module('__mpool')
+        key = tuple(key) + (mpool.fingerprint(credentials),)
+
+        pool = mpool.ConnectionPool.shared()
+        pooled = pool.acquire(key, connect, validate, close or (lambda c: c.close()))
+
+        try:
+            yield pooled.conn
+
+        except CheckResult, result:
+            # exit() inside the block, a failure may come from the connection
+            pool.release(pooled, error=result.state != OK)
+            raise
+
+        except BaseException:
+            pool.release(pooled, error=True)
+            raise
+
+        pool.release(pooled)
+
+    def http_prefetched(self, requests, responses):
+        for request, response in zip(requests, responses):
+            self._http_responses[request.key] = response
+
+    def http_fetch(self, request):
+        """
+        Fetch request or return prefetched response
+
+        @param request: HTTPRequest
+        @return: HTTPResponse
+        """
+        response = self._http_responses.get(request.key)
+
+        if response is None:
+            # Import by name, "from __mhttp" would be mangled inside a class
+            response = import_module('__mhttp').fetch(request)
+            self._http_responses[request.key] = response
+
+        return response
 
     def install(self, id, config, script):
         if not id or not config or not script:
             log.error("install: Invalid information received")
             return False
 
-        plugin_path = abspath(join(self.path, id))
-        if not exists(plugin_path):
-            makedirs(plugin_path)
+        return self.install_bulk([(id, config, script)])
 
-        self.path = plugin_path
-
-        # Write new configuration
-        self.write_config(config)
-
-        # Write script
-        script_file = join(plugin_path, id)
-        self._file_write(script_file, script)
+    def install_bulk(self, plugins):
+        """
+        Install many plugins at once, scripts are stored once by content
 
-        chmod(script_file, 0755)
-        return True
+        @param plugins: list of (id, config, script)
+        @return: True if the whole batch was applied, nothing changes otherwise
+        """
+        return import_module('__minstall').Installer(self.path).install(plugins)
 
     def uninstall(self, id):
-        plugin_path = abspath(join(self.path, id))
-        move_to = abspath(join(self.path, '.' + id))
-
-        # Exists and is inside our plugin path
-        if exists(plugin_path) and self.path in plugin_path:
-            from shutil import move
+        return self.uninstall_bulk([id])
 
-            move(plugin_path, move_to)
-            return True
-
-        return False
+    def uninstall_bulk(self, ids):
+        """
+        @return: True if every plugin was uninstalled, nothing changes otherwise
+        """
+        return import_module('__minstall').Installer(self.path).uninstall(ids)
         
     def _read_config(self):
-        retval = {}
-
-        # Read from configfile
+        """
+        @return: ConfigEntry from the shared config cache
+        """
         config_file = join(self.path, CONFIG_FILE_NAME)
-        if exists(config_file):
-            content = self._file_read(config_file)
-            retval = self._from_json(content)
-
-            if not retval:
-                log.warning("Invalid data in file: %s" % config_file)
+        retval = _mconfig.load_config(config_file)
 
-            # Add raw config
-            retval['.raw'] = content
-
-        else:
+        if not retval.exists:
             log.warning("Data file doesn't exists: %s" % config_file)
 
         return retval
         
+    def _state_store(self):
+        """
+        @return: StateStore shared by plugins in our parent path, None
+                 when not available (counter and touch files are used)
+        """
+        if self._store is None:
+            self._store = _mstate.StateStore.shared(dirname(self.path)) or False
+
+        return self._store or None
+
+    def _state_key(self):
+        # Plugin directory is named as plugin id
+        return basename(self.path)
+
+    def _state_read(self):
+        """
+        @return: ({index: value}, last update time) from state store
+        """
+        if self._state is None:
+            self._state = self._state_store().load(self._state_key())
+
+        return self._state
+
+    def _state_write(self):
+        store = self._state_store()
+
+        if not store:
+            self._counters_write()
+            self._interval_write()
+            return
+
+        values = dict(self._counters or {})
+        values[TIME_INDEX] = self._time_start
+
+        store.save(self._state_key(), values)
+
     def _counters_read(self):
+        if self._state_store():
+            values, updated = self._state_read()
+            counters = dict((idx, values[idx]) for idx in values if idx != TIME_INDEX)
+
+            if counters:
+                if updated > time() - self._counters_max_age():
+                    return counters
+
+                log.warning("Ignored counters, are too old")
+                return {}
+
+        # Counters file, also used to migrate to state store
         counters_file = join(self.path, COUNTER_FILE_NAME)
         
         if exists(counters_file):
             # check last modification time
             mod_time = getmtime(counters_file)
-            valid_time = time() - self.interval - 30
+            valid_time = time() - self._counters_max_age()
             
             if mod_time > valid_time:
                 return self._from_json(self._file_read(counters_file))
@@ -213,6 +1141,164 @@ class MPlugin:
             counters_file = join(self.path, COUNTER_FILE_NAME)
             self._file_write(counters_file, self._to_json(self._counters))
 
+    def _counters_max_age(self):
+        # Adaptive checks may run up to their max interval apart
+        interval = self.adaptive['max_interval'] if self.adaptive else self.interval
+        return interval + 30
+
+    def _adaptive_config(self):
+        """
+        @return: {'max_interval', 'tolerance'} or None if not enabled
+        """
+        adaptive = self.data.get('adaptive')
+        if not adaptive:
+            return None
+
+        if not self._is_dict(adaptive):
+            adaptive = {}
+
+        try:
+            base = int(self.interval)
+            return {
+                'max_interval': max(int(adaptive.get('max_interval', base * ADAPTIVE_MAX_FACTOR)), base),
+                'tolerance': float(adaptive.get('tolerance', ADAPTIVE_TOLERANCE))
+            }
+
+        except (TypeError, ValueError):
+            log.warning("Invalid adaptive configuration, disabled")
+            return None
+
+    def _adaptive_interval(self, state, metrics, data):
+        """
+        Double the interval while state is the same, every number of
+        metrics and data is within tolerance of the previous run and
+        anything else (strings, hashes, states) is equal; back to base
+        on any change
+
+        @return: seconds until the next run
+        """
+        if self._counters is None:
+            self._counters = self._counters_read()
+
+        base = int(self.interval)
+        previous = self._counters.get(ADAPTIVE_INDEX) or {}
+
+        observed = {'metrics': metrics, 'data': data}
+        current = dict(zip(*_flatten(observed)))
+        others = sorted(_other_leaves(observed))
+        digest = '%08x' % (_zlib.crc32(repr(others)) & 0xffffffff)
+
+        # Nothing to compare counts as changed
+        stable = (current or others) and previous.get('state') == state and previous.get('digest') == digest
+
+        interval = base
+        if stable and self._within_tolerance(previous.get('metrics'), current):
+            interval = min(int(previous.get('interval', base)) * 2, self.adaptive['max_interval'])
+
+        self._counters[ADAPTIVE_INDEX] = {'state': state, 'interval': interval, 'metrics': current,
+                                          'digest': digest}
+        return interval
+
+    def _sampling_config(self):
+        """
+        @return: samples per interval, None if not enabled
+        """
+        sampling = self.data.get('sampling')
+        if not sampling:
+            return None
+
+        if sampling is True:
+            return SAMPLER_SAMPLES
+
+        try:
+            return min(max(int(sampling), 2), SAMPLER_MAX_SAMPLES)
+
+        except (TypeError, ValueError):
+            log.warning("Invalid sampling configuration, disabled")
+            return None
+
+    def _delta_config(self):
+        """
+        @return: runs between full snapshots, None if not enabled
+        """
+        delta = self.data.get('delta')
+        if not delta:
+            return None
+
+        if not self._is_dict(delta):
+            delta = {}
+
+        try:
+            return max(int(delta.get('snapshot', DELTA_SNAPSHOT)), 1)
+
+        except (TypeError, ValueError):
+            log.warning("Invalid delta configuration, disabled")
+            return None
+
+    def _delta_data(self, data):
+        """
+        Diff data against the previous result, kept with the counters,
+        full snapshot on the first run of a runner. Receivers merge
+        changed keys into their copy (dicts recursively) and drop removed
+        key paths; a gap in seq means waiting for the next full snapshot.
+
+        @return: (data to send, delta section)
+        """
+        if self._counters is None:
+            self._counters = self._counters_read()
+
+        # Compare as sent and as stored: JSON types, UTF-8 text
+        current = _mcodec.loads(_mcodec.encode(data))
+        previous = self._counters.get(DELTA_INDEX) or {}
+
+        seq = int(previous.get('seq', 0)) + 1
+        runs = int(previous.get('runs', 0)) + 1
+
+        # Counters expired or lost, snapshot due or first run of a runner
+        full = 'data' not in previous or runs >= self.delta_snapshot or (self.embedded and not self.runs)
+
+        self._counters[DELTA_INDEX] = {'seq': seq, 'runs': 0 if full else runs, 'data': current}
+
+        if full:
+            return data, {'seq': seq, 'full': True}
+
+        removed = []
+        changed = _diff(previous['data'], current, [], removed)
+
+        return changed, {'seq': seq, 'removed': removed}
+
+    def _compact_schema(self, metrics):
+        """
+        Metric key paths are sent when they changed since the last
+        run, every SCHEMA_RESEND runs and on the first run of a runner
+
+        @return: (schema id, key paths, values, send key paths)
+        """
+        if self._counters is None:
+            self._counters = self._counters_read()
+
+        schema_id, paths, values = _mcompact.schema_of(metrics)
+        previous = self._counters.get(SCHEMA_INDEX) or [None, 0]
+
+        send = previous[0] != schema_id or previous[1] + 1 >= _mcompact.SCHEMA_RESEND
+        if self.embedded and not self.runs:
+            send = True
+
+        self._counters[SCHEMA_INDEX] = [schema_id, 0 if send else previous[1] + 1]
+
+        return schema_id, paths, values, send
+
+    def _within_tolerance(self, previous, current):
+        if previous is None or set(previous) != set(current):
+            return False
+
+        tolerance = self.adaptive['tolerance']
+        for idx, value in current.iteritems():
+            if abs(value - previous[idx]) > tolerance * max(abs(value), abs(previous[idx])):
+                return False
+
+        return True
+
     def _interval_write(self):
         touch_file = join(self.path, TOUCH_FILE_NAME)
         with open(touch_file, 'a'):
@@ -220,53 +1306,50 @@ class MPlugin:
             
     def _get_time_interval(self):
         """
-        Read modification time from touch file and calculate
-        interval from last run time
+        Read last run time from state store (or modification time
+        from touch file) and calculate interval from last run time
 
         @return: interval
         """
         if self._time_interval:
             return self._time_interval
 
-        touch_file = join(self.path, TOUCH_FILE_NAME)
+        last_time = None
+        if self._state_store():
+            last_time = self._state_read()[0].get(TIME_INDEX)
 
+        touch_file = join(self.path, TOUCH_FILE_NAME)
+        if not last_time and exists(touch_file):
+            last_time = getmtime(touch_file)
 
         retval = 1
-        if exists(touch_file):
-            tmp = int(time() - getmtime(touch_file))
+        if last_time:
+            tmp = int(time() - last_time)
             retval = tmp if tmp > 0 else 1
 
         self._time_interval = retval
         return retval
 
     # Helper functions
-    def _sanitize(self, obj, recursion=0):
-        if not self._is_dict(obj):
-            return obj
-
-        # Avoid recursion loop
-        recursion += 1
-        if recursion > 100:
-            return obj
-
-        for idx in obj:
-            if self._is_dict(obj[idx]):
-                obj[idx] = self._sanitize(obj[idx], recursion)
-
-            elif self._is_list(obj[idx]):
-                obj[idx] = self._sanitize(obj[idx], recursion)
-
-            elif self._is_string:
-                obj[idx] = str(obj[idx])
-                pass
+    @staticmethod
+    def which(program):
+        """
+        @return: full path of program in PATH, None if not found
+        """
+        for path in environ.get('PATH', '').split(pathsep):
+            candidate = join(path, program)
+            if isfile(candidate) and access(candidate, X_OK):
+                return candidate
 
-            elif self._is_number(obj[idx]):
-                pass
+        return None
 
-            else:
-                obj[idx] = str(obj[idx])
+    def _profile_mark(self, phase):
+        if _profile and not self.embedded:
+            _profile.mark(phase)
 
-        return obj
+    def _perf_add(self, phase, start):
+        if self._perf is not None:
+            self._perf[phase] += time() - start
 
     def gauge(self, value, interval=None):
         """
@@ -287,6 +1370,8 @@ class MPlugin:
         if not self._is_number(value):
             return value
 
+        start = time()
+
         # Read counters
         if self._counters is None:
             self._counters = self._counters_read()
@@ -301,75 +1386,89 @@ class MPlugin:
         # Save counter
         self._counters[index] = value
 
+        self._perf_add('counters', start)
         return retval if retval > 0 else 0
 
-    def counters(self, obj, index, gauge=True):
+    def counter_history(self, value, index, size=HISTORY_SIZE):
         """
-            Save values for metrics, compare with latest values and return difference
-            convert counter values to average values
+            Add value to the sample history of a counter
+            @return: CounterHistory
         """
+        start = time()
 
         # Read counters
         if self._counters is None:
             self._counters = self._counters_read()
 
-        if not self._counters.get(index):
-            self._counters[index] = {}
+        history = CounterHistory.decode(self._counters.get(HISTORY_INDEX + index), size)
+        if self._is_number(value):
+            history.add(self._time_start, value)
 
-        if not self._counters.get(INTERVAL_INDEX):
-            self._counters[INTERVAL_INDEX] = {}
+        self._counters[HISTORY_INDEX + index] = history.encode()
 
-        # Read interval from last counter
-        interval = self._get_counter_interval(index)
+        self._perf_add('counters', start)
+        return history
 
-        current_counter = self._counters[index]
-        new_counter = {}
-        retval = {}
+    def counter_rates(self, value, index, windows=None, size=HISTORY_SIZE):
+        """
+            Saves a value in counter history and returns rates over
+            windows (1, 5 and 15 minutes by default), peak and smoothed rate
+        """
+        if windows is None:
+            windows = RATE_WINDOWS
 
-        if not self._is_dict(obj):
-            return retval
+        history = self.counter_history(value, index, size)
 
-        for elm in obj:
-            new_counter[elm] = {}
-            retval[elm] = {}
-            
-            if not current_counter.get(elm):
-                current_counter[elm] = {}
+        retval = {
+            'peak': history.peak_rate(),
+            'smoothed': history.smoothed_rate()
+        }
 
-            # Go deeper if is dict
-            if self._is_dict(obj.get(elm)):
-                for elm2 in obj[elm]:
-                    new_counter[elm][elm2] = {}
-                    retval[elm][elm2] = {}
+        for name, window in windows.items():
+            retval[name] = history.rate(window, self._time_start)
 
-                    # Update counter with current value
-                    new_counter[elm][elm2] = obj[elm][elm2]
-                    retval[elm][elm2] = 0
+        return retval
 
-                    if current_counter[elm].get(elm2):
-                        diff = obj[elm][elm2] - current_counter[elm].get(elm2)
-                        if diff > 0:
-                            retval[elm][elm2] = self.gauge(diff, interval) if gauge else diff
+    def counters(self, obj, index, gauge=True, key=None):
+        """
+            Save values for metrics, compare with latest values and return difference
+            convert counter values to average values.
 
-            elif self._is_list(obj.get(elm)):
-                # Not supported
-                continue
+            Dicts are walked at any depth, lists of records are matched
+            between runs by their "key" field (by position if not given).
+            Returns the same shape as obj, non numeric values untouched.
+        """
+        start = time()
 
-            else:
-                # Update counter with current value
-                new_counter[elm] = obj[elm]
-                retval[elm] = 0
+        # Read counters
+        if self._counters is None:
+            self._counters = self._counters_read()
+
+        if not self._counters.get(INTERVAL_INDEX):
+            self._counters[INTERVAL_INDEX] = {}
+
+        # Read interval from last counter
+        interval = self._get_counter_interval(index) or self._get_time_interval()
+
+        if not self._is_dict(obj) and not self._is_list(obj):
+            self._perf_add('counters', start)
+            return {}
+
+        paths, values = _flatten(obj, key)
+
+        # Stored counters are flat, older nested ones flatten the same way
+        previous = dict(zip(*_flatten(self._counters.get(index) or {})))
+        previous = [previous.get(path, 0) for path in paths]
 
-                # Return difference between last counter and current
-                if current_counter.get(elm):
-                    diff = obj[elm] - current_counter.get(elm)
-                    if diff > 0:
-                        retval[elm] = self.gauge(diff, interval) if gauge else diff
+        deltas = _counter_deltas(values, previous, interval if gauge else None)
 
         # Update index and last used time
-        self._counters[index] = new_counter
+        self._counters[index] = dict(zip(paths, values))
         self._counters[INTERVAL_INDEX][index] = time()
 
+        retval = _unflatten(obj, key, iter(deltas))
+
+        self._perf_add('counters', start)
         return retval
 
     def _get_counter_interval(self, index):
@@ -396,21 +1495,6 @@ class MPlugin:
     def to_mb(self, n):
         return self._convert_bytes(n, 'M')
 
-    def _to_utf8(self, elm):
-        # FIXME: Do it recursive
-        from codecs import decode
-        if self._is_dict(elm):
-            for key in elm.keys():
-                if self._is_dict(elm[key]):
-                    for key2 in elm[key].keys():
-                        if self._is_string(elm[key][key2]):
-                            elm[key][key2] = decode(elm[key][key2], 'utf-8', 'ignore')
-
-                if self._is_string(elm[key]):
-                    elm[key] = decode(elm[key], 'utf-8', 'ignore')
-
-        return elm
-
     @staticmethod
     def _state_to_str(state):
         states = {
@@ -426,12 +1510,10 @@ class MPlugin:
 
     @staticmethod
     def _from_json(string):
-        import simplejson as json
-
         retval = {}
 
         try:
-            retval = json.loads(string)
+            retval = _mcodec.loads(string)
         except:
             pass
 
@@ -439,12 +1521,10 @@ class MPlugin:
         
     @staticmethod
     def _to_json(elm):
-        import simplejson as json
-
         retval = ''
 
         try:
-            retval = json.dumps(elm).encode('utf8')
+            retval = _mcodec.dumps(elm)
         except:
             pass
 
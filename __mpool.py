@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+
+# -*- coding:utf-8 -*-
+
+# Copyright (C) 2012 Juan Carlos Moreno <juancarlos.moreno at ecmanaged.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Database connections kept alive between check runs of a resident runner.
+
+Connections are pooled by (driver, host, port, user, database) and a
+fingerprint of the credentials, so checks with other credentials never
+share an authenticated connection. A
+connection is used by one check at a time, validated with a cheap
+driver call (ping, SELECT 1) when taken from the pool, closed after an
+error inside the check and recycled after POOL_MAX_AGE seconds. Idle
+ones are closed after POOL_MAX_IDLE, e.g. when their check is removed.
+"""
+
+POOL_MAX_AGE = 3600
+POOL_MAX_IDLE = 600
+POOL_MAX_IDLE_PER_KEY = 4
+
+import hashlib
+import threading
+
+from time import time
+
+import logging
+log = logging
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def fingerprint(*credentials):
+    """
+    @return: hash of credentials for pool and cache keys, never the
+             credentials themselves
+    """
+    return hashlib.sha1(repr(credentials)).hexdigest()
+
+
+def _close(conn):
+    conn.close()
+
+
+class PooledConnection:
+    def __init__(self, key, conn, close=_close):
+        self.key = key
+        self.conn = conn
+        self.close_func = close
+
+        self.created = time()
+        self.released = self.created
+
+    def close(self):
+        try:
+            self.close_func(self.conn)
+        except Exception, e:
+            log.debug("Unable to close connection %s: %s" % (self.key[:3], e))
+
+
+class ConnectionPool:
+    def __init__(self, max_age=POOL_MAX_AGE, max_idle=POOL_MAX_IDLE, per_key=POOL_MAX_IDLE_PER_KEY):
+        self.max_age = max_age
+        self.max_idle = max_idle
+        self.per_key = per_key
+
+        self.lock = threading.Lock()
+        self.idle = {}
+
+        self._reset_stats()
+
+    def _reset_stats(self):
+        self.created = 0
+        self.reused = 0
+        self.discarded = 0
+
+    @classmethod
+    def shared(cls):
+        """
+        @return: ConnectionPool of the process
+        """
+        global _shared
+
+        with _shared_lock:
+            if _shared is None:
+                _shared = cls()
+
+            return _shared
+
+    def acquire(self, key, connect, validate=None, close=_close):
+        """
+        Idle connection for key that passes validate(conn), or a new one
+
+        @param key: (driver, host, port, user, database)
+        @param connect: function returning a new connection
+        @return: PooledConnection
+        """
+        while True:
+            with self.lock:
+                expired = self._expire()
+
+                idle = self.idle.get(key)
+                pooled = idle.pop() if idle else None
+
+            for conn in expired:
+                conn.close()
+
+            if pooled is None:
+                break
+
+            try:
+                if validate:
+                    validate(pooled.conn)
+
+            except Exception, e:
+                log.debug("Discarding connection %s: %s" % (key[:3], e))
+                self._discard(pooled)
+                continue
+
+            with self.lock:
+                self.reused += 1
+
+            return pooled
+
+        pooled = PooledConnection(key, connect(), close)
+
+        with self.lock:
+            self.created += 1
+
+        return pooled
+
+    def release(self, pooled, error=False):
+        """
+        Return connection to the pool, closed if it failed or is too old
+        """
+        now = time()
+
+        if error or now - pooled.created > self.max_age:
+            self._discard(pooled)
+            return
+
+        pooled.released = now
+
+        with self.lock:
+            idle = self.idle.setdefault(pooled.key, [])
+            if len(idle) < self.per_key:
+                idle.append(pooled)
+                return
+
+        self._discard(pooled)
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, {}
+
+        for pooled in [p for conns in idle.values() for p in conns]:
+            pooled.close()
+
+    def stats(self, reset=True):
+        """
+        @return: connection counts since last call
+        """
+        with self.lock:
+            retval = {
+                'created': self.created,
+                'reused': self.reused,
+                'discarded': self.discarded,
+                'idle': sum(len(conns) for conns in self.idle.values())
+            }
+
+            if reset:
+                self._reset_stats()
+
+        return retval
+
+    def _discard(self, pooled):
+        with self.lock:
+            self.discarded += 1
+
+        pooled.close()
+
+    def _expire(self):
+        """
+        Remove idle connections past their max idle time or age,
+        called with the lock held
+
+        @return: list of removed PooledConnection to close
+        """
+        now = time()
+        retval = []
+
+        for key, conns in self.idle.items():
+            expired = [p for p in conns if now - p.released > self.max_idle or now - p.created > self.max_age]
+            if not expired:
+                continue
+
+            self.idle[key] = [p for p in conns if p not in expired]
+            if not self.idle[key]:
+                del self.idle[key]
+
+            self.discarded += len(expired)
+            retval.extend(expired)
+
+        return retval
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+
+# -*- coding:utf-8 -*-
+
+# Copyright (C) 2012 Juan Carlos Moreno <juancarlos.moreno at ecmanaged.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Cold start profiling for standalone plugin runs.
+
+Enabled with MPLUGIN_PROFILE=1 in the environment. Every module import
+after __mplugin is loaded is timed, and MPlugin marks the end of each
+startup phase. The report is written to stderr as one JSON line so the
+result line on stdout is left untouched.
+"""
+
+PROFILE_ENV = 'MPLUGIN_PROFILE'
+PROFILE_PREFIX = 'profile: '
+
+import sys
+import __builtin__
+
+from time import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+class StartupProfile:
+    def __init__(self):
+        self.started = time()
+        self.last = self.started
+
+        # [name, depth, seconds] in import order
+        self.imports = []
+        self.phases = []
+
+        self._depth = 0
+        self._import = None
+
+    def install(self):
+        """
+        Time imports from now on
+        """
+        self._import = __builtin__.__import__
+        __builtin__.__import__ = self._timed_import
+
+    def uninstall(self):
+        if self._import:
+            __builtin__.__import__ = self._import
+            self._import = None
+
+    def _timed_import(self, name, *args, **kwargs):
+        # Already loaded modules cost nothing worth reporting
+        if name in sys.modules:
+            return self._import(name, *args, **kwargs)
+
+        record = [name, self._depth, 0]
+        self.imports.append(record)
+
+        self._depth += 1
+        start = time()
+        try:
+            return self._import(name, *args, **kwargs)
+
+        finally:
+            record[2] = time() - start
+            self._depth -= 1
+
+    def mark(self, phase):
+        """
+        Close the phase running since the previous mark
+        """
+        now = time()
+        self.phases.append((phase, now - self.last))
+        self.last = now
+
+    def report(self):
+        """
+        @return: dict with times in milliseconds, max rss in KB
+        """
+        retval = {
+            'total': round((time() - self.started) * 1000, 3),
+            'phases': [[name, round(seconds * 1000, 3)] for name, seconds in self.phases],
+            'imports': [[name, depth, round(seconds * 1000, 3)]
+                        for name, depth, seconds in self.imports],
+        }
+
+        if resource:
+            retval['max_rss'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        # Linux only: peak RSS of this image (ru_maxrss can include the
+        # parent before exec), read and write syscalls
+        status = self._proc('/proc/self/status')
+        if 'VmHWM' in status:
+            retval['max_rss'] = int(status['VmHWM'].split()[0])
+
+        io = self._proc('/proc/self/io')
+        if 'syscr' in io:
+            retval['syscalls'] = {'read': int(io['syscr']), 'write': int(io['syscw'])}
+
+        return retval
+
+    @staticmethod
+    def _proc(path):
+        try:
+            with open(path) as f:
+                return dict(line.split(':', 1) for line in f.read().splitlines() if ':' in line)
+
+        except IOError:
+            return {}
+
+    def write(self, stream=None):
+        # Report is plain data, stdlib json keeps the codec out of the profile
+        import json
+
+        self.uninstall()
+        (stream or sys.stderr).write(PROFILE_PREFIX + json.dumps(self.report()) + '\n')
@@ -0,0 +1,848 @@
+#!/usr/bin/env python
+
+# -*- coding:utf-8 -*-
+
+# Copyright (C) 2012 Juan Carlos Moreno <juancarlos.moreno at ecmanaged.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Resident plugin runner.
+
+Reads the installed plugins from the plugins path manifest, imports
+every plugin class once and calls run() on its interval inside this
+process, so checks do not pay interpreter startup and module imports on
+every execution.
+
+    python __mrunner.py [--once] [--workers N] [--spool TARGET] [--format FORMAT] [plugins_path]
+
+With --spool, results are written to a durable spool under the plugins
+path and delivered from there to TARGET ('-' for stdout, unix:PATH or
+dir:PATH), so a slow or stopped consumer doesn't lose or block results.
+With --format compact (or MPLUGIN_FORMAT=compact), results use the
+compact format of __mcompact.
+
+Plugins with "sampling" in data.json have sample() called several times
+per interval, their results report min, max, mean and p95 of each gauge.
+"""
+
+RUNNER_TICK = 1
+RUNNER_DISCOVER_INTERVAL = 60
+RUNNER_STATS_INTERVAL = 60
+RUNNER_POOL_SIZE = 16
+RUNNER_ID = '__runner__'
+RUNNER_HTTP_ID = '__http__'
+RUNNER_SAMPLE_ID = '__sample__:'
+
+import re
+import sys
+import imp
+import inspect
+import zlib
+import Queue
+import threading
+
+from os import stat, environ
+from os.path import dirname, abspath, join
+from time import time
+
+from __mplugin import MPlugin, CheckResult, GaugeSampler
+from __mplugin import CONFIG_FILE_NAME, LOG_FILE_NAME, DEFAULT_INTERVAL, CHECK_TIMEOUT
+from __mplugin import OK, UNKNOWN, TIMEOUT
+from __mhttp import fetch_all, connection_stats, HTTPResponse, HTTP_PER_HOST
+from __mstate import StateStore
+from __mconfig import load_config
+from __mmanifest import Manifest
+from __mlog import setup as log_setup, LOG_PLUGIN_FORMAT
+from __mcache import FetchCache
+from __mspool import Spool, SpoolDrainer, get_sink
+from __mcompact import FORMAT_ENV, FORMAT_COMPACT, frame as compact_frame, line_frame
+
+import logging
+log = logging
+
+# Compiled scripts by file, plugins sharing a stored script
+# (hard links of one file) compile it once
+_code_cache = {}
+
+
+class PluginEntry:
+    def __init__(self, id, path, script, class_name=None, config_hash=None):
+        self.id = id
+        self.path = path
+        self.script = script
+        self.class_name = class_name
+        self.config_hash = config_hash
+
+        self.klass = None
+        self.mtime = None
+
+        # Source key, checks reading the same source start together
+        self.group = None
+
+        # Results returned since the runner started
+        self.runs = 0
+
+        # Interval adapted by the check, None to use the configured one
+        self.next_interval = None
+
+        # Sub-interval sampling: samples kept between results, the
+        # instance taking them, when the next one is due and how many
+        # were started since the last result
+        self.sampler = None
+        self.sample_plugin = None
+        self.next_sample = None
+        self.sampling = False
+        self.samples_taken = 0
+
+        config = load_config(join(self.path, CONFIG_FILE_NAME)).data
+        self.interval = self._to_int(config.get('interval'), DEFAULT_INTERVAL)
+        self.timeout = self._to_int(config.get('timeout'), CHECK_TIMEOUT)
+
+    @staticmethod
+    def _to_int(value, default):
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return default
+
+    def load(self):
+        """
+        Import plugin script (only if changed) and find its MPlugin class
+
+        @return: plugin class or None
+        """
+        st = stat(self.script)
+        mtime = st.st_mtime
+        if self.klass and self.mtime == mtime:
+            return self.klass
+
+        key = (st.st_dev, st.st_ino, mtime)
+
+        module_name = '_mplugin_' + re.sub(r'\W', '_', self.id)
+        module = imp.new_module(module_name)
+        module.__file__ = self.script
+
+        try:
+            code = _code_cache.get(key)
+            if code is None:
+                f = open(self.script, 'r')
+                source = f.read()
+                f.close()
+
+                # Compile by hand, scripts have no .py extension once installed
+                code = _code_cache[key] = compile(source, self.script, 'exec')
+
+            sys.modules[module_name] = module
+            exec code in module.__dict__
+
+        except Exception:
+            log.exception("Unable to load plugin: %s" % self.script)
+            self.klass = None
+            return None
+
+        self.klass = None
+
+        # Class name from manifest, search module if missing or renamed
+        obj = getattr(module, self.class_name or '', None)
+        if inspect.isclass(obj) and issubclass(obj, MPlugin) and obj is not MPlugin:
+            self.klass = obj
+
+        for obj in vars(module).values():
+            if self.klass:
+                break
+
+            if inspect.isclass(obj) and issubclass(obj, MPlugin) \
+                    and obj is not MPlugin and obj.__module__ == module_name:
+                self.klass = obj
+
+        if not self.klass:
+            log.warning("No plugin class found in %s" % self.script)
+
+        self.mtime = mtime
+        return self.klass
+
+
+class ScheduledJob:
+    def __init__(self, id, interval, group=None):
+        self.id = id
+        self.interval = interval
+        self.group = group
+
+        # Deterministic start offset inside the period, shared by a group
+        self.offset = (zlib.crc32(repr(group) if group else id) & 0xffffffff) % self.interval
+
+        self.next_run = None
+        self.running = False
+
+    def schedule(self, now):
+        """
+        Set next_run to the first slot of this job after now
+        """
+        slot = now - (now - self.offset) % self.interval
+        if slot <= now:
+            slot += self.interval
+
+        self.next_run = slot
+
+
+class Scheduler:
+    """
+    Spread plugin runs across their interval and keep track of
+    schedule lag and overruns
+    """
+    def __init__(self):
+        self.jobs = {}
+        self._reset_stats()
+
+    def _reset_stats(self):
+        self.started = 0
+        self.overruns = 0
+        self.skipped = 0
+        self.lag_total = 0.0
+        self.lag_max = 0.0
+
+    def update(self, id, interval, now=None, group=None):
+        if now is None:
+            now = time()
+
+        interval = max(int(interval), 1)
+
+        job = self.jobs.get(id)
+        if job and job.interval == interval and job.group == group:
+            return job
+
+        new_job = ScheduledJob(id, interval, group)
+        if job:
+            new_job.running = job.running
+
+        new_job.schedule(now)
+        self.jobs[id] = new_job
+
+        return new_job
+
+    def remove(self, id):
+        self.jobs.pop(id, None)
+
+    def due(self, now=None):
+        """
+        Mark due jobs as running
+
+        @return: list of job ids, oldest schedule first
+        """
+        if now is None:
+            now = time()
+
+        retval = []
+        for job in sorted(self.jobs.values(), key=lambda x: x.next_run):
+            if job.next_run > now:
+                continue
+
+            # Never start a check while previous run is alive
+            if job.running:
+                self.overruns += 1
+                self.skipped += 1
+                job.schedule(now)
+                continue
+
+            lag = now - job.next_run
+            self.lag_total += lag
+            self.lag_max = max(self.lag_max, lag)
+            self.started += 1
+
+            job.running = True
+            job.schedule(now)
+            retval.append(job.id)
+
+        return retval
+
+    def done(self, id, now=None):
+        if now is None:
+            now = time()
+
+        job = self.jobs.get(id)
+        if not job:
+            return
+
+        job.running = False
+
+        # Finished after the next slot, skip missed slots
+        if job.next_run <= now:
+            self.overruns += 1
+            self.skipped += 1
+            job.schedule(now)
+
+    def stats(self, reset=True):
+        """
+        @return: scheduler metrics since last call
+        """
+        retval = {
+            'Schedule lag': {
+                'avg': self.lag_total / self.started if self.started else 0,
+                'max': self.lag_max
+            },
+            'Schedule': {
+                'started': self.started,
+                'overruns': self.overruns,
+                'skipped': self.skipped,
+                'jobs': len(self.jobs)
+            }
+        }
+
+        if reset:
+            self._reset_stats()
+
+        return retval
+
+
+class CheckTask:
+    def __init__(self, id, func, timeout):
+        self.id = id
+        self.func = func
+        self.timeout = timeout
+
+        self.queued = time()
+        self.started = None
+        self.finished = None
+
+        self.result = None
+        self.timed_out = False
+
+    def timings(self):
+        now = time()
+        return {
+            'queue': (self.started or now) - self.queued,
+            'run': (self.finished or now) - (self.started or now)
+        }
+
+
+class CheckExecutor:
+    """
+    Thread pool running checks with a deadline for each one.
+
+    Python threads can't be killed: on deadline the task is reported
+    as timed out and its worker is replaced, so siblings keep running.
+    The stuck thread is returned once more (late) when it finishes.
+    """
+    def __init__(self, size=RUNNER_POOL_SIZE):
+        self.size = size
+        self.tasks = Queue.Queue()
+        self.results = Queue.Queue()
+
+        self.lock = threading.Lock()
+        self.running = set()
+        self.inflight = 0
+
+        for i in range(self.size):
+            self._spawn()
+
+    def _spawn(self):
+        worker = threading.Thread(target=self._worker)
+        worker.daemon = True
+        worker.start()
+
+    def _worker(self):
+        while True:
+            task = self.tasks.get()
+
+            with self.lock:
+                task.started = time()
+                self.running.add(task)
+
+            try:
+                task.result = task.func()
+            except BaseException:
+                log.exception("Check %s failed" % task.id)
+
+            with self.lock:
+                task.finished = time()
+                self.running.discard(task)
+                self.results.put(task)
+
+                abandoned = task.timed_out
+                if not abandoned:
+                    self.inflight -= 1
+
+            # A replacement worker was spawned on timeout
+            if abandoned:
+                return
+
+    def submit(self, id, func, timeout=CHECK_TIMEOUT):
+        task = CheckTask(id, func, timeout)
+
+        with self.lock:
+            self.inflight += 1
+
+        self.tasks.put(task)
+        return task
+
+    def pending(self):
+        """
+        @return: tasks queued or running, timed out tasks excluded
+        """
+        with self.lock:
+            return self.inflight
+
+    def collect(self, wait=0):
+        """
+        Wait up to "wait" seconds for finished tasks
+
+        @return: list of finished, timed out or late tasks
+        """
+        retval = []
+
+        try:
+            retval.append(self.results.get(timeout=wait) if wait else self.results.get_nowait())
+            while True:
+                retval.append(self.results.get_nowait())
+        except Queue.Empty:
+            pass
+
+        now = time()
+        with self.lock:
+            for task in list(self.running):
+                if now - task.started < task.timeout:
+                    continue
+
+                task.timed_out = True
+                self.running.discard(task)
+                self.inflight -= 1
+                retval.append(task)
+
+                self._spawn()
+
+        return retval
+
+
+class MRunner:
+    def __init__(self, path=None, workers=RUNNER_POOL_SIZE, spool=None, format=None):
+        if path:
+            self.path = abspath(path)
+
+        else:
+            self.path = abspath(dirname(__file__))
+
+        # Single queued log for every plugin run by this process
+        log_setup(join(self.path, LOG_FILE_NAME), fmt=LOG_PLUGIN_FORMAT)
+
+        self.plugins = {}
+        self.manifest = Manifest(self.path)
+        self.scheduler = Scheduler()
+        self.cache = FetchCache()
+        self.executor = CheckExecutor(workers)
+
+        # Commit state of checks finished in the same tick at once
+        self.store = StateStore.shared(self.path)
+        if self.store:
+            self.store.batch = True
+
+        self.compact = (format or environ.get(FORMAT_ENV)) == FORMAT_COMPACT
+        self.frame = compact_frame if self.compact else line_frame
+
+        # Results go through the on-disk spool to the delivery target
+        self.spool = None
+        self.drainer = None
+        if spool:
+            self.spool = Spool(self.path)
+            self.drainer = SpoolDrainer(self.spool, get_sink(spool, self.frame))
+
+    def discover(self):
+        """
+        Register installed plugins from the manifest, the plugin
+        path is only walked when the manifest is missing or invalid
+        """
+        found = {}
+
+        records = self.manifest.load()
+        if records is None:
+            log.info("Building plugins manifest in %s" % self.path)
+            records = self.manifest.rebuild()
+
+        for id, record in records.items():
+            script = join(self.path, record['script'])
+
+            # Recreate entry on script or config change
+            entry = self.plugins.get(id)
+            if not entry or entry.script != script or entry.config_hash != record.get('config_hash'):
+                entry = PluginEntry(id, dirname(script), script,
+                                    record.get('class'), record.get('config_hash'))
+
+            found[id] = entry
+            self.scheduler.update(id, entry.next_interval or entry.interval, group=entry.group)
+
+        for id in self.plugins:
+            if id not in found:
+                self.scheduler.remove(id)
+
+        self.plugins = found
+        return self.plugins
+
+    def load_plugin(self, entry):
+        """
+        @param entry: PluginEntry
+        @return: embedded plugin instance or None
+        """
+        klass = entry.load()
+        if not klass:
+            return None
+
+        plugin = klass(entry.path, embedded=True)
+        plugin.fetch_cache = self.cache
+        plugin.compact = self.compact
+        plugin.runs = entry.runs
+        entry.interval = plugin.interval
+
+        if not plugin.sampling:
+            entry.sampler = None
+
+        elif not entry.sampler or entry.sampler.samples != plugin.sampling:
+            entry.sampler = GaugeSampler(plugin.sampling)
+
+        plugin.sampler = entry.sampler
+
+        return plugin
+
+    def run_plugin(self, entry, plugin=None):
+        """
+        Run a plugin inside this process
+
+        @param entry: PluginEntry
+        @param plugin: already loaded plugin instance
+        @return: CheckResult or None
+        """
+        try:
+            if plugin is None:
+                plugin = self.load_plugin(entry)
+
+            if not plugin:
+                return None
+
+            if entry.group is None:
+                entry.group = plugin.source_key()
+
+            return plugin.execute()
+
+        except SystemExit, e:
+            # Plugin called sys.exit by itself
+            return CheckResult(e.code, id=entry.id, message="Check exited without result")
+
+        except Exception:
+            log.exception("Plugin %s failed" % entry.id)
+            return CheckResult(UNKNOWN, id=entry.id, message="Check failed")
+
+    def submit(self, entries):
+        """
+        Queue plugins to executor, HTTP requests of all plugins
+        are fetched first in a single batch
+        """
+        batch = []
+
+        for entry in entries:
+            plugin = None
+            requests = []
+
+            try:
+                # Only plugins declaring HTTP requests are created here,
+                # the others once by run_plugin()
+                klass = entry.load()
+                if klass and klass.http_requests.im_func is not MPlugin.http_requests.im_func:
+                    plugin = self.load_plugin(entry)
+                    requests = plugin.http_requests()
+                    entry.group = plugin.source_key() or (requests[0].key if requests else None)
+
+            except (CheckResult, Exception):
+                # Let run() report invalid configuration
+                requests = []
+
+            if requests:
+                batch.append((entry, plugin, requests))
+            else:
+                self.executor.submit(entry.id, lambda entry=entry: self.run_plugin(entry), entry.timeout)
+
+        if batch:
+            # Requests never outlive the deadline of the checks using them
+            for entry, plugin, reqs in batch:
+                for request in reqs:
+                    request.timeout = min(request.timeout, entry.timeout)
+
+            timeout = max(r.timeout for entry, plugin, reqs in batch for r in reqs)
+            self.executor.submit(RUNNER_HTTP_ID, lambda: self._fetch_batch(batch), timeout + RUNNER_TICK)
+
+    def _fetch_batch(self, batch):
+        """
+        Fetch each distinct request once, every plugin is queued as soon
+        as its own responses are complete with the rest of its deadline
+        """
+        started = time()
+
+        requests = {}
+        for entry, plugin, reqs in batch:
+            for request in reqs:
+                # Shortest deadline of the plugins sharing a request
+                if request.key in requests:
+                    request.timeout = min(request.timeout, requests[request.key].timeout)
+                requests[request.key] = request
+
+        # Responses of this tick are reused
+        fetched = dict((key, self.cache.get(key)) for key in requests)
+        missing = [key for key, response in fetched.items() if response is None]
+
+        pending = {}
+        for item in batch:
+            keys = set(r.key for r in item[2] if fetched[r.key] is None)
+            if keys:
+                for key in keys:
+                    pending.setdefault(key, []).append((item, keys))
+            else:
+                self._submit_fetched(item, fetched, started)
+
+        def fetched_one(index, response):
+            key = missing[index]
+            fetched[key] = response
+            if not response.error:
+                self.cache.put(key, response)
+
+            for item, keys in pending.pop(key, []):
+                keys.discard(key)
+                if not keys:
+                    self._submit_fetched(item, fetched, started)
+
+        try:
+            fetch_all([requests[key] for key in missing], per_host=HTTP_PER_HOST, callback=fetched_one)
+
+        finally:
+            # Batch failed, checks still waiting report it instead of
+            # staying scheduled as running
+            for index, key in enumerate(missing):
+                if fetched[key] is None:
+                    fetched_one(index, HTTPResponse(requests[key].url, error="HTTP batch failed"))
+
+    def _submit_fetched(self, item, fetched, started):
+        entry, plugin, reqs = item
+        plugin.http_prefetched(reqs, [fetched[r.key] for r in reqs])
+
+        # Time spent fetching counts against the check deadline
+        timeout = max(entry.timeout - (time() - started), RUNNER_TICK)
+        self.executor.submit(entry.id, lambda: self.run_plugin(entry, plugin), timeout)
+
+    def run_pending(self, now=None):
+        self.submit([self.plugins[id] for id in self.scheduler.due(now)])
+
+    def run_samples(self, now=None):
+        """
+        Queue a sample of plugins with sampling enabled, spread evenly
+        between their runs
+        """
+        if now is None:
+            now = time()
+
+        for entry in self.plugins.values():
+            if not entry.sampler or entry.sampling or entry.next_sample is None or now < entry.next_sample:
+                continue
+
+            # Late runs don't get extra samples
+            if entry.samples_taken >= entry.sampler.samples:
+                continue
+
+            step = self._sample_step(entry)
+            entry.sampling = True
+            entry.next_sample = now + step
+            entry.samples_taken += 1
+
+            self.executor.submit(RUNNER_SAMPLE_ID + entry.id, lambda entry=entry: self._sample(entry), step)
+
+    def _sample(self, entry):
+        # One instance per entry takes every sample
+        if entry.sample_plugin is None:
+            entry.sample_plugin = self.load_plugin(entry)
+
+        values = entry.sample_plugin.take_sample() if entry.sample_plugin else None
+        if values and entry.sampler:
+            entry.sampler.add(values)
+
+    @staticmethod
+    def _sample_step(entry):
+        return max(float(entry.interval) / entry.sampler.samples, RUNNER_TICK)
+
+    def run_finished(self, wait=0):
+        for task in self.executor.collect(wait):
+            if task.id == RUNNER_HTTP_ID:
+                if task.timed_out and not task.finished:
+                    log.warning("HTTP batch timed out")
+                continue
+
+            if task.id.startswith(RUNNER_SAMPLE_ID):
+                entry = self.plugins.get(task.id[len(RUNNER_SAMPLE_ID):])
+
+                # Stuck samples are not retaken until they finish
+                if entry and task.finished:
+                    entry.sampling = False
+                continue
+
+            entry = self.plugins.get(task.id)
+
+            if task.timed_out and not task.finished:
+                # Job stays running in scheduler until thread ends
+                result = CheckResult(TIMEOUT, id=task.id,
+                                     message="Check timed out after %ds" % task.timeout)
+
+            else:
+                self.scheduler.done(task.id)
+
+                # Interval changed in config or adapted by the check
+                if entry:
+                    entry.next_interval = getattr(task.result, 'next_interval', None)
+                    self.scheduler.update(task.id, entry.next_interval or entry.interval, group=entry.group)
+
+                if entry and task.result:
+                    entry.runs += 1
+
+                # K samples spread from each result to the next run, one
+                # still running counts as the first
+                if entry and entry.sampler:
+                    entry.next_sample = time() + (self._sample_step(entry) if entry.sampling else 0)
+                    entry.samples_taken = 1 if entry.sampling else 0
+
+                # Late result, timeout already sent
+                if task.timed_out:
+                    continue
+
+                result = task.result or CheckResult(
+                    UNKNOWN, id=task.id, message="Unable to load check")
+
+            result.timings.update(task.timings())
+            self.emit(result)
+
+        if self.store:
+            self.store.flush()
+
+        if self.spool:
+            self.spool.flush()
+            self.drainer.notify()
+
+    def run_stats(self):
+        metrics = self.scheduler.stats()
+        metrics['Fetch cache'] = self.cache.stats()
+        metrics['HTTP connections'] = connection_stats()
+
+        # Only when a check used a database connection
+        if '__mpool' in sys.modules:
+            metrics['Connection pool'] = sys.modules['__mpool'].ConnectionPool.shared().stats()
+
+        if self.spool:
+            metrics['Spool'] = self.spool.stats()
+
+        message = "%d checks started, %d overruns" % (
+            metrics['Schedule']['started'], metrics['Schedule']['overruns'])
+
+        self.emit(CheckResult(OK, id=RUNNER_ID, name='MONITOR RUNNER',
+                              message=message, metrics=metrics,
+                              interval=RUNNER_STATS_INTERVAL))
+
+    def emit(self, result):
+        # Exit code is not available to consumers, add it to the result
+        extra = {} if self.compact else {'state': result.state}
+
+        if 'queue' in result.timings:
+            extra['timings'] = {
+                'queue': result.timings['queue'],
+                'run': result.timings['run']
+            }
+
+        try:
+            record = result.encode(extra, self.compact)
+
+        except Exception, e:
+            # Don't lose the other results of the tick
+            log.error("Unable to encode result of %s: %s" % (result.id, e))
+            self.emit(CheckResult(UNKNOWN, id=result.id, name=result.name,
+                                  message="Unable to encode result", interval=result.interval))
+            return
+
+        if self.spool:
+            self.spool.append(record)
+            return
+
+        sys.stdout.write(self.frame(record))
+        sys.stdout.flush()
+
+    def close(self):
+        """
+        Write pending results to the spool and stop delivery
+        """
+        if not self.spool:
+            return
+
+        self.spool.flush()
+        self.drainer.stop()
+        self.spool.close()
+
+    def loop(self, once=False):
+        last_discover = 0
+        last_stats = time()
+
+        if once:
+            self.submit(self.discover().values())
+
+            while self.executor.pending():
+                self.run_finished(RUNNER_TICK)
+
+            self.run_finished()
+
+            # Deliver everything spooled before exiting
+            if self.drainer:
+                self.drainer.stop()
+                while self.drainer.drain_once():
+                    pass
+
+            return
+
+        while True:
+            # Manifest is rewritten by install and uninstall
+            if time() - last_discover > RUNNER_DISCOVER_INTERVAL or self.manifest.changed():
+                self.discover()
+                last_discover = time()
+
+            self.run_pending()
+            self.run_samples()
+
+            if time() - last_stats > RUNNER_STATS_INTERVAL:
+                self.run_stats()
+                last_stats = time()
+
+            self.run_finished(RUNNER_TICK)
+
+
+if __name__ == '__main__':
+    from optparse import OptionParser
+
+    parser = OptionParser(usage='%prog [--once] [--workers N] [--spool TARGET] [--format FORMAT] [plugins_path]')
+    parser.add_option('--once', action='store_true', default=False,
+                      help='run every plugin once and exit')
+    parser.add_option('--workers', type='int', default=RUNNER_POOL_SIZE,
+                      help='concurrent checks (default: %default)')
+    parser.add_option('--spool', metavar='TARGET',
+                      help='spool results and deliver them to -, unix:PATH or dir:PATH')
+    parser.add_option('--format', choices=['json', 'compact'],
+                      help='result format (default: json, or MPLUGIN_FORMAT)')
+    (options, args) = parser.parse_args()
+
+    runner = MRunner(args[0] if args else None, workers=options.workers,
+                     spool=options.spool, format=options.format)
+
+    try:
+        runner.loop(once=options.once)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        runner.close()
@@ -0,0 +1,460 @@
+#!/usr/bin/env python
+
+# -*- coding:utf-8 -*-
+
+# Copyright (C) 2012 Juan Carlos Moreno <juancarlos.moreno at ecmanaged.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Durable spool of results between the runner and its consumer.
+
+Records are buffered and written as zlib compressed blocks (length and
+crc32 header) of length prefixed records to numbered segment files,
+fsync'ed on flush. A drain thread reads blocks from the acknowledged
+position, hands them to a sink and moves the position forward only once the sink accepted them;
+fully delivered segments are deleted. A slow or missing consumer makes
+the spool grow up to SPOOL_MAX_BYTES, then the oldest segments are
+dropped.
+
+Sinks write every record framed by the result format (a JSON line, or
+a length prefixed compact record):
+    stream:         write records to stdout
+    unix:PATH       send records and an empty one to a unix socket, the
+                    consumer answers "OK" once stored
+    dir:PATH        write a file per batch (tmp and rename), paused
+                    while SPOOL_MAX_PENDING files are not picked up
+"""
+
+SPOOL_DIR_NAME = '.spool'
+SPOOL_ACK_FILE = 'ack'
+SPOOL_SEGMENT_SUFFIX = '.seg'
+
+SPOOL_MAX_BYTES = 64 * 1024 * 1024
+SPOOL_SEGMENT_BYTES = 1024 * 1024
+SPOOL_BLOCK_BYTES = 64 * 1024
+SPOOL_BATCH_BLOCKS = 16
+SPOOL_MAX_PENDING = 100
+SPOOL_RETRY = 5
+
+import os
+import sys
+import zlib
+import errno
+import struct
+import socket
+import threading
+
+from os.path import join, isdir, getsize
+from time import time
+
+from __mcodec import loads as json_loads, dumps as json_dumps
+from __mcompact import line_frame
+
+import logging
+log = logging
+
+BLOCK_HEADER = struct.Struct('>II')
+RECORD_HEADER = struct.Struct('>I')
+
+
+class SpoolBusy(Exception):
+    """
+    Sink can't take more results now, retried later
+    """
+    pass
+
+
+class Spool:
+    def __init__(self, path, max_bytes=SPOOL_MAX_BYTES, segment_bytes=SPOOL_SEGMENT_BYTES):
+        self.path = join(path, SPOOL_DIR_NAME)
+        self.max_bytes = max_bytes
+        self.segment_bytes = segment_bytes
+
+        if not isdir(self.path):
+            os.makedirs(self.path)
+
+        self.lock = threading.Lock()
+        self.buffer = []
+        self.buffered = 0
+
+        self.segments = self._segments()
+        self.position = self._read_ack()
+
+        # Never append to a segment of a previous process, its tail
+        # may be a block cut by a crash
+        self.seq = (self.segments[-1] + 1) if self.segments else 1
+        self.active = None
+        self._open(self.seq)
+
+        self._reset_stats()
+
+    def _reset_stats(self):
+        self.appended = 0
+        self.delivered = 0
+        self.dropped = 0
+
+    def append(self, record):
+        with self.lock:
+            self.buffer.append(RECORD_HEADER.pack(len(record)) + record)
+            self.buffered += len(record)
+            self.appended += 1
+
+            if self.buffered >= SPOOL_BLOCK_BYTES:
+                self._write_block()
+
+    def flush(self, sync=True):
+        """
+        Write buffered records as a block, to disk if sync
+        """
+        with self.lock:
+            self._write_block()
+            self.active.flush()
+
+            if sync:
+                os.fsync(self.active.fileno())
+
+    def read(self, max_blocks=SPOOL_BATCH_BLOCKS):
+        """
+        Blocks after the acknowledged position
+
+        @return: (list of records, position after them)
+        """
+        with self.lock:
+            segments = list(self.segments)
+            seq, offset = self.position
+
+        records = []
+        blocks = 0
+
+        for current in [s for s in segments if s >= seq]:
+            if current != seq:
+                offset = 0
+
+            try:
+                with open(self._segment_file(current), 'rb') as f:
+                    f.seek(offset)
+
+                    while blocks < max_blocks:
+                        block = self._read_block(f)
+                        if block is None:
+                            break
+
+                        records.extend(block)
+                        blocks += 1
+                        offset = f.tell()
+
+            except IOError, e:
+                # Dropped by _limit() once the lock was released
+                if e.errno != errno.ENOENT:
+                    raise
+
+                seq, offset = current + 1, 0
+                continue
+
+            seq = current
+            if blocks >= max_blocks or current == self.seq:
+                break
+
+            # Segment done, continue on the next one
+            seq, offset = current + 1, 0
+
+        return records, (seq, offset)
+
+    def ack(self, position, count=0):
+        """
+        Mark everything before position as delivered
+        """
+        with self.lock:
+            self.position = position
+            self.delivered += count
+            self._write_ack()
+
+            for seq in [s for s in self.segments if s < position[0] and s != self.seq]:
+                self._remove(seq)
+
+    def pending(self):
+        """
+        @return: bytes on disk not yet delivered
+        """
+        with self.lock:
+            return sum(self._size(seq) for seq in self.segments if seq >= self.position[0]) - self.position[1]
+
+    def stats(self, reset=True):
+        retval = {
+            'appended': self.appended,
+            'delivered': self.delivered,
+            'dropped': self.dropped,
+            'pending bytes': self.pending()
+        }
+
+        if reset:
+            self._reset_stats()
+
+        return retval
+
+    def close(self):
+        self.flush()
+        with self.lock:
+            self.active.close()
+
+    def _write_block(self):
+        if not self.buffer:
+            return
+
+        data = zlib.compress(''.join(self.buffer))
+        self.active.write(BLOCK_HEADER.pack(len(data), zlib.crc32(data) & 0xffffffff) + data)
+
+        self.buffer = []
+        self.buffered = 0
+
+        if self.active.tell() >= self.segment_bytes:
+            self.active.close()
+            self._open(self.seq + 1)
+
+        self._limit()
+
+    @staticmethod
+    def _read_block(f):
+        """
+        @return: list of records, None at the end or on an incomplete block
+        """
+        header = f.read(BLOCK_HEADER.size)
+        if len(header) < BLOCK_HEADER.size:
+            return None
+
+        size, crc = BLOCK_HEADER.unpack(header)
+        data = f.read(size)
+
+        if len(data) < size or zlib.crc32(data) & 0xffffffff != crc:
+            return None
+
+        data = zlib.decompress(data)
+        retval = []
+        pos = 0
+
+        while pos < len(data):
+            size = RECORD_HEADER.unpack_from(data, pos)[0]
+            pos += RECORD_HEADER.size
+            retval.append(data[pos:pos + size])
+            pos += size
+
+        return retval
+
+    def _open(self, seq):
+        self.seq = seq
+        self.active = open(self._segment_file(seq), 'ab')
+
+        if seq not in self.segments:
+            self.segments.append(seq)
+
+    def _limit(self):
+        """
+        Drop oldest segments over max_bytes, called with the lock held
+        """
+        sizes = dict((seq, self._size(seq)) for seq in self.segments)
+
+        while sum(sizes.values()) > self.max_bytes and len(self.segments) > 1:
+            seq = self.segments[0]
+            log.warning("Spool full, dropping undelivered segment %d" % seq)
+
+            self._remove(seq)
+            del sizes[seq]
+            self.dropped += 1
+
+            if self.position[0] <= seq:
+                self.position = (self.segments[0], 0)
+                self._write_ack()
+
+    def _remove(self, seq):
+        try:
+            os.unlink(self._segment_file(seq))
+        except OSError:
+            pass
+
+        self.segments.remove(seq)
+
+    def _size(self, seq):
+        if seq == self.seq:
+            return self.active.tell()
+
+        try:
+            return getsize(self._segment_file(seq))
+        except OSError:
+            return 0
+
+    def _segments(self):
+        return sorted(int(name[:-len(SPOOL_SEGMENT_SUFFIX)]) for name in os.listdir(self.path)
+                      if name.endswith(SPOOL_SEGMENT_SUFFIX) and name[:-len(SPOOL_SEGMENT_SUFFIX)].isdigit())
+
+    def _segment_file(self, seq):
+        return join(self.path, '%020d%s' % (seq, SPOOL_SEGMENT_SUFFIX))
+
+    def _read_ack(self):
+        try:
+            with open(join(self.path, SPOOL_ACK_FILE), 'r') as f:
+                seq, offset = json_loads(f.read())
+                return int(seq), int(offset)
+
+        except (IOError, ValueError, TypeError):
+            return (self.segments[0] if self.segments else 1), 0
+
+    def _write_ack(self):
+        ack_file = join(self.path, SPOOL_ACK_FILE)
+
+        with open(ack_file + '.tmp', 'w') as f:
+            f.write(json_dumps(list(self.position)))
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.rename(ack_file + '.tmp', ack_file)
+
+
+class StreamSink:
+    def __init__(self, stream=None, frame=line_frame):
+        self.stream = stream or sys.stdout
+        self.frame = frame
+
+    def send(self, records):
+        self.stream.write(''.join(self.frame(r) for r in records))
+        self.stream.flush()
+
+
+class UnixSocketSink:
+    def __init__(self, path, timeout=30, frame=line_frame):
+        self.path = path
+        self.timeout = timeout
+        self.frame = frame
+        self.sock = None
+        self.reader = None
+
+    def send(self, records):
+        try:
+            if not self.sock:
+                self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                self.sock.settimeout(self.timeout)
+                self.sock.connect(self.path)
+                self.reader = self.sock.makefile('r')
+
+            # Empty record ends the batch
+            self.sock.sendall(''.join(self.frame(r) for r in records + ['']))
+
+            if self.reader.readline().strip() != 'OK':
+                raise SpoolBusy("Batch not acknowledged by %s" % self.path)
+
+        except (socket.error, SpoolBusy):
+            self.close()
+            raise
+
+    def close(self):
+        # Reader holds its own reference to the socket
+        for f in (self.reader, self.sock):
+            if f:
+                try:
+                    f.close()
+                except socket.error:
+                    pass
+
+        self.sock = None
+        self.reader = None
+
+
+class DirectorySink:
+    def __init__(self, path, max_pending=SPOOL_MAX_PENDING, frame=line_frame):
+        self.path = path
+        self.max_pending = max_pending
+        self.frame = frame
+        self.count = 0
+
+    def send(self, records):
+        pending = [f for f in os.listdir(self.path) if f.endswith('.json')]
+        if len(pending) >= self.max_pending:
+            raise SpoolBusy("%d files pending in %s" % (len(pending), self.path))
+
+        self.count += 1
+        name = join(self.path, 'results-%d-%d-%d.json' % (int(time() * 1000), os.getpid(), self.count))
+
+        with open(name + '.tmp', 'wb') as f:
+            f.write(''.join(self.frame(r) for r in records))
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.rename(name + '.tmp', name)
+
+
+def get_sink(target, frame=line_frame):
+    """
+    @param target: '-' or 'stream', 'unix:PATH' or 'dir:PATH'
+    @param frame: function framing a record for the stream
+    """
+    if target.startswith('unix:'):
+        return UnixSocketSink(target[5:], frame=frame)
+
+    if target.startswith('dir:'):
+        return DirectorySink(target[4:], frame=frame)
+
+    return StreamSink(frame=frame)
+
+
+class SpoolDrainer:
+    """
+    Thread delivering spooled records to a sink
+    """
+    def __init__(self, spool, sink, interval=1):
+        self.spool = spool
+        self.sink = sink
+        self.interval = interval
+
+        self.wakeup = threading.Event()
+        self.stopped = False
+
+        self.thread = threading.Thread(target=self._drain)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _drain(self):
+        while not self.stopped:
+            if not self.drain_once():
+                self.wakeup.wait(self.interval)
+                self.wakeup.clear()
+
+    def drain_once(self):
+        """
+        @return: True if a batch was delivered
+        """
+        try:
+            records, position = self.spool.read()
+            if not records:
+                # Skip over segments without blocks
+                if position != self.spool.position:
+                    self.spool.ack(position)
+                return False
+
+            self.sink.send(records)
+
+        except (SpoolBusy, IOError, OSError, socket.error), e:
+            # Back-pressure or spool read error, kept until retried
+            log.warning("Spool delivery paused: %s" % e)
+            self.wakeup.wait(SPOOL_RETRY)
+            return False
+
+        self.spool.ack(position, len(records))
+        return True
+
+    def notify(self):
+        self.wakeup.set()
+
+    def stop(self):
+        self.stopped = True
+        self.wakeup.set()
+        self.thread.join()
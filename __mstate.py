@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+
+# -*- coding:utf-8 -*-
+
+# Copyright (C) 2012 Juan Carlos Moreno <juancarlos.moreno at ecmanaged.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Host wide state store for plugin counters and last run times.
+
+One SQLite database (WAL mode) for every plugin, with a row per plugin
+holding all its values as a JSON blob, so a run costs one row write
+whatever the number of counters. A runner can batch the writes of all
+checks finished in the same tick in one transaction.
+"""
+
+STATE_FILE_NAME = '.state.db'
+STATE_TIMEOUT = 10
+
+# Stored as user_version once the database is set up
+STATE_SCHEMA_VERSION = 1
+
+import threading
+
+from os.path import join, abspath
+from time import time
+
+from __mcodec import loads as json_loads, dumps as json_dumps
+
+import_error = False
+try:
+    import sqlite3
+except ImportError:
+    import_error = True
+
+import logging
+log = logging
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+class StateStore:
+    def __init__(self, path):
+        self.path = join(abspath(path), STATE_FILE_NAME)
+        self.lock = threading.RLock()
+
+        # Commit on every save unless batching
+        self.batch = False
+
+        # Encoded values not committed yet, by plugin
+        self._pending = {}
+
+        self.conn = sqlite3.connect(self.path, timeout=STATE_TIMEOUT, check_same_thread=False)
+
+        # No fsync, as with the counter files a crash loses at most the
+        # last run. It was most of the cost of a standalone check write
+        self.conn.execute('PRAGMA synchronous=OFF')
+
+        # Rollback journal kept between commits: creating and unlinking it
+        # in a directory holding every plugin, or WAL index setup and
+        # checkpoint on close, cost more than a transaction per run
+        self.conn.execute('PRAGMA journal_mode=TRUNCATE')
+
+        # The table persists in the file, a standalone check opening the
+        # store on every run only reads the version
+        if self.conn.execute('PRAGMA user_version').fetchone()[0] != STATE_SCHEMA_VERSION:
+            self.conn.execute(
+                'CREATE TABLE IF NOT EXISTS plugin_state ('
+                'plugin TEXT PRIMARY KEY, value TEXT NOT NULL, updated REAL)'
+            )
+            self.conn.execute('PRAGMA user_version = %d' % STATE_SCHEMA_VERSION)
+            self.conn.commit()
+
+    @staticmethod
+    def shared(path):
+        """
+        @return: StateStore for path, None if sqlite is not available
+        """
+        if import_error:
+            return None
+
+        path = abspath(path)
+        with _stores_lock:
+            if path not in _stores:
+                try:
+                    _stores[path] = StateStore(path)
+                except sqlite3.Error, e:
+                    log.warning("Unable to open state store in %s: %s" % (path, e))
+                    _stores[path] = None
+
+            return _stores[path]
+
+    def load(self, plugin):
+        """
+        @return: ({index: value}, last update time)
+        """
+        with self.lock:
+            # Write not committed yet
+            if plugin in self._pending:
+                return json_loads(self._pending[plugin]), time()
+
+            row = self.conn.execute(
+                'SELECT value, updated FROM plugin_state WHERE plugin = ?', (plugin,)).fetchone()
+
+        if not row:
+            return {}, 0
+
+        try:
+            return json_loads(row[0]), row[1]
+
+        except ValueError, e:
+            log.warning("Ignored invalid state of %s: %s" % (plugin, e))
+            return {}, 0
+
+    def save(self, plugin, values):
+        """
+        Write all values of a plugin
+
+        @param values: {index: value}, any JSON serializable value
+        """
+        with self.lock:
+            self._pending[plugin] = json_dumps(values)
+
+            if not self.batch:
+                self.flush()
+
+    def flush(self):
+        """
+        Commit pending writes in a single transaction
+        """
+        with self.lock:
+            if not self._pending:
+                return
+
+            now = time()
+            rows = [(plugin, value, now) for plugin, value in self._pending.items()]
+
+            try:
+                with self.conn:
+                    self.conn.executemany(
+                        'INSERT OR REPLACE INTO plugin_state (plugin, value, updated) '
+                        'VALUES (?, ?, ?)', rows)
+
+                self._pending = {}
+
+            except sqlite3.Error, e:
+                log.warning("Unable to write state: %s" % e)
+
+    def remove(self, plugin):
+        """
+        Forget the state of an uninstalled plugin
+        """
+        with self.lock:
+            self._pending.pop(plugin, None)
+
+            try:
+                with self.conn:
+                    self.conn.execute('DELETE FROM plugin_state WHERE plugin = ?', (plugin,))
+
+            except sqlite3.Error, e:
+                log.warning("Unable to remove state of %s: %s" % (plugin, e))
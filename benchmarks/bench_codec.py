@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+
+"""
+Compare JSON codecs on realistic plugin payloads: a full varnishstat -j
+dump and a Kubernetes node list, plus the codec __mcodec picked.
+
+    python benchmarks/bench_codec.py [nodes] [runs]
+"""
+
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from time import time
+
+import __mcodec
+
+
+def varnishstat(counters=600):
+    retval = {'timestamp': '2016-01-01T00:00:00'}
+    for i in range(counters):
+        retval['MAIN.counter_%d' % i] = {
+            'description': 'Counter number %d of the varnish main section' % i,
+            'type': 'MAIN', 'flag': 'c' if i % 3 else 'g', 'format': 'i',
+            'value': i * 1234567
+        }
+
+    return retval
+
+
+def node_list(nodes):
+    items = []
+    for i in range(nodes):
+        items.append({
+            'metadata': {
+                'name': 'node-%d.cluster.local' % i,
+                'uid': '0b6c%028x' % i,
+                'labels': {'kubernetes.io/hostname': 'node-%d' % i, 'zone': u'z\xf3na-%d' % (i % 3)},
+                'creationTimestamp': '2016-01-01T00:00:00Z'
+            },
+            'status': {
+                'capacity': {'cpu': '8', 'memory': '32766Mi', 'pods': '110'},
+                'allocatable': {'cpu': '7800m', 'memory': '31000Mi', 'pods': '110'},
+                'conditions': [
+                    {'type': t, 'status': 'False', 'reason': 'Kubelet%s' % t,
+                     'lastHeartbeatTime': '2016-01-01T00:00:00Z'}
+                    for t in ('OutOfDisk', 'MemoryPressure', 'DiskPressure', 'Ready')
+                ],
+                'addresses': [{'type': 'InternalIP', 'address': '10.0.%d.%d' % (i / 256, i % 256)}],
+                'images': [{'names': ['registry/image-%d:1.%d' % (j, i)], 'sizeBytes': 123456789 + j}
+                           for j in range(10)]
+            }
+        })
+
+    return {'kind': 'NodeList', 'apiVersion': 'v1', 'items': items}
+
+
+def codecs():
+    retval = []
+
+    try:
+        import ujson
+        retval.append(('ujson', ujson.loads,
+                       lambda obj: ujson.dumps(obj, ensure_ascii=True, double_precision=15)))
+    except ImportError:
+        pass
+
+    try:
+        import simplejson
+        retval.append(('simplejson', simplejson.loads, simplejson.dumps))
+    except ImportError:
+        pass
+
+    import json
+    retval.append(('json', json.loads, json.dumps))
+    retval.append(('__mcodec (%s)' % __mcodec.CODEC_NAME, __mcodec.loads, __mcodec.dumps))
+
+    return retval
+
+
+def measure(func, arg, runs):
+    start = time()
+    for i in range(runs):
+        func(arg)
+
+    return (time() - start) / runs
+
+
+if __name__ == '__main__':
+    nodes = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    runs = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+
+    for payload_name, payload in (('varnishstat', varnishstat()), ('node list', node_list(nodes))):
+        encoded = __mcodec.dumps(payload)
+        print '%s: %d bytes' % (payload_name, len(encoded))
+
+        for name, loads, dumps in codecs():
+            print '  %-28s dumps %8.3f ms  loads %8.3f ms' % (
+                name, measure(dumps, payload, runs) * 1000, measure(loads, encoded, runs) * 1000)
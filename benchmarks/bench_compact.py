@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+
+"""
+Compare JSON result lines with the compact format on check_postgres
+like results (five metric groups per database), steady state records
+without the schema and the first one with it.
+
+    python benchmarks/bench_compact.py [databases] [runs]
+"""
+
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from time import time
+
+import __mcodec
+import __mcompact
+from __mplugin import CheckResult, OK
+
+
+def postgres_metrics(databases):
+    retval = {}
+    for i in range(databases):
+        db = 'database_%d' % i
+        retval['Commits and rollbacks on %s' % db] = {'commits': i * 1000, 'rollbacks': i}
+        retval['Rows returned and fetched on %s' % db] = {'returned': i * 5000, 'fetched': i * 4000}
+        retval['Rows inserted, updated and deleted on %s' % db] = {
+            'inserted': i * 10, 'updated': i * 20, 'deleted': i * 30}
+        retval['Blocks read and hit on %s' % db] = {'read': i * 7, 'hit': i * 70000}
+        retval['Connections on %s' % db] = {'connections': i % 50}
+
+    return retval
+
+
+def measure(func, arg, runs):
+    start = time()
+    for i in range(runs):
+        func(arg)
+
+    return (time() - start) / runs
+
+
+if __name__ == '__main__':
+    databases = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    runs = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+
+    metrics = postgres_metrics(databases)
+    schema_id, paths, values = __mcompact.schema_of(metrics)
+
+    json_line = CheckResult(OK, id='pg', name='POSTGRES', message='OK', metrics=metrics, interval=60).to_json()
+    first = CheckResult(OK, id='pg', name='POSTGRES', message='OK', metrics=metrics, interval=60,
+                        schema=(schema_id, paths, values, True)).encode(compact=True)
+    steady = CheckResult(OK, id='pg', name='POSTGRES', message='OK', metrics=metrics, interval=60,
+                         schema=(schema_id, paths, values, False)).encode(compact=True)
+
+    decoder = __mcompact.Decoder()
+    decoder.decode(first)
+
+    print 'compact encoding: %s' % ('msgpack' if __mcompact._packer() else 'json')
+    print '  %-24s %7d bytes  decode %8.3f ms' % ('json line', len(json_line),
+                                                  measure(__mcodec.loads, json_line, runs) * 1000)
+    print '  %-24s %7d bytes  decode %8.3f ms' % ('compact with schema', len(first),
+                                                  measure(decoder.decode, first, runs) * 1000)
+    print '  %-24s %7d bytes  decode %8.3f ms  (raw record %8.3f ms)' % (
+        'compact', len(steady), measure(decoder.decode, steady, runs) * 1000,
+        measure(__mcompact.decode, steady, runs) * 1000)
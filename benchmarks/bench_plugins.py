@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+
+"""
+Cost of one check for every plugin with a local stand-in service, at
+several payload scales. Each plugin runs as a fresh process against the
+fakes in benchmarks/fakes.py and reports median wall time, CPU time,
+syscalls and peak RSS.
+
+The slope line is the growth exponent of CPU time between the two
+largest scales, minus the smallest scale as startup cost: around 1 is
+linear, clearly above 1 means the plugin degrades super-linearly with
+payload size. Small CPU differences make it noisy for flat plugins.
+
+Syscalls are counted with strace when installed, otherwise only read
+and write syscalls are reported from /proc.
+
+    python benchmarks/bench_plugins.py [runs] [scales] [plugin filter]
+    python benchmarks/bench_plugins.py 3 10,1000,10000 haproxy
+"""
+
+import os
+import re
+import sys
+import math
+import shutil
+import tempfile
+import subprocess
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from time import time
+
+from __mcodec import loads, dumps
+from __mprofile import PROFILE_ENV, PROFILE_PREFIX
+
+import fakes
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+TIMEOUT = 30
+
+
+def _spool(services, scale):
+    path = os.path.join(services.root, 'spool')
+    for queue in ('active', 'incoming', 'deferred'):
+        os.makedirs(os.path.join(path, queue))
+        for i in range(scale):
+            open(os.path.join(path, queue, 'msg%d' % i), 'w').close()
+
+    return {'directory': path}
+
+
+def _file(services, scale):
+    path = os.path.join(services.root, 'content.txt')
+    with open(path, 'w') as f:
+        for i in range(scale):
+            f.write('line %d of the monitored file content\n' % i)
+
+    return {'file_path': path}
+
+
+# Plugin script and config for a Services instance and scale
+PLUGINS = [
+    ('check_apache/apache_status.py', lambda s, n: {'url': s.http_url + '/server-status'}),
+    ('check_nginx/nginx_server_status.py', lambda s, n: {'url': s.http_url + '/nginx_status'}),
+    ('check_phpfpm/phpfpm_status.py', lambda s, n: {'url': s.http_url + '/status'}),
+    ('check_haproxy/check_haproxy.py', lambda s, n: {
+        'url': s.http_url, 'username': 'admin', 'password': 'admin'}),
+    ('check_elasticsearch/check_elasticsearch.py', lambda s, n: {'hostname': s.http_url}),
+    ('check_monit/check_monit.py', lambda s, n: {'port': s.http_port}),
+    ('check_kubernetes/kubernetes_api.py', lambda s, n: {'url': s.http_url}),
+    ('check_url/check_url.py', lambda s, n: {'url': s.http_url + '/'}),
+    ('check_tcp/check_tcp.py', lambda s, n: {'host': '127.0.0.1', 'port': s.http_port}),
+    ('check_memcache/check_memcache.py', lambda s, n: {'host': '127.0.0.1', 'port': s.memcache_port}),
+    ('check_redis/redis_status.py', lambda s, n: {'hostname': '127.0.0.1', 'port': s.redis_port}),
+    ('check_redis/redis_queue_length.py', lambda s, n: {
+        'hostname': '127.0.0.1', 'port': s.redis_port, 'queue_name': 'jobs'}),
+    ('check_varnish/varnish_status.py', lambda s, n: {}),
+    ('check_uwsgi/check_uwsgi.py', lambda s, n: {'host': '127.0.0.1', 'port': '1717'}),
+    ('check_rabbitmq/check_rabbitmq.py', lambda s, n: {
+        'rabbitmqctl_path': os.path.join(s.bin, 'rabbitmqctl'), 'action': 'list_queues',
+        'vhost': '/', 'queue': 'queue1', 'parameters': 'messages,consumers,memory'}),
+    ('check_postfix/check_postfix.py', _spool),
+    ('check_file_content/file_content.py', _file),
+]
+
+
+def install(root, script, config):
+    plugin_id = os.path.basename(script)[:-3]
+    target = os.path.join(root, 'plugins', plugin_id)
+    os.makedirs(target)
+    shutil.copy(os.path.join(ROOT, 'mplugins', script), os.path.join(target, plugin_id))
+
+    data = {
+        'id': plugin_id,
+        'timeout': TIMEOUT,
+        'config': dict((k, {'value': v}) for k, v in config.items())
+    }
+    open(os.path.join(target, 'data.json'), 'w').write(dumps(data))
+
+    return os.path.join(target, plugin_id)
+
+
+def _strace():
+    for path in os.environ.get('PATH', '').split(os.pathsep):
+        if os.access(os.path.join(path, 'strace'), os.X_OK):
+            return os.path.join(path, 'strace')
+
+    return None
+
+
+def run(script, env, strace=None):
+    """
+    @return: dict with exit code, wall and cpu seconds, max rss KB, syscalls
+    """
+    stderr = tempfile.TemporaryFile()
+    trace = tempfile.NamedTemporaryFile()
+
+    command = [sys.executable, script]
+    if strace:
+        command = [strace, '-f', '-c', '-o', trace.name] + command
+
+    with open(os.devnull, 'w') as devnull:
+        start = time()
+        proc = subprocess.Popen(command, cwd=os.path.dirname(script), env=env,
+                                stdout=devnull, stderr=stderr)
+        _, status, rusage = os.wait4(proc.pid, 0)
+        elapsed = time() - start
+
+    retval = {
+        'exit': os.WEXITSTATUS(status),
+        'wall': elapsed,
+        'cpu': rusage.ru_utime + rusage.ru_stime,
+        'rss': rusage.ru_maxrss,
+        'syscalls': None
+    }
+
+    # Peak RSS after exec is in the profile, rusage includes the fork
+    report = {}
+    stderr.seek(0)
+    for line in stderr:
+        if line.startswith(PROFILE_PREFIX):
+            report = loads(line[len(PROFILE_PREFIX):])
+
+    retval['rss'] = report.get('max_rss', retval['rss'])
+
+    if strace:
+        total = re.search(r'^-+.*\n\s*[\d.]+\s+[\d.]+\s+(?:\d+\s+)?(\d+)', trace.read(), re.M)
+        if total:
+            retval['syscalls'] = int(total.group(1))
+
+    elif report.get('syscalls'):
+        retval['syscalls'] = report['syscalls']['read'] + report['syscalls']['write']
+
+    return retval
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) / 2]
+
+
+def bench(script, setup, scale, runs, strace):
+    root = tempfile.mkdtemp()
+    services = fakes.Services(scale, root)
+    try:
+        path = install(root, script, setup(services, scale))
+
+        env = dict(os.environ)
+        env[PROFILE_ENV] = '1'
+        env['PYTHONPATH'] = ROOT
+        env['PATH'] = services.bin + os.pathsep + env.get('PATH', '')
+
+        results = [run(path, env) for i in range(runs)]
+
+        retval = dict((key, median([r[key] for r in results])) for key in ('wall', 'cpu', 'rss'))
+        retval['exit'] = results[-1]['exit']
+        retval['syscalls'] = run(path, env, strace)['syscalls'] if strace else results[-1]['syscalls']
+
+        return retval
+
+    finally:
+        services.stop()
+        shutil.rmtree(root)
+
+
+def slope(scales, cpu):
+    # With three or more scales the smallest one is taken as startup cost
+    base = cpu[0] if len(cpu) > 2 else 0
+    if len(scales) < 2 or cpu[-2] - base <= 0 or cpu[-1] - base <= 0:
+        return None
+
+    return math.log((cpu[-1] - base) / (cpu[-2] - base)) / math.log(float(scales[-1]) / scales[-2])
+
+
+if __name__ == '__main__':
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    scales = [int(s) for s in sys.argv[2].split(',')] if len(sys.argv) > 2 else [10, 1000, 10000]
+    pattern = sys.argv[3] if len(sys.argv) > 3 else ''
+
+    strace = _strace()
+    print 'syscalls: %s' % ('strace' if strace else 'read+write from /proc')
+    print '%-26s %7s %4s %9s %9s %9s %9s' % (
+        'plugin', 'scale', 'exit', 'wall ms', 'cpu ms', 'syscalls', 'rss KB')
+
+    for script, setup in PLUGINS:
+        if pattern not in script:
+            continue
+
+        name = os.path.basename(script)[:-3]
+        cpu = []
+
+        for scale in scales:
+            result = bench(script, setup, scale, runs, strace)
+            cpu.append(result['cpu'])
+
+            print '%-26s %7d %4d %9.1f %9.1f %9s %9d' % (
+                name, scale, result['exit'], result['wall'] * 1000, result['cpu'] * 1000,
+                result['syscalls'] if result['syscalls'] is not None else '-', result['rss'])
+
+        growth = slope(scales, cpu)
+        if growth is not None:
+            print '%-26s slope %.2f%s' % ('', growth, '  super-linear' if growth > 1.2 else '')
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+
+"""
+Cold start cost of every plugin in mplugins/: each script runs once as a
+fresh process with MPLUGIN_PROFILE=1, reporting wall time, peak RSS and
+the time spent importing modules. Checks fail fast without their
+services, which still exercises the full startup path.
+
+    python benchmarks/bench_startup.py [runs] [timeout]
+"""
+
+import sys
+import os
+import shutil
+import tempfile
+import subprocess
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from time import time
+
+from __mcodec import loads, dumps
+from __mprofile import PROFILE_ENV, PROFILE_PREFIX
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+
+def plugins():
+    base = os.path.join(ROOT, 'mplugins')
+    for name in sorted(os.listdir(base)):
+        path = os.path.join(base, name)
+        if not os.path.isdir(path):
+            continue
+
+        for script in sorted(os.listdir(path)):
+            if script.endswith('.py'):
+                yield path, script
+
+
+def install(root, path, script, timeout):
+    plugin_id = script[:-3]
+    target = os.path.join(root, plugin_id)
+    os.makedirs(target)
+    shutil.copy(os.path.join(path, script), os.path.join(target, plugin_id))
+
+    config = {}
+    try:
+        config = loads(open(os.path.join(path, 'data.json')).read())
+    except (IOError, ValueError):
+        pass
+
+    config['timeout'] = timeout
+    open(os.path.join(target, 'data.json'), 'w').write(dumps(config))
+
+    return os.path.join(target, plugin_id)
+
+
+def run(script):
+    """
+    @return: (exit code, wall seconds, max rss KB, profile report)
+    """
+    env = dict(os.environ)
+    env[PROFILE_ENV] = '1'
+    env['PYTHONPATH'] = ROOT
+
+    stderr = tempfile.TemporaryFile()
+    with open(os.devnull, 'w') as devnull:
+        start = time()
+        proc = subprocess.Popen([sys.executable, script], cwd=os.path.dirname(script),
+                                env=env, stdout=devnull, stderr=stderr)
+        _, status, rusage = os.wait4(proc.pid, 0)
+        elapsed = time() - start
+
+    proc.returncode = os.WEXITSTATUS(status)
+
+    report = {}
+    stderr.seek(0)
+    for line in stderr:
+        if line.startswith(PROFILE_PREFIX):
+            report = loads(line[len(PROFILE_PREFIX):])
+
+    return proc.returncode, elapsed, rusage.ru_maxrss, report
+
+
+if __name__ == '__main__':
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    timeout = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    root = tempfile.mkdtemp()
+    try:
+        print '%-32s %4s %9s %9s %9s  %s' % (
+            'plugin', 'exit', 'wall ms', 'rss KB', 'import ms', 'slowest import')
+
+        for path, name in plugins():
+            script = install(root, path, name, timeout)
+
+            best = None
+            for i in range(runs):
+                retval = run(script)
+                if best is None or retval[1] < best[1]:
+                    best = retval
+
+            code, elapsed, rss, report = best
+
+            imports = [i for i in report.get('imports', []) if i[1] == 0]
+            slowest = max(imports, key=lambda i: i[2]) if imports else None
+
+            print '%-32s %4d %9.1f %9d %9.1f  %s' % (
+                name[:-3], code, elapsed * 1000, rss, sum(i[2] for i in imports),
+                '%s %.1f ms' % (slowest[0], slowest[2]) if slowest else '-')
+
+    finally:
+        shutil.rmtree(root)
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+
+"""
+Compare counter persistence cost: per plugin .counter.dat and .touch
+files against the shared state store (a row per plugin), for N plugins
+with M counters of which a fraction changes on every run.
+
+A standalone check opens and closes the store on every run, the runner
+keeps it open and commits a tick in one transaction. Prints median and
+min-max of the tick times, the spread between runs is as large as some
+of the differences.
+
+    python benchmarks/bench_state.py [plugins] [counters] [changed] [runs]
+"""
+
+import sys
+import os
+import shutil
+import tempfile
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from time import time
+
+from __mplugin import MPlugin
+import __mstate
+
+
+def make_plugins(root, count):
+    paths = []
+    for i in range(count):
+        path = os.path.join(root, 'plugin%d' % i)
+        os.makedirs(path)
+
+        with open(os.path.join(path, 'data.json'), 'w') as f:
+            f.write('{}')
+        paths.append(path)
+
+    return paths
+
+
+def close_stores():
+    for store in __mstate._stores.values():
+        if store:
+            store.conn.close()
+
+    __mstate._stores.clear()
+
+
+def run(paths, counters, changed, runs, mode):
+    """
+    @return: sorted times of a tick to read and write the state of every
+             plugin, counter arithmetic is not timed
+    """
+    retval = []
+    for n in range(runs):
+        plugins = []
+        for path in paths:
+            plugin = MPlugin(path, embedded=True)
+            if mode == 'files':
+                plugin._store = False
+
+            plugins.append(plugin)
+
+        elapsed = 0
+        for plugin in plugins:
+            start = time()
+            if mode == 'batch':
+                plugin._state_store().batch = True
+
+            plugin._counters = plugin._counters_read()
+            plugin._get_time_interval()
+            elapsed += time() - start
+
+            for i in range(counters):
+                value = n * (i + 1) if i < counters * changed else i
+                plugin.counter(value, 'counter%d' % i)
+
+            start = time()
+            plugin._state_write()
+
+            # Process exit of a standalone check
+            if mode == 'standalone':
+                close_stores()
+
+            elapsed += time() - start
+
+        start = time()
+        if mode == 'batch':
+            __mstate._stores[os.path.dirname(paths[0])].flush()
+
+        elapsed += time() - start
+        retval.append(elapsed)
+
+    close_stores()
+    return sorted(retval)
+
+
+if __name__ == '__main__':
+    plugins = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    counters = int(sys.argv[2]) if len(sys.argv) > 2 else 40
+    changed = float(sys.argv[3]) if len(sys.argv) > 3 else 0.25
+    runs = int(sys.argv[4]) if len(sys.argv) > 4 else 11
+
+    for name, mode in (('files', 'files'),
+                       ('store (standalone)', 'standalone'),
+                       ('store (runner batch)', 'batch')):
+        root = tempfile.mkdtemp()
+        try:
+            paths = make_plugins(root, plugins)
+
+            times = [seconds * 1000 for seconds in run(paths, counters, changed, runs, mode)]
+            median = times[len(times) // 2]
+            print '%-22s %8.1f ms/tick (%.1f-%.1f)  %6.3f ms/plugin' % (
+                name, median, times[0], times[-1], median / plugins)
+
+        finally:
+            shutil.rmtree(root)
@@ -0,0 +1,337 @@
+#!/usr/bin/env python
+
+"""
+Local stand-ins for the services plugins talk to, with payloads scaled
+by one number (rows, nodes, services, counters or workers).
+
+Servers run in daemon threads on ephemeral ports. Fake binaries
+(varnishstat, uwsgi, rabbitmqctl, sudo) are shell wrappers calling this
+module:
+
+    python benchmarks/fakes.py <binary> <scale> [args]
+"""
+
+import os
+import sys
+import stat
+import json
+import threading
+import BaseHTTPServer
+import SocketServer
+
+BINARIES = ('varnishstat', 'uwsgi', 'rabbitmqctl', 'sudo')
+
+
+# Payloads
+def apache_status(scale):
+    scoreboard = ('_W_K.R' * (scale / 6 + 1))[:max(scale, 10)]
+    return (
+        "Total Accesses: %d\nTotal kBytes: %d\nCPULoad: .5\nUptime: 1000\n"
+        "ReqPerSec: 1.5\nBytesPerSec: 100\nBytesPerReq: 10\n"
+        "BusyWorkers: %d\nIdleWorkers: %d\nScoreboard: %s\n" % (
+            scale * 100, scale * 200, scoreboard.count('W'),
+            scoreboard.count('_'), scoreboard)
+    )
+
+
+def nginx_status(scale):
+    return ("Active connections: %d \nserver accepts handled requests\n"
+            " %d %d %d \nReading: 0 Writing: 1 Waiting: 1 \n" % (scale, scale, scale, scale * 2))
+
+
+def phpfpm_status(scale):
+    return json.dumps({
+        'pool': 'www', 'accepted conn': scale, 'active processes': 1,
+        'idle processes': 2, 'max active processes': 3, 'max children reached': 0,
+        'listen queue len': 0, 'max listen queue': 0, 'listen queue': 0, 'slow requests': 0
+    })
+
+
+HAPROXY_FIELDS = (
+    'pxname,svname,qcur,qmax,scur,smax,slim,stot,bin,bout,dreq,dresp,ereq,econ,eresp,'
+    'wretr,wredis,status,weight,act,bck,chkfail,chkdown,lastchg,downtime,qlimit,pid,iid,'
+    'sid,throttle,lbtot,tracked,type,rate,rate_lim,rate_max,check_status,check_code,'
+    'check_duration,hrsp_1xx,hrsp_2xx,hrsp_3xx,hrsp_4xx,hrsp_5xx,hrsp_other,hanafail,'
+    'req_rate,req_rate_max,req_tot,cli_abrt,srv_abrt,comp_in,comp_out,comp_byp,comp_rsp,'
+    'lastsess,last_chk,last_agt,qtime,ctime,rtime,ttime'
+).split(',')
+
+
+def haproxy_csv(scale):
+    lines = ['# ' + ','.join(HAPROXY_FIELDS) + ',']
+    for i in range(scale):
+        row = ['backend%d' % (i / 10), 'server%d' % i]
+        row.extend(str(i * n) for n in range(len(HAPROXY_FIELDS) - 2))
+        row[HAPROXY_FIELDS.index('status')] = 'UP'
+        lines.append(','.join(row) + ',')
+
+    return '\n'.join(lines) + '\n'
+
+
+def elasticsearch_health(scale):
+    return json.dumps({
+        'cluster_name': 'bench', 'status': 'green', 'timed_out': False,
+        'number_of_nodes': scale, 'number_of_data_nodes': scale,
+        'active_primary_shards': scale * 5, 'active_shards': scale * 10,
+        'relocating_shards': 0, 'initializing_shards': 0, 'unassigned_shards': 0
+    })
+
+
+def elasticsearch_nodes(scale):
+    nodes = {}
+    for i in range(scale):
+        nodes['node%08d' % i] = {
+            'name': 'node-%d' % i,
+            'indices': {
+                'docs': {'count': i * 1000, 'deleted': i},
+                'store': {'size_in_bytes': i * 10 ** 6, 'throttle_time_in_millis': 0},
+                'indexing': dict((k, i) for k in (
+                    'index_total', 'index_time_in_millis', 'index_current',
+                    'delete_total', 'delete_time_in_millis', 'delete_current')),
+                'get': dict((k, i) for k in (
+                    'total', 'time_in_millis', 'exists_total', 'missing_total', 'current')),
+                'search': dict((k, i) for k in (
+                    'open_contexts', 'query_total', 'query_time_in_millis', 'query_current',
+                    'fetch_total', 'fetch_time_in_millis', 'fetch_current')),
+            },
+            'jvm': {'mem': {'heap_used_in_bytes': i * 10 ** 6, 'pools': dict(
+                (p, {'used_in_bytes': i, 'max_in_bytes': i * 2}) for p in ('young', 'survivor', 'old'))}},
+            'thread_pool': dict((p, {'threads': 4, 'queue': 0, 'active': 1, 'rejected': 0})
+                                for p in ('bulk', 'get', 'index', 'search', 'refresh', 'flush')),
+        }
+
+    return json.dumps({'cluster_name': 'bench', 'nodes': nodes})
+
+
+def monit_status(scale):
+    services = ['<service type="5"><name>system</name><monitor>1</monitor><system>'
+                '<cpu><user>1.5</user><system>0.5</system><wait>0.1</wait></cpu>'
+                '<memory><percent>40.0</percent></memory><swap><percent>1.0</percent></swap>'
+                '</system></service>']
+    for i in range(scale):
+        services.append(
+            '<service type="3"><name>process%d</name><status>0</status><monitor>1</monitor>'
+            '<memory><percent>1.0</percent></memory><cpu><percent>0.5</percent></cpu>'
+            '<children>2</children></service>' % i)
+
+    return '<?xml version="1.0"?><monit>%s</monit>' % ''.join(services)
+
+
+def kubernetes(path, scale):
+    if path == 'healthz':
+        return 'ok'
+
+    if path == 'api/v1/componentstatuses':
+        return json.dumps({'kind': 'ComponentStatusList', 'items': [
+            {'metadata': {'name': name}, 'conditions': [{'type': 'Healthy', 'status': 'True'}]}
+            for name in ('scheduler', 'controller-manager', 'etcd-0')]})
+
+    items = []
+    for i in range(scale):
+        items.append({
+            'metadata': {'name': 'node-%d' % i, 'labels': {'kubernetes.io/hostname': 'node-%d' % i}},
+            'status': {
+                'capacity': {'cpu': '8', 'memory': '32766Mi', 'pods': '110'},
+                'conditions': [
+                    {'type': t, 'status': 'True' if t == 'Ready' else 'False', 'reason': 'Kubelet' + t}
+                    for t in ('OutOfDisk', 'MemoryPressure', 'DiskPressure', 'Ready')],
+                'images': [{'names': ['registry/image-%d' % j], 'sizeBytes': 10 ** 8} for j in range(10)]
+            }
+        })
+
+    return json.dumps({'kind': 'NodeList', 'items': items})
+
+
+def memcache_stats(scale):
+    names = ['cmd_get', 'cmd_set', 'get_hits', 'get_misses', 'curr_connections',
+             'total_connections', 'bytes', 'curr_items', 'evictions']
+    names.extend('slab_%d' % i for i in range(scale))
+    return ''.join('STAT %s %d\r\n' % (name, i) for i, name in enumerate(names)) + 'END\r\n'
+
+
+def redis_info(scale):
+    lines = ['# Server', 'redis_version:3.0.0', '# Clients', 'connected_clients:10',
+             'blocked_clients:0', '# Stats', 'keyspace_hits:100', 'keyspace_misses:10',
+             'evicted_keys:0', 'instantaneous_ops_per_sec:5', 'used_cpu_sys:1.5',
+             'used_cpu_user:2.5', 'used_memory:1024', 'connected_slaves:0', '# Keyspace']
+    lines.extend('db%d:keys=%d,expires=0,avg_ttl=0' % (i, i) for i in range(scale))
+    return '\r\n'.join(lines) + '\r\n'
+
+
+def varnishstat(scale):
+    retval = {'timestamp': '2016-01-01T00:00:00'}
+    names = ['MAIN.sess_conn', 'MAIN.cache_hit', 'MAIN.cache_miss', 'MAIN.threads']
+    names.extend('MAIN.counter_%d' % i for i in range(scale))
+    for i, name in enumerate(names):
+        retval[name] = {'description': name, 'type': 'MAIN', 'flag': 'c', 'format': 'i', 'value': i}
+
+    return json.dumps(retval)
+
+
+def uwsgi_stats(scale):
+    return json.dumps({
+        'version': '2.0', 'load': 1, 'listen_queue': 0, 'listen_queue_errors': 0,
+        'signal_queue': 0, 'workers': [
+            {'id': i, 'status': 'idle' if i % 2 else 'busy', 'requests': i} for i in range(scale)]
+    })
+
+
+def rabbitmqctl(scale):
+    lines = ['Listing queues ...']
+    lines.extend('queue%d\t%d\t%d\t%d' % (i, i, i % 3, i * 1024) for i in range(scale))
+    return '\n'.join(lines) + '\n'
+
+
+# Servers
+class _HTTPHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def do_GET(self):
+        scale = self.server.scale
+        path, _, query = self.path.partition('?')
+        path = path.strip('/')
+
+        if query == 'auto':
+            body = apache_status(scale)
+        elif query == 'json':
+            body = phpfpm_status(scale)
+        elif query.startswith('format=xml'):
+            body = monit_status(scale)
+        elif path == ';csv;norefresh':
+            body = haproxy_csv(scale)
+        elif path == '_cluster/health':
+            body = elasticsearch_health(scale)
+        elif path == '_nodes/stats':
+            body = elasticsearch_nodes(scale)
+        elif path in ('healthz', 'api/v1/componentstatuses', 'api/v1/nodes'):
+            body = kubernetes(path, scale)
+        else:
+            body = nginx_status(scale)
+
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_POST = do_GET
+
+    def log_message(self, *args):
+        pass
+
+
+class _LineHandler(SocketServer.StreamRequestHandler):
+    def handle(self):
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+
+            reply = self.server.respond(self.rfile, line.strip())
+            if reply is not None:
+                self.wfile.write(reply)
+
+
+class _Server(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _HTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+def _redis_respond(server, rfile, line):
+    # RESP array: *N then $len/arg pairs
+    if not line.startswith('*'):
+        return '-ERR inline commands not supported\r\n'
+
+    args = []
+    for i in range(int(line[1:])):
+        rfile.readline()
+        args.append(rfile.readline().strip())
+
+    command = args[0].upper()
+    if command == 'INFO':
+        body = redis_info(server.scale)
+        return '$%d\r\n%s\r\n' % (len(body), body)
+
+    if command == 'LLEN':
+        return ':%d\r\n' % server.scale
+
+    return '+OK\r\n'
+
+
+def _memcache_respond(server, rfile, line):
+    if line.startswith('stats'):
+        return memcache_stats(server.scale)
+
+    if line == 'version':
+        return 'VERSION 1.4.0\r\n'
+
+    return 'ERROR\r\n'
+
+
+class Services:
+    """
+    Every fake service for one payload scale
+    """
+    def __init__(self, scale, root):
+        self.scale = scale
+        self.root = root
+        self.servers = []
+
+        self.http_port = self._serve(_HTTPServer(('127.0.0.1', 0), _HTTPHandler))
+        self.redis_port = self._serve(_Server(('127.0.0.1', 0), _LineHandler), _redis_respond)
+        self.memcache_port = self._serve(_Server(('127.0.0.1', 0), _LineHandler), _memcache_respond)
+
+        self.bin = os.path.join(root, 'bin')
+        os.makedirs(self.bin)
+        for name in BINARIES:
+            self._binary(name)
+
+    @property
+    def http_url(self):
+        return 'http://127.0.0.1:%d' % self.http_port
+
+    def _serve(self, server, respond=None):
+        server.scale = self.scale
+        if respond:
+            server.respond = lambda rfile, line: respond(server, rfile, line)
+
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+        self.servers.append(server)
+        return server.server_address[1]
+
+    def _binary(self, name):
+        path = os.path.join(self.bin, name)
+        with open(path, 'w') as f:
+            f.write('#!/bin/sh\nexec "%s" "%s" %s %d "$@"\n' % (
+                sys.executable, os.path.abspath(__file__), name, self.scale))
+
+        os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+
+    def stop(self):
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+
+
+def main(name, scale, args):
+    if name == 'sudo':
+        os.execvp(args[0], args)
+
+    if name == 'varnishstat':
+        # Only the JSON interface is faked
+        if '-j' in args:
+            sys.stdout.write(varnishstat(scale))
+
+    elif name == 'uwsgi':
+        sys.stdout.write(uwsgi_stats(scale))
+
+    elif name == 'rabbitmqctl':
+        sys.stdout.write(rabbitmqctl(scale))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1], int(sys.argv[2]), sys.argv[3:])
@@ -7,12 +7,14 @@ sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..', '..', 'plugi
 from __mplugin import MPlugin
 from __mplugin import OK, CRITICAL, TIMEOUT
 
-import socket
-import urllib
+from __mhttp import HTTPRequest
 
 
 class ApacheStatus(MPlugin):
-    def run(self):
+    def http_requests(self):
+        return [self._status_request()]
+
+    def _status_request(self):
         url = self.config.get('url')
 
         if not url:
@@ -22,19 +24,34 @@ class ApacheStatus(MPlugin):
         if not url.endswith('?auto'):
             url = url + '?auto'
 
-        # Set timeout
-        socket.setdefaulttimeout(self.config.get('timeout', TIMEOUT))
+        return HTTPRequest(url, timeout=int(self.config.get('timeout', TIMEOUT)))
+
+    def sample(self):
+        # Gauges only, _parse_status also updates counters
+        response = self.http_fetch(self._status_request())
+        if response.error or response.code != 200:
+            return None
+
+        retval = {}
+        for line in str(response.body).splitlines():
+            key, sep, value = line.partition(': ')
+
+            if key == 'BusyWorkers':
+                retval['busy_workers'] = int(value)
 
+            if key == 'IdleWorkers':
+                retval['idle_workers'] = int(value)
+
+        return retval
+
+    def run(self):
         # Fetch URL
-        try:
-            urlopen = urllib.urlopen(url)
-        except:
-            self.exit(CRITICAL, message="Unable to open URL")
+        response = self.http_fetch(self._status_request())
 
-        if urlopen.getcode() != 200:
+        if response.error or response.code != 200:
             self.exit(CRITICAL, message="Unable to open URL")
 
-        data = self._parse_status(urlopen.readlines())
+        data = self._parse_status(response.body)
 
         metrics = {
             'Apache Workers': {
@@ -1,6 +1,5 @@
 #!/usr/bin/env python
 
-import urllib2
 import json
 
 import sys
@@ -10,18 +9,25 @@ sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..', '..', 'plugi
 from __mplugin import MPlugin
 from __mplugin import OK, CRITICAL
 
+from __mhttp import HTTPRequest
+
+PATHS = ['/_cluster/health', '/_nodes/stats']
+
 
 class ElasticSearchStatus(MPlugin):
+    def http_requests(self):
+        host = self.config.get('hostname', 'http://localhost:9200')
+        return [HTTPRequest('{h}{p}'.format(h=host, p=path)) for path in PATHS]
+
     def call_to_cluster(self, host, path):
         """Call a given path to the cluster and return JSON."""
 
-        try:
-            r = urllib2.urlopen('{h}{p}'.format(h=host, p=path))
-        except (urllib2.URLError, ValueError):
+        r = self.http_fetch(HTTPRequest('{h}{p}'.format(h=host, p=path)))
+        if r.error or r.code >= 400:
             self.exit(CRITICAL, message='error opening url')
 
         try:
-            response = json.loads(r.read())
+            response = json.loads(r.body)
         except Exception:
             self.exit(CRITICAL, message='error loading json')
 
@@ -14,14 +14,16 @@ from collections import defaultdict
 import re
 import time
 
-# 3rd party
-import requests
+from __mhttp import HTTPRequest
 
 STATS_URL = "/;csv;norefresh"
 
 class HAproxyStatus(MPlugin):
 
-    def get_stats(self):
+    def http_requests(self):
+        return [self._stats_request()]
+
+    def _stats_request(self):
         url = self.config.get('url', None)
         if not url:
             self.exit(CRITICAL, message="Please provide haproxy status url")
@@ -35,14 +37,18 @@ class HAproxyStatus(MPlugin):
         auth = (username, password)
         url = "%s%s" % (url, STATS_URL)
 
-        r = requests.get(url, auth=auth)
+        return HTTPRequest(url, auth=auth)
+
+    def get_stats(self):
+        r = self.http_fetch(self._stats_request())
+
+        if r.error:
+            self.exit(CRITICAL, message=r.error)
 
-        try:
-            r.raise_for_status()
-        except Exception as e:
-            self.exit(CRITICAL, message=str(e))
+        if r.code >= 400:
+            self.exit(CRITICAL, message="%s Error: %s for url: %s" % (r.code, r.reason, r.url))
 
-        data = r.content.splitlines()
+        data = r.body.splitlines()
 
         fields = [f.strip() for f in data[0][2:].split(',') if f]
 
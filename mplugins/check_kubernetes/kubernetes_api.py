@@ -9,7 +9,9 @@ sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..', '..', 'plugi
 from __mplugin import MPlugin
 from __mplugin import OK, CRITICAL, TIMEOUT
 
-import requests
+from __mhttp import HTTPRequest
+
+ENDPOINTS = ["healthz", "/api/v1/componentstatuses", "/api/v1/nodes"]
 
 NODE_CONDITIONS_MAP = {
     "OutOfDisk": {
@@ -31,6 +33,9 @@ NODE_CONDITIONS_MAP = {
 }
 
 class CheckKubernetesAPI(MPlugin):
+    def http_requests(self):
+        return [self._request(endpoint) for endpoint in ENDPOINTS]
+
     def run(self):
         self.kube_api = self.config.get('url')
         self.data = {}
@@ -42,7 +47,7 @@ class CheckKubernetesAPI(MPlugin):
             # check kubernetes api health_status
             result = self._send_request("healthz", as_json=False)
 
-            if not result.content == 'ok':
+            if not result.body == 'ok':
                 self.status = CRITICAL
                 self.message += 'health_status: Critical'
 
@@ -123,8 +128,14 @@ class CheckKubernetesAPI(MPlugin):
                                                             condition_type,
                                                             condition['reason'])
 
+    def _request(self, endpoint):
+        return HTTPRequest("{}/{}".format(self.config.get('url'), endpoint))
+
     def _send_request(self, endpoint, as_json=True):
-        result = requests.get("{}/{}".format(self.kube_api, endpoint))
+        result = self.http_fetch(self._request(endpoint))
+        if result.error:
+            raise Exception(result.error)
+
         return result.json() if as_json else result
 
 if __name__ == '__main__':
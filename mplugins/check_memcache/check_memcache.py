@@ -4,16 +4,12 @@ import sys
 import os
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..', '..', 'plugins'))
 
-from __mplugin import MPlugin
+from __mplugin import MPlugin, lazy_import
 from __mplugin import OK, CRITICAL, TIMEOUT
 
 
 # pip install python-memcached
-import_error = False
-try:
-    import memcache
-except:
-    import_error = True
+memcache = lazy_import('memcache')
 
 
 class MemcacheStatus(MPlugin):
@@ -22,7 +18,7 @@ class MemcacheStatus(MPlugin):
         host = self.config.get('host')
         port = self.config.get('port')
 
-        if import_error:
+        if not memcache.available():
             self.exit(CRITICAL, message="Please install python-memcached")
 
         memcache_client = memcache.Client(['%s:%s' %(host, port)])
@@ -4,17 +4,13 @@ import sys
 import os
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..', '..', 'plugins'))
 
-from __mplugin import MPlugin
+from __mplugin import MPlugin, lazy_import
 from __mplugin import OK, CRITICAL, TIMEOUT
 
 
 # pip install pymongo
-import_error = False
-try:
-    from pymongo import MongoClient as Client
-    from pymongo.errors import ConnectionFailure, AutoReconnect
-except:
-    import_error = True
+pymongo = lazy_import('pymongo')
+pymongo_errors = lazy_import('pymongo.errors')
 
 
 class MongoDBStatus(MPlugin):
@@ -26,41 +22,54 @@ class MongoDBStatus(MPlugin):
         password = self.config.get('password', None)
 
         try:
-            if username and password and database:
-                uri = "mongodb://{}:{}@{}:{}/{}".format(username,
-                                                        password,
-                                                        host,
-                                                        port,
-                                                        database)
-                cli = Client(uri)
-                check_db = cli[database]
-                check_db.authenticate(username, password)
-                return check_db.command("serverStatus")
-
-            elif username and password:
-                uri = "mongodb://{}:{}@{}:{}".format(username,
-                                                     password,
-                                                     host,
-                                                     port)
-                cli = Client(uri)
-                return cli.test.command("serverStatus")
-
-            elif database:
-                uri = "mongodb://{}:{}/{}".format(host,
-                                                  port,
-                                                  database)
-                cli = Client(uri)
-                check_db = cli[database]
-                return check_db.command("serverStatus")
-            else:
-                cli = Client(host, port)
-                return cli.test.command("serverStatus")
-
-        except (ConnectionFailure, AutoReconnect):
+            # Same serverStatus is shared by checks on this server in a runner
+            return self.fetch_cached(
+                ('mongodb', host, port, username, database, 'serverStatus'),
+                lambda: self._server_status(host, port, database, username, password),
+                credentials=(username, password))
+
+        except (pymongo_errors.ConnectionFailure, pymongo_errors.AutoReconnect):
             self.exit(CRITICAL, message="unable to connect to mongodb")
 
+    def source_key(self):
+        return 'mongodb', self.config.get('hostname', 'localhost'), int(self.config.get('port', '27017'))
+
+    def _server_status(self, host, port, database, username, password):
+        # Client is kept between runs in a runner, it reconnects by itself
+        with self.db_connection(('mongodb', host, port, username, database),
+                                lambda: self._client(host, port, database, username, password),
+                                credentials=(username, password)) as cli:
+            return cli[database or 'test'].command("serverStatus")
+
+    @staticmethod
+    def _client(host, port, database, username, password):
+        if username and password and database:
+            uri = "mongodb://{}:{}@{}:{}/{}".format(username,
+                                                    password,
+                                                    host,
+                                                    port,
+                                                    database)
+            cli = pymongo.MongoClient(uri)
+            cli[database].authenticate(username, password)
+            return cli
+
+        elif username and password:
+            uri = "mongodb://{}:{}@{}:{}".format(username,
+                                                 password,
+                                                 host,
+                                                 port)
+            return pymongo.MongoClient(uri)
+
+        elif database:
+            uri = "mongodb://{}:{}/{}".format(host,
+                                              port,
+                                              database)
+            return pymongo.MongoClient(uri)
+        else:
+            return pymongo.MongoClient(host, port)
+
     def run(self):
-        if import_error:
+        if not pymongo.available():
             self.exit(CRITICAL, message="Please install pymongo")
 
         s = self.get_stats()
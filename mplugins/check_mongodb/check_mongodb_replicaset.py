@@ -4,7 +4,7 @@ import sys
 import os
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..', '..', 'plugins'))
 
-from __mplugin import MPlugin
+from __mplugin import MPlugin, lazy_import
 from __mplugin import OK, CRITICAL, TIMEOUT
 
 # Replication states
@@ -28,12 +28,8 @@ REPLSET_MEMBER_STATES = {
 
 
 # pip install pymongo
-import_error = False
-try:
-    from pymongo import MongoClient as Client
-    from pymongo.errors import ConnectionFailure, AutoReconnect
-except:
-    import_error = True
+pymongo = lazy_import('pymongo')
+pymongo_errors = lazy_import('pymongo.errors')
 
 
 class MongoDBReplicaSetStatus(MPlugin):
@@ -44,24 +40,39 @@ class MongoDBReplicaSetStatus(MPlugin):
         password = self.config.get('password', None)
 
         try:
-            if username and password:
-                uri = "mongodb://{}:{}@{}:{}".format(username,
-                                                     password,
-                                                     host,
-                                                     port)
-                cli = Client(uri)
-                admin_db = cli['admin']
-                admin_db.authenticate(username, password)
-                return admin_db.command("replSetGetStatus")
-
-            else:
-                cli = Client(host, port)
-                admin_db = cli['admin']
-                return admin_db.command("replSetGetStatus")
-
-        except (ConnectionFailure, AutoReconnect):
+            # Same status is shared by checks on this server in a runner
+            return self.fetch_cached(
+                ('mongodb', host, port, username, 'admin', 'replSetGetStatus'),
+                lambda: self._replset_status(host, port, username, password),
+                credentials=(username, password))
+
+        except (pymongo_errors.ConnectionFailure, pymongo_errors.AutoReconnect):
             self.exit(CRITICAL, message="unable to connect to mongodb")
 
+    def source_key(self):
+        return 'mongodb', self.config.get('hostname', 'localhost'), int(self.config.get('port', '27017'))
+
+    def _replset_status(self, host, port, username, password):
+        # Client is kept between runs in a runner, it reconnects by itself
+        with self.db_connection(('mongodb', host, port, username, 'admin'),
+                                lambda: self._client(host, port, username, password),
+                                credentials=(username, password)) as cli:
+            return cli['admin'].command("replSetGetStatus")
+
+    @staticmethod
+    def _client(host, port, username, password):
+        if username and password:
+            uri = "mongodb://{}:{}@{}:{}".format(username,
+                                                 password,
+                                                 host,
+                                                 port)
+            cli = pymongo.MongoClient(uri)
+            cli['admin'].authenticate(username, password)
+            return cli
+
+        else:
+            return pymongo.MongoClient(host, port)
+
     def get_state_name(self, state):
         if state in self.REPLSET_MEMBER_STATES:
             return self.REPLSET_MEMBER_STATES[state][0]
@@ -69,7 +80,7 @@ class MongoDBReplicaSetStatus(MPlugin):
             return 'UNKNOWN'
 
     def run(self):
-        if import_error:
+        if not pymongo.available():
             self.exit(CRITICAL, message="Please install pymongo")
 
         replSet = self.get_stats()
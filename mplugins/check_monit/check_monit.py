@@ -6,9 +6,6 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
-import urllib2
-import base64
-
 import sys
 import os
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..', '..', 'plugins'))
@@ -16,17 +13,25 @@ sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..', '..', 'plugi
 from __mplugin import MPlugin
 from __mplugin import OK, CRITICAL
 
+from __mhttp import HTTPRequest
+
 MIN_METRICS = 3
 
 
 class Monit(MPlugin):
-    def run(self):
+    def http_requests(self):
+        return [self._status_request()]
+
+    def _status_request(self):
         username = self.config.get('username', '')
         password = self.config.get('password', '')
         port = self.config.get('port')
 
+        return MonitConn.request(username=username, password=password, port=port)
+
+    def run(self):
         try:
-            mons = MonitConn(username=username, password=password, port=port)
+            mons = MonitConn(self.http_fetch(self._status_request()))
         except Exception as e:
             self.exit(CRITICAL, message=e.message)
 
@@ -83,31 +88,31 @@ class Monit(MPlugin):
 
 
 class MonitConn(dict):
-    def __init__(self, host='localhost', port=2812, username=None, password='', https=False):
+    @staticmethod
+    def request(host='localhost', port=2812, username=None, password='', https=False):
 
         if not port:
             port = 2812
 
         port = int(port)
-        self.baseurl = (https and 'https://%s:%i' or 'http://%s:%i') % (host, port)
-        url = self.baseurl + '/_status?format=xml'
+        baseurl = (https and 'https://%s:%i' or 'http://%s:%i') % (host, port)
+        url = baseurl + '/_status?format=xml'
 
-        req = urllib2.Request(url)
+        auth = None
 
         if username:
-            base64string = base64.encodestring('%s:%s' % (username, password))[:-1]
-            authheader = "Basic %s" % base64string
-            req.add_header("Authorization", authheader)
+            auth = (username, password)
 
-        try:
-            handle = urllib2.urlopen(req)
-        except urllib2.URLError as e:
-            raise Exception(e.reason)
+        return HTTPRequest(url, auth=auth)
 
-        try:
-            response = handle.read()
-        except:
-            raise Exception("Error while reading")
+    def __init__(self, handle):
+        if handle.error:
+            raise Exception(handle.error)
+
+        if handle.code >= 400:
+            raise Exception(handle.reason)
+
+        response = handle.body
 
         try:
             from xml.etree.ElementTree import XML
@@ -171,7 +176,7 @@ class MonitConn(dict):
         def _xmlfind(self, key, kind= 'text'):
             retval = ''
             try:
-                retval = self.xml.find(kind).text
+                retval = self.xml.find(key).text
                 if kind == 'float':
                     retval = float(retval)
 
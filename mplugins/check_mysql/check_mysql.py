@@ -4,45 +4,54 @@ import sys
 import os
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..', '..', 'plugins'))
 
-from __mplugin import MPlugin
+from __mplugin import MPlugin, lazy_import
 from __mplugin import OK, CRITICAL, TIMEOUT
 
-import_error = False
-try:
-    import MySQLdb as Database
-except:
-    import_error = True
+Database = lazy_import('MySQLdb')
 
 class MySQLStatus(MPlugin):
-    def get_stats(self):
+    def get_stats(self, query='SHOW GLOBAL STATUS;'):
         host = self.config.get('host')
         port = self.config.get('port', 3306)
         user = self.config.get('user')
         password = self.config.get('password')
 
-        if import_error:
+        if not Database.available():
             self.exit(CRITICAL, message="Please install python-mysqldb or MySQL-python")
 
-        try:
-            conn = Database.connect(
-                host=host,
-                port=int(port),
-                user=user,
-                passwd=password,
-                connect_timeout=10
-                )
-        except:
-            self.exit(CRITICAL, message="Unable to connect to MySQL Database")
+        connect = lambda: Database.connect(
+            host=host,
+            port=int(port),
+            user=user,
+            passwd=password,
+            connect_timeout=10
+            )
 
+        # Kept open between runs in a runner, checked with ping()
         try:
-            conn_cursor = conn.cursor(Database.cursors.DictCursor)
-            conn_cursor.execute('SHOW GLOBAL STATUS;')
-            result = conn_cursor.fetchall()
-        except:
-            self.exit(CRITICAL, message="Unable to run SHOW GLOBAL STATUS")
+            with self.db_connection(('mysql', host, int(port), user, None), connect,
+                                    validate=lambda conn: conn.ping(),
+                                    credentials=(user, password)) as conn:
+                try:
+                    conn_cursor = conn.cursor(Database.cursors.DictCursor)
+                    conn_cursor.execute(query)
+                    result = conn_cursor.fetchall()
+                    conn_cursor.close()
+                except:
+                    self.exit(CRITICAL, message="Unable to run SHOW GLOBAL STATUS")
+
+        except Exception:
+            self.exit(CRITICAL, message="Unable to connect to MySQL Database")
 
         return dict(map(lambda x: (x.get('Variable_name'), x.get('Value')), result))
 
+    def sample(self):
+        data = self.get_stats("SHOW GLOBAL STATUS LIKE 'Threads_%';")
+        return {
+            'Threads_running': int(data.get('Threads_running', 0)),
+            'Threads_connected': int(data.get('Threads_connected', 0))
+        }
+
     def run(self):
         data = self.get_stats()
 
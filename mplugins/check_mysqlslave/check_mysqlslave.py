@@ -4,40 +4,43 @@ import sys
 import os
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..', '..', 'plugins'))
 
-from __mplugin import MPlugin
+from __mplugin import MPlugin, lazy_import
 from __mplugin import OK, CRITICAL
 
-import_error = False
-try:
-    import MySQLdb as Database
-except:
-    import_error = True
+Database = lazy_import('MySQLdb')
 
 
 class CheckMySQLSlave(MPlugin):
     def mysql_repchk(self, host, port, user, password):
 
+        connect = lambda: Database.connect(
+            host=host,
+            port=int(port),
+            user=user,
+            passwd=password,
+            connect_timeout=10
+            )
+
+        # Kept open between runs in a runner, checked with ping()
         try:
-            conn = Database.connect(
-                host=host,
-                port=int(port),
-                user=user,
-                passwd=password,
-                connect_timeout=10
-                )
-        except:
+            with self.db_connection(('mysql', host, int(port), user, None), connect,
+                                    validate=lambda conn: conn.ping(),
+                                    credentials=(user, password)) as conn:
+                try:
+                    conn_cursor = conn.cursor(Database.cursors.DictCursor)
+                    conn_cursor.execute('SHOW SLAVE STATUS;')
+                    result = conn_cursor.fetchall()
+                    conn_cursor.close()
+                except:
+                    self.exit(CRITICAL, message="Unable to run SHOW SLAVE STATUS")
+
+        except Exception:
             self.exit(CRITICAL, message="Unable to connect to MySQL Database")
-        try:
-            conn_cursor = conn.cursor(Database.cursors.DictCursor)
-            conn_cursor.execute('SHOW SLAVE STATUS;')
-            result = conn_cursor.fetchall()
-        except:
-            self.exit(CRITICAL, message="Unable to run SHOW SLAVE STATUS")
 
         return result[0]
 
     def run(self):
-        if import_error:
+        if not Database.available():
             self.exit(CRITICAL, message="Please install python-mysqldb or MySQL-python")
 
         host = self.config.get('host')
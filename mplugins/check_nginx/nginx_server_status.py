@@ -7,29 +7,41 @@ sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..', '..', 'plugi
 from __mplugin import MPlugin
 from __mplugin import OK, CRITICAL, TIMEOUT
 
-import socket, urllib, re
+import re
+
+from __mhttp import HTTPRequest
 
 class NginxStatus(MPlugin):
-    def run(self):
+    def http_requests(self):
+        return [self._status_request()]
+
+    def _status_request(self):
         url = self.config.get('url')
         if not url:
            self.exit(CRITICAL, message="Please specify URL")
 
+        timeout = self.config.get('timeout', TIMEOUT)
+        return HTTPRequest(url, timeout=int(timeout))
+
+    def sample(self):
+        response = self.http_fetch(self._status_request())
+        if response.error or response.code != 200:
+            return None
+
+        data = self._get_data(response.body)
+        return dict((idx, data[idx]) for idx in ('connections', 'reading', 'writing', 'waiting'))
+
+    def run(self):
         # Fetch URL
-        url_open = None
-        try:
-            url_open = urllib.urlopen(url)
-        except:
+        response = self.http_fetch(self._status_request())
+
+        if response.error:
             self.exit(CRITICAL, message="Unable to open URL")
 
-        if not url_open or url_open.getcode() != 200:
+        if response.code != 200:
             self.exit(CRITICAL, message="Can not reach URL")
 
-        # Set timeout
-        timeout = self.config.get('timeout', TIMEOUT)
-        socket.setdefaulttimeout(int(timeout))
-
-        data = self._get_data(url_open)
+        data = self._get_data(response.body)
 
         counter_data = [
             'accepted',
@@ -80,9 +92,7 @@ class NginxStatus(MPlugin):
         }
         self.exit(OK, data, metrics)
 
-    def _get_data(self, url):
-        data = url
-        data = data.read()
+    def _get_data(self, data):
         result = {}
         match1 = re.search(r'Active connections:\s+(\d+)', data)
         match2 = re.search(r'\s*(\d+)\s+(\d+)\s+(\d+)', data)
@@ -1,6 +1,6 @@
 #!/usr/bin/env python
 
-import socket, urllib, re
+import re
 
 import sys
 import os
@@ -9,10 +9,15 @@ sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..', '..', 'plugi
 from __mplugin import MPlugin
 from __mplugin import OK, CRITICAL
 
+from __mhttp import HTTPRequest
+
 
 class PhPFPMStatus(MPlugin):
     
-    def get_stats(self):
+    def http_requests(self):
+        return [self._status_request()]
+
+    def _status_request(self):
 
         url = self.config.get('url')
 
@@ -25,18 +30,28 @@ class PhPFPMStatus(MPlugin):
         if not re.search("\?json$", url):
             url = url + '?json'
 
-        try:
-            urlopen = urllib.urlopen(url)
-        except:
+        return HTTPRequest(url)
+
+    def get_stats(self):
+        response = self.http_fetch(self._status_request())
+
+        if response.error:
             self.exit(CRITICAL, message="Invalid URL")
 
-        data = self._from_json(urlopen.read())
+        data = self._from_json(response.body)
 
         if not data:
             self.exit(CRITICAL, message="Unable to parse statistics")
 
         return data
 
+    def sample(self):
+        data = self.get_stats()
+        return {
+            'listen queue': data.get('listen queue'),
+            'active processes': data.get('active processes')
+        }
+
     def run(self):
         data = self.get_stats()
 
@@ -4,14 +4,10 @@ import sys
 import os
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..', '..', 'plugins'))
 
-from __mplugin import MPlugin
+from __mplugin import MPlugin, lazy_import
 from __mplugin import OK, CRITICAL, TIMEOUT
 
-import_error = False
-try:
-    import psycopg2 as pg
-except:
-    import_error = True
+pg = lazy_import('psycopg2')
 
 class PostGresCheck(MPlugin):
     DB_METRICS = {
@@ -183,8 +179,14 @@ SELECT relname,
 
         return connection
 
+    @staticmethod
+    def _check_connection(db):
+        cursor = db.cursor()
+        cursor.execute('SELECT 1;')
+        cursor.close()
+
     def run(self):
-        if import_error:
+        if not pg.available():
             self.exit(CRITICAL, message="psycopg2 library cannot be imported.")
 
         host = self.config.get('host', '')
@@ -202,14 +204,17 @@ SELECT relname,
         #     relations = relations.split(',')
 
         key = '%s:%s:%s' % (host, port, dbname)
-        db = self.get_connection(host, port, user, password, dbname)
-
-        version = self._get_version(db)
+        # Kept open between runs in a runner, checked with SELECT 1
+        with self.db_connection(('postgres', host, port, user, dbname),
+                                lambda: self.get_connection(host, port, user, password, dbname),
+                                validate=self._check_connection,
+                                credentials=(user, password)) as db:
+            version = self._get_version(db)
 
-        try:
-            self._collect_stats(db, relations)
-        except Exception:
-            self.exit(CRITICAL, message="failed to obtain metrics")
+            try:
+                self._collect_stats(db, relations)
+            except Exception:
+                self.exit(CRITICAL, message="failed to obtain metrics")
 
         counter_data = [
             'commits',
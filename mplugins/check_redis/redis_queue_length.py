@@ -4,20 +4,16 @@ import sys
 import os
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..', '..', 'plugins'))
 
-from __mplugin import MPlugin
+from __mplugin import MPlugin, lazy_import
 from __mplugin import OK, CRITICAL, TIMEOUT
 
-redis_py_error = False
-try:
-    import redis
-except:
-    redis_py_error = True
+redis = lazy_import('redis')
 
 class RedisQueueLength(MPlugin):
 
     def get_stats(self):
 
-        if redis_py_error:
+        if not redis.available():
             self.exit(CRITICAL, message="please install redis python library (pip install redis)")
 
         hostname = self.config.get('hostname', 'localhost')
@@ -25,17 +21,15 @@ class RedisQueueLength(MPlugin):
         password = self.config.get('password', '')
         queue_name = self.config.get('queue_name')
 
-        r = None
-
-        try:
-            r = redis.Redis(host=hostname, port=int(port), db=0, password=password)
-        except:
-            self.exit(CRITICAL, message="could not connect to redis")
-
         queue_length = None
 
         try:
-            queue_length = r.llen(queue_name)
+            # Client is kept between runs in a runner, it reconnects by itself
+            with self.db_connection(('redis', hostname, int(port), None, 0),
+                                    lambda: redis.Redis(host=hostname, port=int(port), db=0, password=password),
+                                    close=lambda r: r.connection_pool.disconnect(),
+                                    credentials=(password,)) as r:
+                queue_length = r.llen(queue_name)
         except:
             self.exit(CRITICAL, message="can not obtain queue length")
 
@@ -44,6 +38,9 @@ class RedisQueueLength(MPlugin):
 
         return {'length': queue_length}
 
+    def source_key(self):
+        return 'redis', self.config.get('hostname', 'localhost'), self.config.get('port', '6379')
+
     def run(self):
         data = self.get_stats()
 
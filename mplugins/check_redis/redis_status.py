@@ -4,37 +4,30 @@ import sys
 import os
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..', '..', 'plugins'))
 
-from __mplugin import MPlugin
+from __mplugin import MPlugin, lazy_import
 from __mplugin import OK, CRITICAL, TIMEOUT
 
-redis_py_error = False
-try:
-    import redis
-except:
-    redis_py_error = True
+redis = lazy_import('redis')
 
 class CheckRedis(MPlugin):
 
     def get_stats(self):
 
-        if redis_py_error:
+        if not redis.available():
             self.exit(CRITICAL, message="please install redis python library (pip install redis)")
 
         hostname = self.config.get('hostname', 'localhost')
         port = self.config.get('port', '6379')
         password = self.config.get('password', '')
 
-        r = None
-
-        try:
-            r = redis.Redis(host=hostname, port=int(port), db=0, password=password)
-        except:
-            self.exit(CRITICAL, message="could not connect to redis")
-
         redis_info = None
 
         try:
-            redis_info = r.info()
+            # Same INFO is shared by checks on this server in a runner
+            redis_info = self.fetch_cached(
+                ('redis', hostname, port, 'info'),
+                lambda: self._info(hostname, port, password),
+                credentials=(password,))
         except:
             self.exit(CRITICAL, message="can not obtain info")
 
@@ -44,6 +37,17 @@ class CheckRedis(MPlugin):
 
         return redis_info
 
+    def _info(self, hostname, port, password):
+        # Client is kept between runs in a runner, it reconnects by itself
+        with self.db_connection(('redis', hostname, int(port), None, 0),
+                                lambda: redis.Redis(host=hostname, port=int(port), db=0, password=password),
+                                close=lambda r: r.connection_pool.disconnect(),
+                                credentials=(password,)) as r:
+            return r.info()
+
+    def source_key(self):
+        return 'redis', self.config.get('hostname', 'localhost'), self.config.get('port', '6379')
+
     def run(self):
         stat = self.get_stats()
 
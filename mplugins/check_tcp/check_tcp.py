@@ -18,9 +18,7 @@ class CheckTCP(MPlugin):
         if not host or not port:
             self.exit(CRITICAL, message="Invalid configuration")
 
-        # Set timeout
         timeout = self.config.get('timeout', TIMEOUT)
-        socket.setdefaulttimeout(int(timeout))
 
         #create an AF_INET, STREAM socket (TCP)
         try:
@@ -28,6 +26,10 @@ class CheckTCP(MPlugin):
         except socket.error, msg:
             self.exit(CRITICAL, message="Failed to create socket: " + msg[1])
 
+        # Set timeout on our socket only, a process wide default would
+        # apply to every check of a runner
+        s.settimeout(int(timeout))
+
         # Resolve
         try:
             remote_ip = socket.gethostbyname(host)
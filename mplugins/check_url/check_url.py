@@ -8,14 +8,16 @@ from __mplugin import MPlugin
 from __mplugin import OK, WARNING, CRITICAL, UNKNOWN, TIMEOUT
 
 import urllib
-import urllib2
-import socket
 import json
-from time import time
+
+from __mhttp import HTTPRequest
 
 
 class CheckURL(MPlugin):
-    def run(self):
+    def http_requests(self):
+        return [self._url_request()]
+
+    def _url_request(self):
         url = self.config.get('url')
         method = self.config.get('method')
         headers_raw = self.config.get('headers')
@@ -42,59 +44,44 @@ class CheckURL(MPlugin):
                     data[key.strip()] = value.strip()
 
         # Set timeout
-        timeout = self.config.get('timeout', TIMEOUT)
-        socket.setdefaulttimeout(int(timeout))
-
-        start_time = time()
+        timeout = int(self.config.get('timeout', TIMEOUT))
 
         if method == 'POST':
             if not data:
                 self.exit(CRITICAL, message="Unable to parse data to POST")
 
-            try:
-                if headers:
-                    content_type = headers.get("Content-Type", None)
-                    if content_type == 'application/json':
-                        req = urllib2.Request(url, json.dumps(data), headers)
-                    else:
-                        req = urllib2.Request(url, urllib.urlencode(data), headers)
-                else:
-                    req = urllib2.Request(url, urllib.urlencode(data))
+            content_type = headers.get("Content-Type", None)
+            if content_type == 'application/json':
+                body = json.dumps(data)
+            else:
+                body = urllib.urlencode(data)
+                headers.setdefault("Content-Type", "application/x-www-form-urlencoded")
 
-            except:
-                self.exit(CRITICAL, message="Unable to request URL")
+            return HTTPRequest(url, 'POST', headers, body, timeout=timeout)
 
-        else:
-            if headers:
-                try:
-                    req = urllib2.Request(url, headers=headers)
-                except:
-                    self.exit(CRITICAL, message="Unable to request URL")
-            else:
-                req = url
+        return HTTPRequest(url, headers=headers, timeout=timeout)
+
+    def run(self):
+        response = self.http_fetch(self._url_request())
 
-        try:
-            urlopen = urllib2.urlopen(req)
-        except urllib2.HTTPError as err:
-            self.exit(WARNING, message="%s: %s" % (err.code, err.msg))
-        except Exception:
+        if response.error:
             self.exit(CRITICAL, message="Unable to open URL")
 
-        end_time = time()
-        mytime = "%.2f" %(end_time - start_time)
+        if response.code >= 400:
+            self.exit(WARNING, message="%s: %s" % (response.code, response.reason))
+
+        mytime = "%.2f" % response.elapsed
 
-        headers = urlopen.info()
-        content = ''.join(urlopen.readlines())
-        code = urlopen.getcode()
+        headers = response.headers
+        content = response.body
+        code = response.code
 
         size = 0
         if "content-length" in headers:
-            size = int(headers["Content-Length"])
+            size = int(headers["content-length"])
         else:
             size = len(content)
 
-        urlopen.close()
-
         data = {
             'content': content,
             'code': code,